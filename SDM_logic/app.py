@@ -1,69 +1,41 @@
+# First, so the startup report includes the imports below
+from startup import IMPORTED_AT, StartupReport
 from command_manager import CommandManager
-from change_detection import detect_new_object, capture_reference_frame
-from vision import get_trash_classification
+from capture_archive import default_archive
+from change_detection import default_detector
+from component_supervisor import (CameraComponent, ClassifierComponent,
+                                  ComponentSupervisor, SerialLinkComponent)
+from event_store import default_store, make_event
+from live_channel import FramePublisher, LiveChannel, channel_name
+from metrics import (CYCLE_SECONDS, FALSE_TRIGGERS, ITEMS_DROPPED, ITEMS_SORTED,
+                     STAGE_SECONDS, default_registry, start_metrics_server,
+                     unit_collector)
+from pipeline import ItemPipeline, classify_locally
+from profiling import start_profiling_control
+from tuning import apply_detection, apply_mechanism, load_profile
+from unit_registry import DEFAULT_BIN_CODE, DEFAULT_LOCATION
+from vision import reset_client, warm_up
+import asyncio
 import json
 import time
-import sys
 import os
 
+# Pipeline stages timed for the metrics: (stage, start, end) item timestamps
+ITEM_STAGES = (
+    ('classify', 'detected_at', 'classified_at'),
+    ('dispatch', 'classified_at', 'dispatched_at'),  # Throughput mode only
+    ('actuate', 'classified_at', 'actuated_at'),
+    ('record', 'actuated_at', 'recorded_at'),
+)
 
-def restart_program():
-    """Restart the entire program"""
-    print("\nRestarting system...")
-    time.sleep(2)  # Wait before restart
-    python = sys.executable
-    os.execl(python, python, *sys.argv)
 
-
-def update_database(result_data):
-    """Update data_base.txt with latest detection at the top"""
+def update_database(result_data, sensor_data=None, bin_code=DEFAULT_BIN_CODE,
+                    location=DEFAULT_LOCATION, capture_hash=None):
+    """Append the latest detection to the event store"""
     try:
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Get current sensor values from command manager
-        cmd = CommandManager()
-        sensor_data = cmd.get_sensor_data()
-
-        # Use sensor data if available, otherwise use defaults
-        if sensor_data and len(sensor_data) == 4:
-            br_value = str(sensor_data[0])
-            bnr_value = str(sensor_data[1])
-            nbr_value = str(sensor_data[2])
-            nbnr_value = str(sensor_data[3])
-        else:
-            br_value = '00'
-            bnr_value = '00'
-            nbr_value = '00'
-            nbnr_value = '00'
-
-        # Read existing content
-        existing_lines = []
-        if os.path.exists('data_base.txt') and os.path.getsize('data_base.txt') > 0:
-            with open('data_base.txt', 'r') as f:
-                existing_lines = f.readlines()
-
-        # Create new data entry with updated sensor values
-        new_data = (
-            f"Dustbin Code: BIN001, "
-            f"Dustbin Location: New Student Activity Center (New SAC), "
-            f"BR: {br_value}, "
-            f"BNR: {bnr_value}, "
-            f"NBR: {nbr_value}, "
-            f"NBNR: {nbnr_value}, "
-            f"Last used: {timestamp}, "
-            f"Recyclable tips: {result_data.get(
-                'Recyclable tips', 'No recycling information available')}, "
-            f"Bio degradable facts: {result_data.get(
-                'Bio degradable facts', 'No biodegradable information available')}, "
-            f"Item: {result_data.get('Item', 'Unknown')}, "
-            f"Category: {result_data.get('Category', 'Unknown')}\n"
-        )
-
-        # Write new data at the top, followed by existing content
-        with open('data_base.txt', 'w') as f:
-            f.write(new_data)
-            f.writelines(existing_lines)
-
+        # Missing sensor data is stored as NULL levels
+        default_store.record(make_event(bin_code, location, sensor_data, result_data,
+                                        capture_hash=capture_hash))
         print(f"Database updated - Item: {result_data.get('Item', 'Unknown')}, Type: {
               result_data.get('Category', 'Unknown')}")
 
@@ -92,99 +64,246 @@ def clean_json_string(raw_string):
     return cleaned
 
 
-def main():
-    max_retries = 3
-    retry_count = 0
+def parse_classification(result):
+    """Parse the classifier reply into a dict, or None if it is not valid JSON"""
+    print("Raw result:", result)
+    print("Result type:", type(result))
+
+    try:
+        # Clean the JSON string before parsing
+        cleaned_result = clean_json_string(result)
+        result_data = json.loads(cleaned_result)
+        print("Parsed data:", result_data)
+        return result_data
+
+    except json.JSONDecodeError as e:
+        print(f"JSON parsing error: {e}")
+        print(f"Failed to parse: {result}")
+        return None
+
+
+def actuate_item(cmd, result_data):
+    """Compress a classified item and route it into its bin; returns the bin levels"""
+    print(f"\nDetected: {result_data['Item']}")
+    print(f"Classification: {result_data['Category']}")
+
+    # Get bin code from category
+    category_code = get_bin_code(result_data['Category'])
+
+    print("Starting compression...")
+    cmd.run_stepper()
+
+    # Open appropriate bin
+    if category_code == "BR":
+        print("Directing trash to BR bin")
+        cmd.open_br()
+    elif category_code == "BNR":
+        print("Directing trash to BNR bin")
+        cmd.open_bnr()
+    elif category_code == "NBR":
+        print("Directing trash to NBR bin")
+        cmd.open_nbr()
+    elif category_code == "NBNR":
+        print("Directing trash to NBNR bin")
+        cmd.open_nbnr()
+
+    sensor_data = check_bin_levels(cmd)
+
+    # Send RESTART command to reset mechanism
+    print("Resetting mechanism...")
+    cmd.restart_mechanism()
+
+    return sensor_data
+
+
+def check_bin_levels(cmd):
+    """Read the bin levels and flush the bins when one is full"""
+    sensor_data = cmd.get_sensor_data()
+    if sensor_data:
+        print(f"Current bin levels: {sensor_data}")
+
+        # Check if any bin is full (threshold can be adjusted)
+        if max(sensor_data) > 10:  # 10 cm i guess
+            print("Warning: One or more bins need emptying")
+            cmd.flush_bins()
+
+    return sensor_data
+
+
+def dispatch_item(cmd, result_data):
+    """
+    Throughput mode, first half of actuate_item: compress the item into the
+    disk and start routing it. Returns once the chamber is empty, so the
+    next item can be put in while this one is still being routed.
+    """
+    print(f"\nDetected: {result_data['Item']}")
+    print(f"Classification: {result_data['Category']}")
+    category_code = get_bin_code(result_data['Category'])
+
+    # The previous item must be out of the disk before this one goes in
+    cmd.claim_disk()
+    try:
+        cmd.hold_lid()
+        print("Starting compression...")
+        cmd.run_stepper()
+        if category_code:
+            cmd.route_in_background(category_code)
+    except Exception:
+        cmd.release_disk()
+        raise
+    finally:
+        cmd.release_lid()
+
+
+def finish_item(cmd, result_data):
+    """Throughput mode, second half of actuate_item: wait for routing, check the bins"""
+    try:
+        if not cmd.wait_routed():
+            raise TimeoutError(f"Routing {result_data['Item']} did not finish")
+        return check_bin_levels(cmd)
+    finally:
+        cmd.release_disk()
+
+
+def record_item(item):
+    """Record stage, run by the pipeline's background worker"""
+    image_path = item.get('image_path')
+    try:
+        if item['result'] is not None:
+            # The dashboard shows the capture from the archive
+            capture = default_archive.ingest(image_path, item.get('classified_at')) \
+                if image_path else None
+            update_database(item['result'], item.get('sensor_data'),
+                            item['bin_code'], item['location'],
+                            capture['hash'] if capture else None)
+    finally:
+        # Captures that were not archived (dropped items, errors) are not kept
+        if image_path and os.path.exists(image_path):
+            os.remove(image_path)
+        item['recorded_at'] = time.time()
+        observe_item(item)
+
+
+def observe_item(item):
+    """Count a recorded item and its stage latencies in the metrics"""
+    bin_code = item['bin_code']
+    if item['result'] is None:
+        reason = item.get('drop_reason', 'unparsed')
+        ITEMS_DROPPED.labels(bin_code, reason).inc()
+        if reason == 'unparsed':
+            FALSE_TRIGGERS.labels(bin_code).inc()
+        return
+
+    category = get_bin_code(str(item['result'].get('Category', '')))
+    if category is None:
+        # Compressed but not routed: the classifier saw nothing it can sort
+        FALSE_TRIGGERS.labels(bin_code).inc()
+    ITEMS_SORTED.labels(bin_code, category or 'unknown').inc()
+    for stage, start, end in ITEM_STAGES:
+        if start in item and end in item:
+            STAGE_SECONDS.labels(bin_code, stage).observe(item[end] - item[start])
+    CYCLE_SECONDS.labels(bin_code).observe(item['recorded_at'] - item['detected_at'])
+
+
+def create_pipeline(cmd, detector, bin_code=DEFAULT_BIN_CODE, location=DEFAULT_LOCATION,
+                    **options):
+    """Item pipeline wired to this module's parse/actuate/record steps"""
+    if cmd.throughput_mode:
+        options.setdefault('dispatch', dispatch_item)
+        options.setdefault('finish', finish_item)
+    return ItemPipeline(cmd, detector, parse_classification, actuate_item, record_item,
+                        bin_code, location, **options)
+
+
+def create_supervisor(cmd, detector, classify=classify_locally, name=None,
+                      reset=reset_client):
+    """
+    Supervisor for one unit's serial link, camera and classifier client.
+    Returns (supervisor, classify) where classify is the health-tracked
+    classify stage to give the pipeline; reset resets the client.
+    """
+    camera = CameraComponent(detector)
+    classifier = ClassifierComponent(classify, reset=reset, camera=camera)
+    supervisor = ComponentSupervisor(
+        [SerialLinkComponent(cmd), camera, classifier], name=name)
+    return supervisor, classifier.classify
+
+
+def unit_status(supervisor, pipeline):
+    """Live status of a unit, as shown on the dashboard"""
+    return {
+        'state': 'running',
+        'components': supervisor.status(),
+        'in_flight': pipeline.in_flight,
+        'levels': pipeline.cmd.telemetry.get(),
+    }
 
+
+async def run_supervised(supervisor, pipeline, live=None, interval=1.0):
+    """
+    Run the pipeline under its supervisor. With a live channel the unit's
+    status is published every interval seconds, which is also the
+    heartbeat the process supervisor watches.
+    """
+    async def publish():
+        while True:
+            try:
+                live.publish_status(unit_status(supervisor, pipeline))
+            except Exception as e:
+                print(f"Error publishing unit status: {e}")
+            await asyncio.sleep(interval)
+
+    publisher = asyncio.create_task(publish()) if live else None
+    try:
+        await supervisor.run(pipeline.run, pipeline.idle)
+    finally:
+        if publisher:
+            publisher.cancel()
+
+
+def main():
+    report = StartupReport(IMPORTED_AT)
+    report.mark("imports")
+    default_archive.start()  # Retention and compaction of archived captures
+    start_metrics_server()
+    # Profiling on demand: python profiling.py profile, or kill -USR1 <pid>
+    profiling = start_profiling_control()
+    # Created by supervisor.py; None when app.py runs on its own
+    live = LiveChannel.open(channel_name(DEFAULT_BIN_CODE))
+    if live:
+        default_detector.frame_listener = FramePublisher(live)
+    # Thresholds and timeouts measured at this site by calibrate.py, if any
+    profile = load_profile(DEFAULT_BIN_CODE)
+    change_threshold = apply_detection(default_detector, profile)
     while True:
+        cmd = None
+        supervisor = None
+
+        def connect():
+            nonlocal cmd  # Closed below even if another startup step fails
+            cmd = CommandManager()
+            apply_mechanism(cmd, profile)
+
         try:
             print("Initializing system...")
-            cmd = CommandManager()
+            # Serial links, camera and classifier client come up side by side
+            report.parallel(
+                serial=connect,
+                # Opens the camera and captures the reference frame
+                camera=CameraComponent(default_detector).start,
+                classifier=warm_up,
+            )
             print("Arduino connections established")
-            capture_reference_frame()
-            retry_count = 0
-
-            while True:
-                try:
-                    while True:
-                        # 0.01 is the threshold for detection
-                        if detect_new_object(0.01):
-                            print("🔴 Object detected, camera released!")
-                            break  # Stop loop after detection
-                        else:
-                            print("✅ No new object detected")
-                        time.sleep(3)  # Check every 1 second
-
-                    print("\nWaiting for trash...")
-                    result = get_trash_classification()
-
-                    print("Raw result:", result)
-                    print("Result type:", type(result))
-
-                    try:
-                        # Clean the JSON string before parsing
-                        cleaned_result = clean_json_string(result)
-                        result_data = json.loads(cleaned_result)
-                        print("Parsed data:", result_data)
-
-                        # Continue with the rest of your code...
-
-                    except json.JSONDecodeError as e:
-                        print(f"JSON parsing error: {e}")
-                        print(f"Failed to parse: {result}")
-                        continue
-
-                    print(f"\nDetected: {result_data['Item']}")
-                    print(f"Classification: {result_data['Category']}")
-
-                    # Update database
-                    update_database(result_data)
-
-                    # Get bin code from category
-                    bin_code = get_bin_code(result_data['Category'])
-
-                    print("Starting compression...")
-                    cmd.run_stepper()
-
-                    # Open appropriate bin
-                    if bin_code == "BR":
-                        print("Directing trash to BR bin")
-                        cmd.open_br()
-                    elif bin_code == "BNR":
-                        print("Directing trash to BNR bin")
-                        cmd.open_bnr()
-                    elif bin_code == "NBR":
-                        print("Directing trash to NBR bin")
-                        cmd.open_nbr()
-                    elif bin_code == "NBNR":
-                        print("Directing trash to NBNR bin")
-                        cmd.open_nbnr()
-
-                    # Get bin levels
-                    sensor_data = cmd.get_sensor_data()
-                    if sensor_data:
-                        print(f"Current bin levels: {sensor_data}")
-
-                        # Check if any bin is full (threshold can be adjusted)
-                        if max(sensor_data) > 10:  # 10 cm i guess
-                            print("Warning: One or more bins need emptying")
-                            cmd.flush_bins()
-
-                    # Send RESTART command to reset mechanism
-                    print("Resetting mechanism...")
-                    cmd.restart_mechanism()
-
-                    # Wait before next detection
-                    time.sleep(3)
-                    print("\nReady for next item...")
-
-                except Exception as e:
-                    print(f"Error in main loop: {e}")
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        print("Max retries reached. Restarting system...")
-                        break
-                    time.sleep(2)
+            default_registry.register_collector(
+                DEFAULT_BIN_CODE, unit_collector(DEFAULT_BIN_CODE, cmd))
+            supervisor, classify = create_supervisor(cmd, default_detector)
+            report.run("components", supervisor.start)
+
+            pipeline = create_pipeline(cmd, default_detector, classify=classify,
+                                       change_threshold=change_threshold)
+            report.report()
+            # Failures from here on restart only the component that failed
+            asyncio.run(run_supervised(supervisor, pipeline, live))
 
         except KeyboardInterrupt:
             print("\nSystem stopped by user")
@@ -194,9 +313,18 @@ def main():
             time.sleep(5)
         finally:
             # Clean shutdown
-            if 'cmd' in locals():
+            if supervisor:
+                supervisor.stop()
+            if cmd:
                 cmd.close()
+            default_registry.unregister_collector(DEFAULT_BIN_CODE)
+            default_store.flush()
             print("System shutdown complete")
+        report = StartupReport()  # Time the restart on its own
+    if live:
+        live.close()
+    if profiling:
+        profiling.stop()
 
 
 if __name__ == "__main__":
@@ -9,6 +9,27 @@
 #define STEP_DELAY_FAST 200                            // Step delay for fast forward motion (adjust for speed)
 #define STEP_DELAY_SLOW 100                            // Step delay for slow return motion (adjust for speed)
 
+// Serial protocol (keep in sync with serial_protocol.py)
+#define LEGACY_BAUD 9600          // Text protocol baud rate (always used at boot)
+#define PROTOCOL_VERSION 2        // Framed protocol version
+#define FRAME_SOF 0xA5            // Start of frame marker
+#define FRAME_CMD 0x01            // Host -> board command
+#define FRAME_ACK 0x02            // Command received
+#define FRAME_DONE 0x03           // Command finished, payload is the reply
+#define FRAME_NAK 0x04            // Frame rejected
+#define MAX_PAYLOAD 64            // Largest payload in one frame
+#define MAX_LINE 64               // Largest text command
+#define BINARY_REVERT_MS 2000     // Fall back to text if the host never confirms
+
+bool binaryMode = false;          // True once the host switched to framed protocol
+bool binaryConfirmed = false;     // True after the first valid frame at the new baud rate
+unsigned long binarySince = 0;    // When we switched to framed protocol
+uint8_t frameBuf[MAX_PAYLOAD + 7];
+int frameLen = 0;
+uint8_t lastSeq = 0;              // Sequence number of the last executed command
+String lastReply = "";            // Reply to resend if the host repeats lastSeq
+String lineBuffer = "";
+
 void setup()
 {
   // Set pins as outputs
@@ -20,7 +41,7 @@ void setup()
   digitalWrite(EN_PIN, LOW); // Enable motor
 
   // Start serial communication for debugging
-  Serial.begin(9600);
+  Serial.begin(LEGACY_BAUD);
   while (!Serial)
   {
     ;
@@ -28,38 +49,235 @@ void setup()
   Serial.println("ARDUINO1"); // Send handshake signal
 }
 
-void loop()
+String handleCommand(const String &command)
 {
-  if (Serial.available() > 0)
+  // If the command is "run", start the motor sequence
+  if (command == "HANDSHAKE")
+  {
+    return "ARDUINO1";
+  }
+
+  if (command == "COMPRESS")
+  {
+    // Move piston forward for 3600 degrees (10 rotations)
+    digitalWrite(DIR_PIN, LOW);                            // Set direction (HIGH for forward)
+    moveMotor(DEGREE_TO_ROTATIONS(7200), STEP_DELAY_FAST); // Fast forward motion
+
+    delay(1000); // Wait for 1 second before reversing direction
+
+    // Move piston backward to return slowly
+
+    digitalWrite(DIR_PIN, HIGH);                           // Set direction (LOW for reverse)
+    moveMotor(DEGREE_TO_ROTATIONS(7200), STEP_DELAY_SLOW); // Slow return motion
 
+    delay(1000);
+    return "DONE COMPRESS"; // Completion: piston is back
+  }
+  if (command == "STATUS")
   {
-    //delay(1000);
-    String command = Serial.readStringUntil('\n');
-    //Serial.println(command+"+");
+    return "IDLE"; // Commands block, so we only answer once idle
+  }
+  return "";
+}
 
-    // If the command is "run", start the motor sequence
-    if (command == "HANDSHAKE")
+uint16_t crc16(const uint8_t *data, int len)
+{
+  // CRC-16/CCITT-FALSE, same as serial_protocol.crc16
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < len; i++)
+  {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int b = 0; b < 8; b++)
     {
-      Serial.println("ARDUINO1");
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
     }
+  }
+  return crc;
+}
 
-    if (command == "COMPRESS")
+void sendFrame(uint8_t type, uint8_t seq, const String &payload)
+{
+  uint8_t out[MAX_PAYLOAD + 7];
+  int len = min((int)payload.length(), MAX_PAYLOAD);
+
+  out[0] = FRAME_SOF;
+  out[1] = PROTOCOL_VERSION;
+  out[2] = type;
+  out[3] = seq;
+  out[4] = len;
+  for (int i = 0; i < len; i++)
+  {
+    out[5 + i] = payload[i];
+  }
+  uint16_t crc = crc16(out + 1, len + 4);
+  out[5 + len] = crc >> 8;
+  out[6 + len] = crc & 0xFF;
+  Serial.write(out, len + 7);
+}
+
+void switchToBinary(long baud)
+{
+  Serial.println("PROTO 2 OK");
+  Serial.flush(); // Finish sending the reply before changing speed
+  Serial.end();
+  Serial.begin(baud);
+  binaryMode = true;
+  binaryConfirmed = false;
+  binarySince = millis();
+  frameLen = 0;
+  // The host numbers each session from 1 again; 0 is never sent, so a
+  // stale reply cannot be replayed for the new session's first command
+  lastSeq = 0;
+  lastReply = "";
+}
+
+void switchToText()
+{
+  Serial.end();
+  Serial.begin(LEGACY_BAUD);
+  binaryMode = false;
+  lineBuffer = "";
+}
+
+void handleLine(String line)
+{
+  line.trim();
+  if (line.startsWith("PROTO "))
+  {
+    // "PROTO <version> <baud>" asks us to switch to the framed protocol
+    int space = line.indexOf(' ', 6);
+    if (space > 0 && line.substring(6, space).toInt() == PROTOCOL_VERSION)
     {
-      // Move piston forward for 3600 degrees (10 rotations)
-      //Serial.println(command);
-      digitalWrite(DIR_PIN, LOW);                            // Set direction (HIGH for forward)
-      moveMotor(DEGREE_TO_ROTATIONS(7200), STEP_DELAY_FAST); // Fast forward motion
+      switchToBinary(line.substring(space + 1).toInt());
+    }
+    return;
+  }
 
-      delay(1000); // Wait for 1 second before reversing direction
+  String reply = handleCommand(line);
+  if (reply.length() > 0)
+  {
+    Serial.println(reply);
+  }
+}
 
-      // Move piston backward to return slowly
+void handleFrame()
+{
+  uint8_t type = frameBuf[2];
+  uint8_t seq = frameBuf[3];
+  uint8_t len = frameBuf[4];
 
-      digitalWrite(DIR_PIN, HIGH);                           // Set direction (LOW for reverse)
-      moveMotor(DEGREE_TO_ROTATIONS(7200), STEP_DELAY_SLOW); // Slow return motion
+  if (type != FRAME_CMD)
+  {
+    return;
+  }
+  binaryConfirmed = true;
 
-      delay(1000);
+  if (seq == lastSeq)
+  {
+    // Host retransmitted a command we already ran; repeat the answers only
+    sendFrame(FRAME_ACK, seq, "");
+    sendFrame(FRAME_DONE, seq, lastReply);
+    return;
+  }
+
+  String command = "";
+  for (int i = 0; i < len; i++)
+  {
+    command += (char)frameBuf[5 + i];
+  }
+
+  sendFrame(FRAME_ACK, seq, "");
+  lastSeq = seq;
+  lastReply = handleCommand(command);
+  sendFrame(FRAME_DONE, seq, lastReply);
+}
+
+void pollBinary()
+{
+  while (Serial.available() > 0)
+  {
+    uint8_t b = Serial.read();
+    if (frameLen == 0 && b != FRAME_SOF)
+    {
+      // Between frames, listen for a host that went back to the text protocol
+      if (b == '\n')
+      {
+        String line = lineBuffer;
+        lineBuffer = "";
+        line.trim();
+        if (line == "HANDSHAKE" || line.startsWith("PROTO "))
+        {
+          switchToText();
+          handleLine(line);
+          return;
+        }
+      }
+      else if (lineBuffer.length() < MAX_LINE)
+      {
+        lineBuffer += (char)b;
+      }
+      continue; // Wait for start of frame
+    }
+    if (frameLen == 0)
+    {
+      lineBuffer = "";
+    }
+    frameBuf[frameLen++] = b;
+
+    if (frameLen == 5 && (frameBuf[1] != PROTOCOL_VERSION || frameBuf[4] > MAX_PAYLOAD))
+    {
+      frameLen = 0; // Not a valid header, resync
+      continue;
+    }
+    if (frameLen >= 5 && frameLen == frameBuf[4] + 7)
+    {
+      uint16_t crc = ((uint16_t)frameBuf[frameLen - 2] << 8) | frameBuf[frameLen - 1];
+      if (crc16(frameBuf + 1, frameLen - 3) == crc)
+      {
+        handleFrame();
+      }
+      else
+      {
+        sendFrame(FRAME_NAK, frameBuf[3], "");
+      }
+      frameLen = 0;
+    }
+  }
+}
+
+void pollText()
+{
+  // Collect characters without blocking; readStringUntil() would stall
+  while (Serial.available() > 0)
+  {
+    char c = Serial.read();
+    if (c == '\n')
+    {
+      String line = lineBuffer;
+      lineBuffer = "";
+      handleLine(line);
+    }
+    else if (lineBuffer.length() < MAX_LINE)
+    {
+      lineBuffer += c;
     }
-  } // Wait for 1 second before repeating
+  }
+}
+
+void loop()
+{
+  if (binaryMode)
+  {
+    pollBinary();
+    if (!binaryConfirmed && millis() - binarySince > BINARY_REVERT_MS)
+    {
+      switchToText(); // Host gave up on the framed protocol
+    }
+  }
+  else
+  {
+    pollText();
+  }
 }
 
 // Function to move the motor for the specified number of rotations
@@ -31,9 +31,52 @@ int angleUpper = 0;   // Starting position for upper servo
 int anglemidflap = 0; // Starting position for mid flap
 long updated_sensor_values[4] = {0, 0, 0, 0};
 
+// Routing targets, same order as updated_sensor_values: {upper, lower} disk angles
+const char *BIN_NAMES[4] = {"BR", "BNR", "NBR", "NBNR"};
+const int ROUTE_ANGLES[4][2] = {{45, 0}, {135, 0}, {135, 90}, {135, 180}};
+// Routing steps: upper disk, lower disk, open mid flap, close mid flap, settle.
+// Each step waits this long (ms) before the next one starts.
+#define ROUTE_STEPS 5
+const unsigned long ROUTE_STEP_MS[ROUTE_STEPS] = {1000, 1000, 3000, 1000, 2000};
+
+int routeBin = -1;                // Bin currently being routed to (-1 = disk free)
+int routeStep = 0;                // Current routing step
+unsigned long routeStepSince = 0; // When the current routing step started
+bool routeNotify = false;         // Send "ROUTED <bin>" when the routing run ends
+
+// Throughput mode: loop() runs the lid from the proximity sensors
+bool lidAuto = false; // Lid follows the proximity sensors without blocking
+bool lidHold = false; // Host asked to keep the lid closed (compressor running)
+bool lidOpen = false;
+
+// Serial protocol (keep in sync with serial_protocol.py)
+#define LEGACY_BAUD 9600          // Text protocol baud rate (always used at boot)
+#define PROTOCOL_VERSION 2        // Framed protocol version
+#define FRAME_SOF 0xA5            // Start of frame marker
+#define FRAME_CMD 0x01            // Host -> board command
+#define FRAME_ACK 0x02            // Command received
+#define FRAME_DONE 0x03           // Command finished, payload is the reply
+#define FRAME_NAK 0x04            // Frame rejected
+#define FRAME_EVENT 0x05          // Unsolicited message (telemetry), seq 0
+#define MAX_PAYLOAD 64            // Largest payload in one frame
+#define MAX_LINE 64               // Largest text command
+#define BINARY_REVERT_MS 2000     // Fall back to text if the host never confirms
+
+bool binaryMode = false;          // True once the host switched to framed protocol
+bool binaryConfirmed = false;     // True after the first valid frame at the new baud rate
+unsigned long binarySince = 0;    // When we switched to framed protocol
+uint8_t frameBuf[MAX_PAYLOAD + 7];
+int frameLen = 0;
+uint8_t lastSeq = 0;              // Sequence number of the last executed command
+String lastReply = "";            // Reply to resend if the host repeats lastSeq
+String lineBuffer = "";
+
+unsigned long telemetryPeriod = 0; // Push bin levels every N ms (0 = telemetry off)
+unsigned long lastTelemetry = 0;   // When bin levels were last pushed
+
 void setup()
 {
-  Serial.begin(9600); // Initialize serial communication
+  Serial.begin(LEGACY_BAUD); // Initialize serial communication
   while (!Serial)
   {
     ;
@@ -71,8 +114,6 @@ void setup()
 
 void update_distance(int n)
 {
-  delay(2000); // Allow time for trash to settle in bin
-
   // Ultrasonic sensor measurement sequence
   digitalWrite(TRIG, LOW);
   delayMicroseconds(2);
@@ -82,7 +123,41 @@ void update_distance(int n)
 
   long duration = pulseIn(ECHO, HIGH);  // Get echo duration
   long distance = duration * 0.034 / 2; // Convert duration to distance in cm
+  bool changed = updated_sensor_values[n] != distance;
   updated_sensor_values[n] = distance;  // Store distance in array
+
+  if (changed && telemetryPeriod > 0)
+  {
+    push_levels(); // Tell the host right away instead of waiting for GETD
+  }
+}
+
+String levels_string()
+{
+  // All sensor values as comma-separated string
+  return String(updated_sensor_values[0]) + "," +
+         String(updated_sensor_values[1]) + "," +
+         String(updated_sensor_values[2]) + "," +
+         String(updated_sensor_values[3]);
+}
+
+void send_event(const String &message)
+{
+  // Unsolicited message to the host (telemetry, routing and lid events)
+  if (binaryMode)
+  {
+    sendFrame(FRAME_EVENT, 0, message);
+  }
+  else
+  {
+    Serial.println(message);
+  }
+}
+
+void push_levels()
+{
+  send_event("LEVELS " + levels_string());
+  lastTelemetry = millis();
 }
 
 void disk_reset()
@@ -91,56 +166,94 @@ void disk_reset()
   upperServo.write(angleUpper);
 }
 
-void bio_ren()
+int bin_index(const String &name)
 {
-  upperServo.write(45); // Set upper servo to 45 degrees
-  delay(1000);
-  lowerServo.write(0); // Set lower servo to 0 degrees
-  delay(1000);
+  for (int i = 0; i < 4; i++)
+  {
+    if (name.equals(BIN_NAMES[i]))
+    {
+      return i;
+    }
+  }
+  return -1;
+}
 
-  midflapServo.write(90); // Open mid flap
-  delay(3000);            // Wait for waste to fall
-  midflapServo.write(0);  // Close mid flap
-  delay(1000);
+void start_route(int n, bool notify)
+{
+  routeBin = n;
+  routeStep = 0;
+  routeStepSince = millis();
+  routeNotify = notify;
+  upperServo.write(ROUTE_ANGLES[n][0]);
 }
 
-void bio_nonren()
+void service_route()
 {
-  upperServo.write(135); // Set upper servo to 135 degrees
-  delay(1000);
-  lowerServo.write(0); // Set lower servo to 0 degrees
-  delay(1000);
+  // Advance the routing run one step at a time instead of blocking in delay()
+  if (routeBin < 0 || millis() - routeStepSince < ROUTE_STEP_MS[routeStep])
+  {
+    return;
+  }
+  routeStep++;
+  routeStepSince = millis();
 
-  midflapServo.write(90); // Open mid flap
-  delay(3000);
-  midflapServo.write(0); // Close mid flap
-  delay(1000);
+  if (routeStep == 1)
+  {
+    lowerServo.write(ROUTE_ANGLES[routeBin][1]);
+  }
+  else if (routeStep == 2)
+  {
+    midflapServo.write(90); // Open mid flap, wait for waste to fall
+  }
+  else if (routeStep == 3)
+  {
+    midflapServo.write(0); // Close mid flap
+  }
+  else if (routeStep == ROUTE_STEPS)
+  {
+    // Trash has settled in the bin
+    int n = routeBin;
+    update_distance(n);
+    disk_reset();
+    routeBin = -1;
+    if (routeNotify)
+    {
+      send_event("ROUTED " + String(BIN_NAMES[n]));
+    }
+  }
 }
 
-void nonbio_ren()
+void route(int n)
 {
-  upperServo.write(135); // Set upper servo to 135 degrees
-  delay(1000);
-  lowerServo.write(90); // Set lower servo to 90 degrees
-  delay(1000);
-
-  midflapServo.write(90); // Open mid flap
-  delay(3000);
-  midflapServo.write(0); // Close mid flap
-  delay(1000);
+  // Blocking routing run used by the BR/BNR/NBR/NBNR commands
+  start_route(n, false);
+  while (routeBin >= 0)
+  {
+    service_route();
+  }
 }
 
-void nonbio_nonren()
+void service_lid()
 {
-  upperServo.write(135); // Set upper servo to 135 degrees
-  delay(1000);
-  lowerServo.write(180); // Set lower servo to 180 degrees
-  delay(1000);
+  if (!lidAuto)
+  {
+    return;
+  }
+  bool openSensor = digitalRead(PROXIMITY_OPEN) == HIGH;
+  bool closeSensor = digitalRead(PROXIMITY_CLOSE) == HIGH;
 
-  midflapServo.write(90); // Open mid flap
-  delay(3000);
-  midflapServo.write(0); // Close mid flap
-  delay(1000);
+  if (openSensor && !closeSensor && !lidOpen && !lidHold)
+  {
+    servo_lid.write(90); // Lid open
+    lidOpen = true;
+    send_event("LID OPEN");
+  }
+  else if (closeSensor && !openSensor && lidOpen)
+  {
+    servo_lid.write(0); // Lid close
+    lidOpen = false;
+    send_event("LID CLOSED");
+  }
 }
 
 void flush_trash_to_external_bin()
@@ -172,76 +285,317 @@ void open_lid()
   delay(1000);
 }
 
-void loop()
+String handleCommand(const String &message)
 {
-  // Check for serial commands
-  if (Serial.available() > 0)
+  if (message.equals("HANDSHAKE"))
   {
-    //delay(1000);
-    String message = Serial.readStringUntil('\n');
-    //message.trim(); // Remove whitespace
-    //Serial.println(message);
+    return "ARDUINO2";
+  }
 
-    if (message.equals("HANDSHAKE"))
+  // Process different commands
+  int bin = bin_index(message);
+  if (bin >= 0)
+  {
+    if (routeBin >= 0)
     {
-      Serial.println("ARDUINO2");
+      return "BUSY"; // Previous item is still in the disk
     }
-
-    // Process different commands
-    if (message.equals("BR"))
+    route(bin);
+    return "DONE " + message; // Completion: the item has settled in its bin
+  }
+  else if (message.startsWith("ROUTE ")) // Route in the background, "ROUTED <bin>" when done
+  {
+    if (routeBin >= 0)
     {
-      bio_ren();
-      update_distance(0);
-      disk_reset();
+      return "BUSY";
     }
-    else if (message.equals("BNR"))
+    bin = bin_index(message.substring(6));
+    if (bin < 0)
     {
-      bio_nonren();
-      update_distance(1);
-      disk_reset();
+      return "ERR";
     }
-    else if (message.equals("NBR"))
+    start_route(bin, true);
+    return "ROUTING " + String(BIN_NAMES[bin]);
+  }
+  else if (message.equals("STATUS"))
+  {
+    return routeBin >= 0 ? "BUSY " + String(BIN_NAMES[routeBin]) : "IDLE";
+  }
+  else if (message.equals("LID AUTO")) // Throughput mode: lid follows the proximity sensors
+  {
+    lidAuto = true;
+    lidHold = false;
+    return "LID AUTO";
+  }
+  else if (message.equals("LID HOLD")) // Keep the lid closed until the next LID AUTO
+  {
+    lidHold = true;
+    return lidOpen ? "LID OPEN" : "LID HELD";
+  }
+  else if (message.equals("LID OFF"))
+  {
+    lidAuto = false;
+    lidHold = false;
+    return "LID OFF";
+  }
+  else if (message.equals("GETD")) // Request bin levels
+  {
+    return levels_string();
+  }
+  else if (message.startsWith("TELEMETRY ")) // "TELEMETRY <period ms>", 0 turns it off
+  {
+    telemetryPeriod = message.substring(10).toInt();
+    if (telemetryPeriod > 0)
     {
-      nonbio_ren();
-      update_distance(2);
-      disk_reset();
+      push_levels(); // Seed the host cache immediately
+      return "TELEMETRY ON";
     }
-    else if (message.equals("NBNR"))
+    return "TELEMETRY OFF";
+  }
+  else if (message.equals("FLUSH")) // Empty all bins
+  {
+    if (routeBin >= 0)
     {
-      nonbio_nonren();
-      update_distance(3);
-      disk_reset();
+      return "BUSY";
     }
-    else if (message.equals("GETD")) // Request bin levels
+    flush_trash_to_external_bin();
+    return "DONE FLUSH";
+  }
+  else if (message.equals("disk_reset"))
+  {
+    if (routeBin >= 0)
     {
-      // Send all sensor values as comma-separated string
-      Serial.print(updated_sensor_values[0]);
-      Serial.print(",");
-      Serial.print(updated_sensor_values[1]);
-      Serial.print(",");
-      Serial.print(updated_sensor_values[2]);
-      Serial.print(",");
-      Serial.println(updated_sensor_values[3]);
+      return "BUSY";
     }
-    else if (message.equals("FLUSH")) // Empty all bins
+    disk_reset();
+    return "DONE disk_reset";
+  }
+  else if (message.equals("RESTART"))
+  {
+    while (true)
     {
-      flush_trash_to_external_bin();
+      if ((digitalRead(PROXIMITY_OPEN) == HIGH) && (digitalRead(PROXIMITY_CLOSE) == LOW))
+      {
+        open_lid();
+      }
+      else if ((digitalRead(PROXIMITY_CLOSE) == HIGH) && (digitalRead(PROXIMITY_OPEN) == LOW))
+      {
+        close_lid();
+        break;
+      }
+      delay(1000);
     }
-    else if (message.equals("RESTART"))
+    return "DONE RESTART"; // Next item is in and the lid is closed
+  }
+  return "";
+}
+
+uint16_t crc16(const uint8_t *data, int len)
+{
+  // CRC-16/CCITT-FALSE, same as serial_protocol.crc16
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < len; i++)
+  {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int b = 0; b < 8; b++)
+    {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, uint8_t seq, const String &payload)
+{
+  uint8_t out[MAX_PAYLOAD + 7];
+  int len = min((int)payload.length(), MAX_PAYLOAD);
+
+  out[0] = FRAME_SOF;
+  out[1] = PROTOCOL_VERSION;
+  out[2] = type;
+  out[3] = seq;
+  out[4] = len;
+  for (int i = 0; i < len; i++)
+  {
+    out[5 + i] = payload[i];
+  }
+  uint16_t crc = crc16(out + 1, len + 4);
+  out[5 + len] = crc >> 8;
+  out[6 + len] = crc & 0xFF;
+  Serial.write(out, len + 7);
+}
+
+void switchToBinary(long baud)
+{
+  Serial.println("PROTO 2 OK");
+  Serial.flush(); // Finish sending the reply before changing speed
+  Serial.end();
+  Serial.begin(baud);
+  binaryMode = true;
+  binaryConfirmed = false;
+  binarySince = millis();
+  frameLen = 0;
+  // The host numbers each session from 1 again; 0 is never sent, so a
+  // stale reply cannot be replayed for the new session's first command
+  lastSeq = 0;
+  lastReply = "";
+}
+
+void switchToText()
+{
+  Serial.end();
+  Serial.begin(LEGACY_BAUD);
+  binaryMode = false;
+  lineBuffer = "";
+}
+
+void handleLine(String line)
+{
+  line.trim();
+  if (line.startsWith("PROTO "))
+  {
+    // "PROTO <version> <baud>" asks us to switch to the framed protocol
+    int space = line.indexOf(' ', 6);
+    if (space > 0 && line.substring(6, space).toInt() == PROTOCOL_VERSION)
     {
-      while (true)
+      switchToBinary(line.substring(space + 1).toInt());
+    }
+    return;
+  }
+
+  String reply = handleCommand(line);
+  if (reply.length() > 0)
+  {
+    Serial.println(reply);
+  }
+}
+
+void handleFrame()
+{
+  uint8_t type = frameBuf[2];
+  uint8_t seq = frameBuf[3];
+  uint8_t len = frameBuf[4];
+
+  if (type != FRAME_CMD)
+  {
+    return;
+  }
+  binaryConfirmed = true;
+
+  if (seq == lastSeq)
+  {
+    // Host retransmitted a command we already ran; repeat the answers only
+    sendFrame(FRAME_ACK, seq, "");
+    sendFrame(FRAME_DONE, seq, lastReply);
+    return;
+  }
+
+  String command = "";
+  for (int i = 0; i < len; i++)
+  {
+    command += (char)frameBuf[5 + i];
+  }
+
+  sendFrame(FRAME_ACK, seq, "");
+  lastSeq = seq;
+  lastReply = handleCommand(command);
+  sendFrame(FRAME_DONE, seq, lastReply);
+}
+
+void pollBinary()
+{
+  while (Serial.available() > 0)
+  {
+    uint8_t b = Serial.read();
+    if (frameLen == 0 && b != FRAME_SOF)
+    {
+      // Between frames, listen for a host that went back to the text protocol
+      if (b == '\n')
       {
-        if ((digitalRead(PROXIMITY_OPEN) == HIGH) && (digitalRead(PROXIMITY_CLOSE) == LOW))
+        String line = lineBuffer;
+        lineBuffer = "";
+        line.trim();
+        if (line == "HANDSHAKE" || line.startsWith("PROTO "))
         {
-          open_lid();
+          switchToText();
+          handleLine(line);
+          return;
         }
-        else if ((digitalRead(PROXIMITY_CLOSE) == HIGH) && (digitalRead(PROXIMITY_OPEN) == LOW))
-        {
-          close_lid();
-          break;
-        }
-        delay(1000);
       }
+      else if (lineBuffer.length() < MAX_LINE)
+      {
+        lineBuffer += (char)b;
+      }
+      continue; // Wait for start of frame
+    }
+    if (frameLen == 0)
+    {
+      lineBuffer = "";
+    }
+    frameBuf[frameLen++] = b;
+
+    if (frameLen == 5 && (frameBuf[1] != PROTOCOL_VERSION || frameBuf[4] > MAX_PAYLOAD))
+    {
+      frameLen = 0; // Not a valid header, resync
+      continue;
+    }
+    if (frameLen >= 5 && frameLen == frameBuf[4] + 7)
+    {
+      uint16_t crc = ((uint16_t)frameBuf[frameLen - 2] << 8) | frameBuf[frameLen - 1];
+      if (crc16(frameBuf + 1, frameLen - 3) == crc)
+      {
+        handleFrame();
+      }
+      else
+      {
+        sendFrame(FRAME_NAK, frameBuf[3], "");
+      }
+      frameLen = 0;
     }
   }
 }
+
+void pollText()
+{
+  // Collect characters without blocking; readStringUntil() would stall
+  while (Serial.available() > 0)
+  {
+    char c = Serial.read();
+    if (c == '\n')
+    {
+      String line = lineBuffer;
+      lineBuffer = "";
+      handleLine(line);
+    }
+    else if (lineBuffer.length() < MAX_LINE)
+    {
+      lineBuffer += c;
+    }
+  }
+}
+
+void loop()
+{
+  if (binaryMode)
+  {
+    pollBinary();
+    if (!binaryConfirmed && millis() - binarySince > BINARY_REVERT_MS)
+    {
+      switchToText(); // Host gave up on the framed protocol
+    }
+  }
+  else
+  {
+    pollText();
+  }
+
+  // Background routing and lid (throughput mode)
+  service_route();
+  service_lid();
+
+  // Periodic bin level push
+  if (telemetryPeriod > 0 && millis() - lastTelemetry >= telemetryPeriod)
+  {
+    push_levels();
+  }
+}
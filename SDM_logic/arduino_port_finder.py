@@ -4,7 +4,8 @@ import serial.tools.list_ports
 import json
 import os
 
-CONFIG_FILE = 'arduino_ports.json'
+# ARDUINO_PORTS_FILE lets the simulator point everything at its own ports
+CONFIG_FILE = os.environ.get('ARDUINO_PORTS_FILE', 'arduino_ports.json')
 
 
 def list_all_ports():
@@ -40,10 +41,14 @@ def list_all_ports():
 
 def save_port_config(stepper_port, mechanism_port):
     """Save port configuration to file"""
-    config = {
-        'stepper_port': stepper_port,
-        'mechanism_port': mechanism_port
-    }
+    # Keep other settings (protocol, telemetry, ...) already in the file
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        config = {}
+    config['stepper_port'] = stepper_port
+    config['mechanism_port'] = mechanism_port
     with open(CONFIG_FILE, 'w') as f:
         json.dump(config, f)
     print(f"Configuration saved to {CONFIG_FILE}")
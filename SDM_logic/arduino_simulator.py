@@ -0,0 +1,464 @@
+import argparse
+import json
+import os
+import queue
+import random
+import select
+import threading
+import time
+import tty
+
+from paths import data_path
+from serial_protocol import (FRAME_ACK, FRAME_CMD, FRAME_DONE, FRAME_EVENT,
+                             FRAME_SOF, PROTOCOL_VERSION, FrameDecoder,
+                             encode_frame)
+
+# Seconds each command keeps the real board busy (before --time-scale).
+# COMPRESS: 2 x 20 rotations x 800 steps at 400/200 us per step + 2 x 1 s pause.
+# Routing: servo routine (6 s) + settle delay before the ultrasonic read (2 s).
+BOARD_COMMANDS = {
+    "ARDUINO1": {
+        "HANDSHAKE": 0.0,
+        "STATUS": 0.0,
+        "COMPRESS": 11.6,
+    },
+    "ARDUINO2": {
+        "HANDSHAKE": 0.0,
+        "BR": 8.0,
+        "BNR": 8.0,
+        "NBR": 8.0,
+        "NBNR": 8.0,
+        "GETD": 0.0,
+        "FLUSH": 4.0,
+        "disk_reset": 0.0,
+        "RESTART": 3.0,  # Waiting for the user to close the lid
+    },
+}
+
+ROUTE_BINS = ["BR", "BNR", "NBR", "NBNR"]
+
+# Routines that end with a "DONE <command>" completion reply
+MECHANISM_COMMANDS = {"COMPRESS", "FLUSH", "disk_reset", "RESTART", *ROUTE_BINS}
+
+DEFAULT_FAULTS = {
+    'drop_rate': 0.0,    # Ignore the command completely
+    'garble_rate': 0.0,  # Corrupt one byte of the reply
+    'stall_rate': 0.0,   # Add stall_s to the command duration
+    'stall_s': 5.0,
+    'jitter': 0.05,      # +/- fraction applied to every duration
+}
+
+
+class SimulatedArduino:
+    """
+    Pseudo-terminal that behaves like one of the sorting Arduinos.
+    Speaks both the legacy text protocol and the framed protocol, so the
+    real CommandManager and port finder can connect to it unchanged.
+    """
+
+    def __init__(self, name, time_scale=1.0, faults=None, seed=None, fill_step=1,
+                 legacy_firmware=False):
+        self.name = name
+        # Behave like the original sketches: text protocol only, no telemetry
+        self.legacy_firmware = legacy_firmware
+        self.durations = dict(BOARD_COMMANDS[name])
+        self.time_scale = time_scale
+        self.faults = dict(DEFAULT_FAULTS, **(faults or {}))
+        self.random = random.Random(seed)
+        self.fill_step = fill_step
+
+        self.levels = [0, 0, 0, 0]
+        self.routing = None  # Bin being routed to in the background (ROUTE)
+        self.lid_auto = False
+        self.telemetry_period = 0
+        self.last_telemetry = 0
+        self.binary = False
+        self.decoder = FrameDecoder()
+        self.line_buffer = b''
+        self.last_seq = 0
+        self.last_reply = ''
+        self.commands_handled = 0
+
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.write_lock = threading.Lock()  # Background routing writes events too
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Create the pseudo-terminal and start answering commands"""
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # No echo or newline translation
+        # Keep our slave fd open so the master never sees EIO between clients
+        self.port = os.ttyname(self.slave)
+        self.thread = threading.Thread(
+            target=self.run, name=f"sim-{self.name}", daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.write_lock:
+            os.write(self.master, data)
+
+    def reply_line(self, text):
+        self.write(f"{text}\r\n")  # Serial.println() ends lines with CRLF
+
+    def run(self):
+        while not self.stop_event.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if ready:
+                try:
+                    data = os.read(self.master, 1024)
+                except OSError:
+                    break
+                if self.binary:
+                    self.handle_binary(data)
+                else:
+                    self.handle_text(data)
+
+            if self.telemetry_period and \
+                    time.time() - self.last_telemetry >= self.telemetry_period:
+                self.push_levels()
+
+    def handle_text(self, data):
+        self.line_buffer += data
+        while b'\n' in self.line_buffer:
+            raw, self.line_buffer = self.line_buffer.split(b'\n', 1)
+            line = raw.decode(errors='ignore').strip()
+            if line.startswith("PROTO ") and not self.legacy_firmware:
+                parts = line.split()
+                if len(parts) == 3 and parts[1] == str(PROTOCOL_VERSION):
+                    self.reply_line(f"PROTO {PROTOCOL_VERSION} OK")
+                    self.binary = True
+                    self.line_buffer = b''
+                    self.last_seq = 0  # Like switchToBinary(): a new session
+                    self.last_reply = ''
+                    return
+                continue
+            reply = self.execute(line)
+            if reply:
+                self.reply_line(reply)
+
+    def handle_binary(self, data):
+        text = data.strip().decode(errors='ignore')
+        if not self.decoder.buffer and FRAME_SOF not in data and \
+                (text == "HANDSHAKE" or text.startswith("PROTO ")):
+            # The host went back to the text protocol (or a new client opened
+            # the port and the real board reset); the firmware follows it
+            self.binary = False
+            self.telemetry_period = 0
+            self.handle_text(data)
+            return
+
+        for frame_type, seq, payload in self.decoder.feed(data):
+            if frame_type != FRAME_CMD:
+                continue
+            if seq == self.last_seq:
+                # Retransmission of a command we already ran
+                self.write(encode_frame(FRAME_ACK, seq))
+                self.write(encode_frame(FRAME_DONE, seq, self.last_reply))
+                continue
+            command = payload.decode(errors='ignore')
+            if self.roll('drop_rate'):
+                continue
+            self.write(encode_frame(FRAME_ACK, seq))
+            self.last_seq = seq
+            self.last_reply = self.execute(command, dropped_checked=True) or ''
+            frame = bytearray(encode_frame(FRAME_DONE, seq, self.last_reply))
+            if self.roll('garble_rate'):
+                frame[-1] ^= 0xFF
+            self.write(bytes(frame))
+
+    def roll(self, fault):
+        return self.random.random() < self.faults[fault]
+
+    def busy(self, command):
+        """Block like the firmware does while a routine runs"""
+        duration = self.durations[command]
+        jitter = self.faults['jitter']
+        duration *= 1 + self.random.uniform(-jitter, jitter)
+        if self.roll('stall_rate'):
+            duration += self.faults['stall_s']
+        if duration > 0:
+            time.sleep(duration * self.time_scale)
+
+    def execute(self, command, dropped_checked=False):
+        """Run one command and return its reply text ('' for none, None if dropped)"""
+        if not dropped_checked and self.roll('drop_rate'):
+            return None
+
+        self.commands_handled += 1
+
+        if command.startswith("TELEMETRY ") and self.name == "ARDUINO2" \
+                and not self.legacy_firmware:
+            period_ms = int(command.split()[1])
+            self.telemetry_period = period_ms / 1000 * self.time_scale
+            if period_ms > 0:
+                self.push_levels()
+                return "TELEMETRY ON"
+            return "TELEMETRY OFF"
+
+        if self.name == "ARDUINO2" and not self.legacy_firmware:
+            reply = self.execute_throughput(command)
+            if reply is not None:
+                return reply
+
+        if command not in self.durations:
+            return ''
+
+        self.busy(command)
+
+        if command == "HANDSHAKE":
+            return self.name
+        if command == "GETD":
+            reply = ",".join(str(v) for v in self.levels)
+            if not self.binary and self.roll('garble_rate'):
+                reply = reply[:-1] + "?"
+            return reply
+        if command == "STATUS":
+            return "IDLE" if not self.legacy_firmware else ''
+        if command in ROUTE_BINS:
+            if self.routing:
+                return "BUSY"
+            self.levels[ROUTE_BINS.index(command)] += self.fill_step
+            if self.telemetry_period:
+                self.push_levels()
+        elif command == "FLUSH":
+            self.levels = [0, 0, 0, 0]
+            if self.telemetry_period:
+                self.push_levels()
+        if command in MECHANISM_COMMANDS and not self.legacy_firmware:
+            return f"DONE {command}"
+        return ''
+
+    def execute_throughput(self, command):
+        """Throughput mode commands of arduino2; None if command is not one of them"""
+        if command.startswith("ROUTE "):
+            bin_code = command[len("ROUTE "):]
+            if self.routing:
+                return "BUSY"
+            if bin_code not in ROUTE_BINS:
+                return "ERR"
+            self.routing = bin_code
+            threading.Thread(target=self.route_in_background, args=(bin_code,),
+                             name=f"sim-route-{bin_code}", daemon=True).start()
+            return f"ROUTING {bin_code}"
+        if command == "STATUS":
+            return f"BUSY {self.routing}" if self.routing else "IDLE"
+        if command == "LID AUTO":
+            self.lid_auto = True
+            return "LID AUTO"
+        if command == "LID HOLD":
+            return "LID HELD"  # Nobody stands at the simulated lid
+        if command == "LID OFF":
+            self.lid_auto = False
+            return "LID OFF"
+        return None
+
+    def route_in_background(self, bin_code):
+        self.busy(bin_code)
+        self.levels[ROUTE_BINS.index(bin_code)] += self.fill_step
+        self.routing = None
+        self.send_event(f"ROUTED {bin_code}")
+        if self.telemetry_period:
+            self.push_levels()
+
+    def send_event(self, message):
+        if self.binary:
+            self.write(encode_frame(FRAME_EVENT, 0, message))
+        else:
+            self.reply_line(message)
+
+    def push_levels(self):
+        self.send_event("LEVELS " + ",".join(str(v) for v in self.levels))
+        self.last_telemetry = time.time()
+
+
+def start_simulators(time_scale=1.0, faults=None, seed=None, config_file=None,
+                     legacy_firmware=False):
+    """Start both simulated boards and optionally write a port config for them"""
+    boards = {
+        name: SimulatedArduino(name, time_scale, faults,
+                               None if seed is None else seed + i,
+                               legacy_firmware=legacy_firmware)
+        for i, name in enumerate(BOARD_COMMANDS)
+    }
+    for board in boards.values():
+        board.start()
+
+    if config_file:
+        config = {
+            'stepper_port': boards["ARDUINO1"].port,
+            'mechanism_port': boards["ARDUINO2"].port,
+        }
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+    return boards
+
+
+def run_cycle_benchmark(cycles, time_scale, faults=None, seed=0, legacy_firmware=False,
+                        throughput=False, classify_s=3.0):
+    """
+    Drive the real CommandManager through full sorting cycles.
+
+    classify_s stands in for detecting and classifying each item. With
+    throughput=True the cycle uses throughput mode: the next item is put
+    in and classified while the previous one is routed.
+    """
+    config_file = data_path('arduino_ports.sim.json')
+    os.makedirs(os.path.dirname(config_file), exist_ok=True)
+    boards = start_simulators(time_scale, faults, seed, config_file, legacy_firmware)
+    if throughput:
+        with open(config_file) as f:
+            config = json.load(f)
+        config['throughput_mode'] = True
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+    # The port finder and CommandManager both read this
+    os.environ['ARDUINO_PORTS_FILE'] = config_file
+
+    from command_manager import CommandManager
+
+    cmd = None
+    try:
+        start = time.time()
+        cmd = CommandManager()
+        connect_s = time.time() - start
+
+        # Time the user needs to put an item in (RESTART waits for it)
+        lid_s = BOARD_COMMANDS["ARDUINO2"]["RESTART"] * time_scale
+        if cmd.throughput_mode:
+            cycle_times = run_throughput_cycles(cmd, cycles, classify_s * time_scale, lid_s)
+        else:
+            cycle_times = []
+            for i in range(cycles):
+                cycle_start = time.time()
+                time.sleep(classify_s * time_scale)
+                cmd.run_stepper()
+                getattr(cmd, f"open_{ROUTE_BINS[i % 4].lower()}")()
+                cmd.get_sensor_data()
+                cmd.restart_mechanism()
+                cycle_times.append(time.time() - cycle_start)
+
+        mean_s = sum(cycle_times) / len(cycle_times)
+        print("\nSimulator benchmark")
+        print("===================")
+        print(f"Connect time: {connect_s:.2f} s")
+        print(f"Mode: {'throughput' if cmd.throughput_mode else 'one item at a time'}")
+        print(f"Cycles: {cycles}, mean {mean_s:.3f} s, "
+              f"min {min(cycle_times):.3f} s, max {max(cycle_times):.3f} s")
+        print(f"Cycles per hour: {3600 / mean_s:.0f} "
+              f"(x{1 / time_scale:.0f} hardware speed)")
+        print(cmd.stats.format_report())
+        return cycle_times
+    finally:
+        if cmd:
+            cmd.close()
+        for board in boards.values():
+            board.stop()
+        os.remove(config_file)
+
+
+def run_throughput_cycles(cmd, cycles, classify_s, lid_s):
+    """Throughput mode cycles: routing overlaps with the next item going in"""
+    routed = queue.Queue(maxsize=1)
+
+    def finish():
+        while routed.get() is not None:
+            try:
+                if not cmd.wait_routed():
+                    print("Routing did not finish")
+                cmd.get_sensor_data()
+            finally:
+                cmd.release_disk()
+
+    finisher = threading.Thread(target=finish, name="bench-finish", daemon=True)
+    finisher.start()
+
+    cycle_times = []
+    last = time.time()
+    for i in range(cycles):
+        time.sleep(lid_s + classify_s)  # Next item goes in and is classified
+        cmd.claim_disk()
+        cmd.hold_lid()
+        cmd.run_stepper()
+        cmd.route_in_background(ROUTE_BINS[i % 4])
+        cmd.release_lid()
+        routed.put(i)
+        now = time.time()
+        cycle_times.append(now - last)
+        last = now
+    routed.put(None)
+    finisher.join()
+    return cycle_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated ARDUINO1/ARDUINO2 on pseudo-terminals")
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help="Multiply all hardware delays (0.1 = 10x faster)")
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--garble-rate', type=float, default=0.0)
+    parser.add_argument('--stall-rate', type=float, default=0.0)
+    parser.add_argument('--stall-s', type=float, default=5.0)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--legacy-firmware', action='store_true',
+                        help="Only speak the original text protocol (tests the fallback)")
+    parser.add_argument('--write-config', metavar='FILE',
+                        help="Write a port config for the simulated boards (e.g. arduino_ports.json)")
+    parser.add_argument('--bench', type=int, metavar='CYCLES',
+                        help="Run CYCLES sorting cycles through CommandManager and exit")
+    parser.add_argument('--throughput', action='store_true',
+                        help="Benchmark throughput mode (routing overlaps the next item)")
+    parser.add_argument('--classify-s', type=float, default=3.0,
+                        help="Seconds per item for detection and classification in --bench")
+    args = parser.parse_args()
+
+    faults = {
+        'drop_rate': args.drop_rate,
+        'garble_rate': args.garble_rate,
+        'stall_rate': args.stall_rate,
+        'stall_s': args.stall_s,
+        'jitter': args.jitter,
+    }
+
+    if args.bench:
+        run_cycle_benchmark(args.bench, args.time_scale, faults, args.seed or 0,
+                            args.legacy_firmware, args.throughput, args.classify_s)
+        return
+
+    boards = start_simulators(args.time_scale, faults, args.seed, args.write_config,
+                              args.legacy_firmware)
+    print("Arduino Simulator")
+    print("=================")
+    for name, board in boards.items():
+        print(f"{name}: {board.port}")
+    if args.write_config:
+        print(f"Port configuration written to {args.write_config}")
+    print("Press Ctrl+C to stop")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for board in boards.values():
+            board.stop()
+
+
+if __name__ == "__main__":
+    main()
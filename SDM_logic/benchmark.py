@@ -0,0 +1,498 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import glob
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+
+from arduino_simulator import start_simulators
+from metrics import classifier_request
+from mock_model_server import LatencyModel, MockModelServer
+from vision import CLASSIFY_PROMPT, capture_image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Saved baselines, one JSON file per name
+BASELINE_DIR = os.path.join(HERE, 'benchmarks')
+FRAME_SIZE = (1280, 720)
+
+# Per-stage latency: (from, to) timestamps of an item
+STAGES = {
+    'detect': ('arrived_at', 'detected_at'),
+    'classify': ('detected_at', 'classified_at'),
+    'actuate': ('classified_at', 'actuated_at'),
+    'record': ('actuated_at', 'recorded_at'),
+    'end_to_end': ('arrived_at', 'recorded_at'),
+}
+# Item timestamps kept per sorted item
+TIMESTAMPS = ('detected_at', 'classified_at', 'dispatched_at', 'actuated_at', 'recorded_at')
+# Compared metrics where higher is better; for the rest lower is
+HIGHER_IS_BETTER = {'items_per_min'}
+# Latency changes smaller than this are noise, whatever their relative size
+MIN_DELTA_S = 0.05
+
+
+class ReplayFeed:
+    """
+    Recorded frames played back as the unit's camera: the empty chamber
+    until an item is put in, then that item until the mechanism has
+    compressed it. Each frame gets a little sensor noise.
+    """
+
+    def __init__(self, background, items, fps=30.0, noise=2.0, variants=8, seed=0):
+        rng = np.random.default_rng(seed)
+
+        def noisy(frame):
+            return [np.clip(frame + rng.normal(0.0, noise, frame.shape), 0, 255).astype(np.uint8)
+                    for _ in range(variants)]
+
+        self.background = noisy(background)
+        self.items = [noisy(frame) for frame in items]
+        self.interval = 1.0 / fps
+        self.lock = threading.Lock()
+        self.current = None  # Frames of the item in the chamber
+        self.put_in = 0
+        self.reads = 0
+
+    def put_item(self):
+        with self.lock:
+            self.current = self.items[self.put_in % len(self.items)]
+            self.put_in += 1
+
+    def clear(self):
+        with self.lock:
+            self.current = None
+
+    def occupied(self):
+        return self.current is not None
+
+    def frame(self):
+        with self.lock:
+            frames = self.current or self.background
+            self.reads += 1
+            return frames[self.reads % len(frames)].copy()
+
+    def open(self, *args, **kwargs):
+        """Stands in for cv2.VideoCapture"""
+        return ReplayCapture(self)
+
+
+class ReplayCapture:
+    """cv2.VideoCapture over a ReplayFeed; reads block until the next frame is due"""
+
+    def __init__(self, feed):
+        self.feed = feed
+        self.opened = True
+        self.next_at = time.monotonic()
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        delay = self.next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_at = max(self.next_at + self.feed.interval, time.monotonic())
+        return True, self.feed.frame()
+
+    def set(self, *args):
+        return True
+
+    def get(self, *args):
+        return 0.0
+
+    def release(self):
+        self.opened = False
+
+
+def load_frames(frames_dir):
+    """
+    (background, item frames) from a directory of captures. background.jpg
+    is the empty chamber; without one a plain frame in the captures'
+    median colour stands in for it.
+    """
+    paths = sorted(p for p in glob.glob(os.path.join(frames_dir, '*'))
+                   if p.lower().endswith(('.jpg', '.jpeg', '.png')))
+    background_path = next((p for p in paths
+                            if os.path.splitext(os.path.basename(p))[0] == 'background'), None)
+    items = [frame for frame in (cv2.imread(p) for p in paths if p != background_path)
+             if frame is not None]
+    items = [cv2.resize(frame, FRAME_SIZE) for frame in items]
+    if not items:
+        raise RuntimeError(f"No item frames in {frames_dir}")
+    if background_path:
+        background = cv2.resize(cv2.imread(background_path), FRAME_SIZE)
+    else:
+        colour = np.median(np.stack([f.reshape(-1, 3)[::97] for f in items]), axis=(0, 1))
+        background = np.full((FRAME_SIZE[1], FRAME_SIZE[0], 3), colour, dtype=np.uint8)
+    return background, items
+
+
+class ModelClient:
+    """
+    Classifies captures through the mock server's Gemini or OpenAI REST
+    endpoint, in place of the provider SDK (which cannot be pointed at it).
+    """
+
+    def __init__(self, base_url, provider='gemini', timeout=60.0):
+        self.base_url = base_url
+        self.provider = provider
+        self.timeout = timeout
+
+    def request(self, image_path):
+        with open(image_path, 'rb') as f:
+            image = base64.b64encode(f.read()).decode('utf-8')
+        if self.provider == 'gemini':
+            url = f"{self.base_url}/v1beta/models/gemini-1.5-pro-latest:generateContent"
+            payload = {'contents': [{'parts': [
+                {'inline_data': {'mime_type': 'image/jpeg', 'data': image}},
+                {'text': CLASSIFY_PROMPT}]}]}
+        else:
+            url = f"{self.base_url}/v1/chat/completions"
+            payload = {'model': 'gpt-4-vision-preview', 'max_tokens': 1000, 'messages': [
+                {'role': 'user', 'content': [
+                    {'type': 'text', 'text': CLASSIFY_PROMPT},
+                    {'type': 'image_url',
+                     'image_url': {'url': f"data:image/jpeg;base64,{image}"}}]}]}
+        return urllib.request.Request(url, json.dumps(payload).encode(),
+                                      {'Content-Type': 'application/json'})
+
+    def analyze(self, image_path):
+        try:
+            with classifier_request(self.provider), \
+                    urllib.request.urlopen(self.request(image_path), timeout=self.timeout) as r:
+                body = json.load(r)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"Error analyzing image: {e}")
+            return None
+        if self.provider == 'gemini':
+            return body['candidates'][0]['content']['parts'][0]['text']
+        return body['choices'][0]['message']['content']
+
+    def capture_and_classify(self, detector=None):
+        """vision.capture_and_classify against the mock server"""
+        image_path = capture_image(detector=detector)
+        if image_path is None:
+            return "Error: Could not capture image", None
+        return self.analyze(image_path) or "Error: Could not analyze waste", image_path
+
+    async def classify(self, detector):
+        return await asyncio.to_thread(self.capture_and_classify, detector)
+
+    def reset(self):
+        pass  # Every request opens its own connection
+
+
+def summarize(values):
+    """Count, mean and p50/p95/p99/max (seconds) of a list of durations"""
+    if not values:
+        return None
+    cuts = statistics.quantiles(values, n=100, method='inclusive') \
+        if len(values) > 1 else values * 99
+    return {
+        'count': len(values),
+        'mean_s': round(statistics.mean(values), 3),
+        'p50_s': round(cuts[49], 3),
+        'p95_s': round(cuts[94], 3),
+        'p99_s': round(cuts[98], 3),
+        'max_s': round(max(values), 3),
+    }
+
+
+def run_benchmark(items=20, time_scale=0.1, provider='gemini', median_s=1.5, p95_s=4.0,
+                  error_rate=0.0, throughput=False, frames_dir=None, arrival_gap_s=1.0,
+                  fps=30.0, seed=0, timeout_s=None, verbose=False, on_record=None):
+    """
+    Sort items through the real pipeline (detection, supervisor, serial
+    protocol, record worker, event store and capture archive) with the
+    camera, both Arduinos and the model replaced by local stand-ins.
+    The next item is put in arrival_gap_s after the chamber empties.
+    on_record(sorted, dropped) is called after every recorded item.
+    """
+    frames = load_frames(frames_dir or os.path.join(HERE, 'images'))
+    workdir = tempfile.mkdtemp(prefix='sdm-bench-')
+    # Before the imports below: the store and archive take their paths from these
+    os.environ['SDM_DATABASE_FILE'] = os.path.join(workdir, 'events.db')
+    os.environ['SDM_ARCHIVE_DIR'] = os.path.join(workdir, 'archive')
+    from app import create_pipeline, create_supervisor, record_item
+    from change_detection import ChangeDetector
+    from command_manager import CommandManager
+    from event_store import default_store
+
+    cwd = os.getcwd()
+    os.chdir(workdir)  # Captures go to images/ under the working directory
+    boards = start_simulators(time_scale, {'jitter': 0.05}, seed)
+    server = MockModelServer(('127.0.0.1', 0), LatencyModel(median_s, p95_s, seed),
+                             error_rate, seed=seed)
+    server.start()
+    client = ModelClient(server.url, provider)
+    feed = ReplayFeed(*frames, fps=fps, seed=seed)
+    camera = cv2.VideoCapture
+    cv2.VideoCapture = feed.open  # The detector opens its camera through it
+
+    arrivals = []
+    sorted_items = []  # Timestamps only, so long runs stay small
+    dropped = 0
+    done = threading.Event()
+    stop = threading.Event()
+
+    def arrive():
+        while len(arrivals) < items and not stop.is_set():
+            if feed.occupied():
+                stop.wait(0.01)
+            elif not stop.wait(arrival_gap_s):
+                feed.put_item()
+                arrivals.append(time.time())
+
+    def record(item):
+        nonlocal dropped
+        record_item(item)  # Stamps recorded_at
+        if item['result'] is None:
+            dropped += 1
+        else:
+            sorted_items.append({k: item[k] for k in TIMESTAMPS if k in item})
+        if on_record:
+            on_record(len(sorted_items), dropped)
+        if len(sorted_items) >= items:
+            done.set()
+
+    async def drive(supervisor, pipeline):
+        work = asyncio.create_task(supervisor.run(pipeline.run, pipeline.idle))
+        deadline = time.monotonic() + (timeout_s or items * 60)
+        try:
+            while not done.is_set() and not work.done():
+                if time.monotonic() > deadline:
+                    print(f"Benchmark timed out after {len(sorted_items)} items")
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+
+    cmd = None
+    supervisor = None
+    log_path = os.path.join(workdir, 'benchmark.log')
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+    try:
+        with open(log_path, 'w') as log, \
+                contextlib.redirect_stdout(sys.stdout if verbose else log):
+            cmd = CommandManager({
+                'stepper_port': boards["ARDUINO1"].port,
+                'mechanism_port': boards["ARDUINO2"].port,
+                'throughput_mode': throughput,
+                'stats_file': os.path.join(workdir, 'serial_stats.json'),
+            })
+            run_stepper = cmd.run_stepper
+
+            def compress():
+                # Once compressed the item has left the chamber
+                try:
+                    return run_stepper()
+                finally:
+                    feed.clear()
+
+            cmd.run_stepper = compress
+            detector = ChangeDetector(0, name="bench", show_debug=False)
+            supervisor, classify = create_supervisor(cmd, detector, client.classify,
+                                                     reset=client.reset)
+            supervisor.start()
+            pipeline = create_pipeline(cmd, detector, classify=classify)
+            pipeline.record = record
+            arrivals_thread = threading.Thread(target=arrive, name="bench-arrivals", daemon=True)
+            arrivals_thread.start()
+            asyncio.run(drive(supervisor, pipeline))
+            default_store.flush()
+    finally:
+        stop.set()
+        elapsed = time.monotonic() - started
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        cv2.VideoCapture = camera
+        with open(log_path, 'a') as log, contextlib.redirect_stdout(log):
+            if supervisor:
+                supervisor.stop()
+            if cmd:
+                cmd.close()
+        server.shutdown()
+        server.server_close()
+        for board in boards.values():
+            board.stop()
+        os.chdir(cwd)
+
+    # Dropped classifications leave the item in; it is detected again
+    for item, arrived_at in zip(sorted_items, arrivals):
+        item['arrived_at'] = arrived_at
+    span = (sorted_items[-1]['recorded_at'] - sorted_items[0]['arrived_at']) \
+        if sorted_items else 0.0
+    cpu_s = (usage_after.ru_utime - usage_before.ru_utime
+             + usage_after.ru_stime - usage_before.ru_stime)
+    results = {
+        'config': {
+            'items': items, 'time_scale': time_scale, 'provider': provider,
+            'model_median_s': median_s, 'model_p95_s': p95_s, 'error_rate': error_rate,
+            'throughput': throughput, 'arrival_gap_s': arrival_gap_s, 'fps': fps,
+            'seed': seed,
+        },
+        'sorted': len(sorted_items),
+        'dropped': dropped,
+        'elapsed_s': round(elapsed, 2),
+        'items_per_min': round(len(sorted_items) / span * 60, 2) if span else 0.0,
+        'stages': {name: summarize([item[end] - item[start] for item in sorted_items
+                                    if start in item and end in item])
+                   for name, (start, end) in STAGES.items()},
+        'model': dict(summarize(list(server.latencies)) or {}, errors=server.errors),
+        'serial': cmd.stats.snapshot() if cmd else {},
+        'cpu_percent': round(cpu_s / elapsed * 100, 1) if elapsed else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(usage_after.ru_maxrss / 1024, 1),
+        'frames_read': feed.reads,
+        'log': log_path,
+    }
+    return results, workdir
+
+
+def metrics(results):
+    """Flat {name: value} of the results compared against baselines"""
+    flat = {
+        'items_per_min': results['items_per_min'],
+        'cpu_percent': results['cpu_percent'],
+        'peak_rss_mb': results['peak_rss_mb'],
+    }
+    for name, summary in list(results['stages'].items()) + [('model', results['model'])]:
+        if summary and 'p50_s' in summary:
+            for key in ('p50_s', 'p95_s', 'p99_s'):
+                flat[f"{name}.{key}"] = summary[key]
+    return flat
+
+
+def compare(baseline, results, tolerance=0.1):
+    """
+    [(metric, baseline, current, relative change, regressed)] for the
+    metrics in both; a metric regressed when it got worse by more than
+    tolerance (relative), and latencies also by more than MIN_DELTA_S.
+    """
+    before, after = metrics(baseline), metrics(results)
+    rows = []
+    for name in before:
+        if name not in after:
+            continue
+        old, new = before[name], after[name]
+        change = (new - old) / old if old else 0.0
+        worse = -change if name in HIGHER_IS_BETTER else change
+        noise = name.endswith('_s') and abs(new - old) <= MIN_DELTA_S
+        rows.append((name, old, new, change, worse > tolerance and not noise))
+    return rows
+
+
+def print_report(results):
+    print("\nEnd-to-end benchmark")
+    print("====================")
+    config = results['config']
+    print(f"Provider: {config['provider']} (median {config['model_median_s']} s, "
+          f"p95 {config['model_p95_s']} s, errors {config['error_rate']:.0%}); "
+          f"mode: {'throughput' if config['throughput'] else 'one item at a time'}; "
+          f"hardware x{1 / config['time_scale']:.0f} speed")
+    print(f"Sorted {results['sorted']} items, dropped {results['dropped']} classifications "
+          f"in {results['elapsed_s']:.1f} s: {results['items_per_min']:.1f} items/min")
+    print(f"\n{'Stage':<12} {'n':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, summary in list(results['stages'].items()) + [('model', results['model'])]:
+        if summary and 'p50_s' in summary:
+            print(f"{name:<12} {summary['count']:>4} {summary['p50_s']:>7.3f}s "
+                  f"{summary['p95_s']:>7.3f}s {summary['p99_s']:>7.3f}s {summary['max_s']:>7.3f}s")
+    print(f"\nModel errors: {results['model']['errors']}")
+    # The simulators and mock server run in this process too
+    print(f"CPU: {results['cpu_percent']:.1f}% of one core (including the stand-ins), "
+          f"peak RSS {results['peak_rss_mb']:.1f} MB")
+
+
+def print_comparison(rows, name, tolerance):
+    print(f"\nAgainst baseline '{name}' (tolerance {tolerance:.0%})")
+    print(f"{'Metric':<22} {'baseline':>10} {'current':>10} {'change':>8}")
+    for metric, old, new, change, regressed in rows:
+        print(f"{metric:<22} {old:>10.3f} {new:>10.3f} {change:>+7.1%}"
+              + ("  ⚠️ regression" if regressed else ""))
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(name)
+    with open(path, 'w') as f:
+        json.dump({k: v for k, v in results.items() if k != 'log'}, f, indent=4)
+    return path
+
+
+def load_baseline(name):
+    with open(baseline_path(name), 'r') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end benchmark against a replayed camera, simulated "
+                    "Arduinos and a mock model server")
+    parser.add_argument('--items', type=int, default=20, help="Items to sort")
+    parser.add_argument('--time-scale', type=float, default=0.1,
+                        help="Multiply the simulated hardware delays (0.1 = 10x faster)")
+    parser.add_argument('--provider', choices=['gemini', 'openai'], default='gemini')
+    parser.add_argument('--median-s', type=float, default=1.5, help="Median model latency")
+    parser.add_argument('--p95-s', type=float, default=4.0, help="95th percentile model latency")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of model requests that fail")
+    parser.add_argument('--throughput', action='store_true', help="Use throughput mode")
+    parser.add_argument('--frames', help="Directory of captures to replay (default: images/)")
+    parser.add_argument('--arrival-gap-s', type=float, default=1.0,
+                        help="Seconds from the chamber emptying to the next item")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save-baseline', metavar='NAME',
+                        help="Save the results as benchmarks/NAME.json")
+    parser.add_argument('--compare', metavar='NAME',
+                        help="Compare with benchmarks/NAME.json; exits 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="Relative change that counts as a regression")
+    parser.add_argument('--keep', action='store_true',
+                        help="Keep the working directory (log, database, archive)")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's output")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.compare) if args.compare else None
+    results, workdir = run_benchmark(
+        args.items, args.time_scale, args.provider, args.median_s, args.p95_s,
+        args.error_rate, args.throughput, args.frames, args.arrival_gap_s,
+        seed=args.seed, verbose=args.verbose)
+    print_report(results)
+    if args.keep:
+        print(f"Working directory: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        print(f"\nBaseline saved to {save_baseline(args.save_baseline, results)}")
+    if baseline:
+        if baseline['config'] != results['config']:
+            print("\n⚠️ Baseline was run with a different configuration")
+        rows = compare(baseline, results, args.tolerance)
+        print_comparison(rows, args.compare, args.tolerance)
+        if any(row[4] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
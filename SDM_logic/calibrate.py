@@ -0,0 +1,228 @@
+import argparse
+import math
+import statistics
+import time
+from datetime import datetime
+from itertools import product
+
+from change_detection import ChangeDetector
+from command_manager import CommandManager
+from tuning import load_profile, save_profile
+from unit_registry import UNITS_FILE, load_units
+
+# Candidate detection settings tried against the recordings
+PIXEL_THRESHOLDS = [15, 20, 25, 30, 40, 50]
+MIN_AREAS = [200, 500, 1000, 2000, 4000, 8000]
+CHANGE_THRESHOLDS = [0.002, 0.005, 0.01, 0.02, 0.03, 0.05, 0.08]
+
+# Mechanism routines timed by --mechanism, with the board that runs them
+# (RESTART waits for the next item, so it cannot be timed)
+ROUTINES = [("COMPRESS", "arduino1"), ("BR", "arduino2"), ("BNR", "arduino2"),
+            ("NBR", "arduino2"), ("NBNR", "arduino2"), ("FLUSH", "arduino2"),
+            ("disk_reset", "arduino2")]
+# Completion timeout: slowest measured run x TIMEOUT_FACTOR + TIMEOUT_MARGIN_S
+TIMEOUT_FACTOR = 1.5
+TIMEOUT_MARGIN_S = 2.0
+
+
+def record(detector, seconds, interval):
+    """
+    Read frames for seconds and measure each against the reference frame
+    at every candidate pixel threshold.
+    Returns [(t, {pixel_threshold: (change factor, largest area)})].
+    """
+    samples = []
+    start = time.monotonic()
+    while (t := time.monotonic() - start) < seconds:
+        frame = detector.read_frame()
+        if frame is not None:
+            features = {}
+            for pixel_threshold in PIXEL_THRESHOLDS:
+                change_factor, largest_area, _, _ = detector.measure(frame, pixel_threshold)
+                features[pixel_threshold] = (change_factor, largest_area)
+            samples.append((t, features))
+        time.sleep(max(0.0, interval - (time.monotonic() - start - t)))
+    return samples
+
+
+def find_onset(samples, idle, quantile=0.9):
+    """
+    When the item appeared in a drop recording: the first frame from which
+    on every frame changed more than most idle frames (at the most
+    sensitive pixel threshold). The item stays in, so flicker and other
+    short changes before it are not taken for it. None if the drop is
+    indistinguishable from idle.
+    """
+    pixel_threshold = PIXEL_THRESHOLDS[0]
+    idle_changes = sorted(f[pixel_threshold][0] for _, f in idle)
+    ceiling = idle_changes[int(quantile * (len(idle_changes) - 1))] if idle_changes else 0.0
+    onset = None
+    for t, features in samples:
+        if features[pixel_threshold][0] <= ceiling:
+            onset = None
+        elif onset is None:
+            onset = t
+    return onset
+
+
+def evaluate(idle, drops, pixel_threshold, min_area, change_threshold):
+    """
+    How one candidate does on the recordings: frames that would trigger
+    with no item present, drops it misses, and its mean trigger latency
+    (seconds after the item appeared).
+    """
+    def triggers(features):
+        change_factor, largest_area = features[pixel_threshold]
+        return change_factor > change_threshold and largest_area > min_area
+
+    # Frames of a drop recording before the item appeared are idle too
+    quiet = [f for _, f in idle] + [f for onset, samples in drops
+                                    for t, f in samples if t < onset]
+    latencies = []
+    missed = 0
+    for onset, samples in drops:
+        hit = next((t for t, f in samples if t >= onset and triggers(f)), None)
+        if hit is None:
+            missed += 1
+        else:
+            latencies.append(hit - onset)
+    return {
+        'pixel_threshold': pixel_threshold,
+        'min_area': min_area,
+        'change_threshold': change_threshold,
+        'false_triggers': sum(triggers(f) for f in quiet),
+        'idle_frames': len(quiet),
+        'missed': missed,
+        'latency_s': round(statistics.mean(latencies), 3) if latencies else None,
+    }
+
+
+def choose(candidates):
+    """
+    Best candidate: no missed drops, then fewest false triggers, then
+    lowest latency (to the frame interval). Among equals the one in the
+    middle of their range (geometrically) wins, leaving margin both for
+    smaller items and for lighting changes.
+    """
+    def score(c):
+        latency = c['latency_s'] if c['latency_s'] is not None else float('inf')
+        return c['missed'], c['false_triggers'], round(latency, 1)
+
+    best = min(score(c) for c in candidates)
+    tied = [c for c in candidates if score(c) == best]
+    keys = ('pixel_threshold', 'min_area', 'change_threshold')
+    centre = {k: (math.log(min(c[k] for c in tied)) + math.log(max(c[k] for c in tied))) / 2
+              for k in keys}
+    return min(tied, key=lambda c: sum(abs(math.log(c[k]) - centre[k]) for k in keys))
+
+
+def calibrate_detection(unit, idle_s, drops, drop_window_s, interval):
+    detector = ChangeDetector(unit['camera'], name=unit['code'], show_debug=False)
+    try:
+        input("Empty the chamber and close the lid, then press Enter...")
+        detector.capture_reference_frame()
+        print(f"Recording {idle_s:.0f} s with nothing in the chamber...")
+        idle = record(detector, idle_s, interval)
+
+        recordings = []
+        for i in range(drops):
+            input(f"\nDrop {i + 1}/{drops}: press Enter, then put an item in...")
+            samples = record(detector, drop_window_s, interval)
+            onset = find_onset(samples, idle)
+            if onset is None:
+                print("No change seen; drop not counted")
+            else:
+                recordings.append((onset, samples))
+                print(f"Item appeared {onset:.1f} s after Enter")
+            input("Take the item out and press Enter...")
+    finally:
+        detector.release_camera()
+
+    if not recordings:
+        raise RuntimeError("No usable drop recordings; nothing to calibrate")
+
+    candidates = [evaluate(idle, recordings, *settings) for settings in
+                  product(PIXEL_THRESHOLDS, MIN_AREAS, CHANGE_THRESHOLDS)]
+    best = choose(candidates)
+    current = evaluate(idle, recordings, 25, 500, unit['change_threshold'])
+
+    print("\nDetection calibration")
+    print("=====================")
+    print(f"Idle frames: {best['idle_frames']}, drops: {len(recordings)}")
+    for label, c in (("Current", current), ("Chosen", best)):
+        latency = f"{c['latency_s']:.2f} s" if c['latency_s'] is not None else "n/a"
+        print(f"{label:<8} pixel {c['pixel_threshold']:>3}, area {c['min_area']:>5}, "
+              f"change {c['change_threshold']:.3f}: {c['false_triggers']} false triggers, "
+              f"{c['missed']} missed, latency {latency}")
+    if best['missed']:
+        print("⚠️ No setting caught every drop; check the camera position and lighting")
+    return dict(best, idle_s=idle_s, drops=len(recordings))
+
+
+def calibrate_mechanism(unit, runs):
+    """Time each mechanism routine runs times; returns (durations, completion timeouts)"""
+    cmd = CommandManager(unit['ports'])
+    try:
+        if not all(cmd.completions.values()):
+            raise RuntimeError("Firmware does not report completions; "
+                               "routines cannot be timed")
+        input("Make sure the chamber and disk are empty, then press Enter...")
+        boards = {'arduino1': cmd.arduino1, 'arduino2': cmd.arduino2}
+        durations = {}
+        for command, board in ROUTINES:
+            times = []
+            for _ in range(runs):
+                start = time.monotonic()
+                # Generous timeout: the routine is being measured, not policed
+                cmd.complete(boards[board], command, timeout=120)
+                times.append(round(time.monotonic() - start, 2))
+            durations[command] = times
+            print(f"{command:<10} {', '.join(f'{t:.2f}' for t in times)} s")
+    finally:
+        cmd.close()
+
+    timeouts = {command: round(max(times) * TIMEOUT_FACTOR + TIMEOUT_MARGIN_S, 1)
+                for command, times in durations.items()}
+    return durations, timeouts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrate a unit's detection thresholds and mechanism timeouts")
+    parser.add_argument('--units', default=UNITS_FILE, help="Unit registry (JSON)")
+    parser.add_argument('--unit', help="Bin code to calibrate (default: the first unit)")
+    parser.add_argument('--idle-s', type=float, default=60.0,
+                        help="Seconds to record with nothing in the chamber")
+    parser.add_argument('--drops', type=int, default=5, help="Items to drop in")
+    parser.add_argument('--drop-window-s', type=float, default=6.0,
+                        help="Seconds recorded for each drop")
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help="Seconds between recorded frames")
+    parser.add_argument('--no-detection', action='store_true',
+                        help="Keep the detection thresholds of the current profile")
+    parser.add_argument('--mechanism', action='store_true',
+                        help="Also time the mechanism routines (moves the hardware)")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per mechanism routine")
+    args = parser.parse_args()
+
+    units, _ = load_units(args.units)
+    unit = next((u for u in units if u['code'] == args.unit), None) if args.unit else units[0]
+    if unit is None:
+        parser.error(f"Unknown unit {args.unit}")
+
+    print(f"Calibrating {unit['code']} ({unit['location']})")
+    profile = load_profile(unit['code'])
+    if not args.no_detection:
+        profile['detection'] = calibrate_detection(
+            unit, args.idle_s, args.drops, args.drop_window_s, args.interval)
+    if args.mechanism:
+        print("\nTiming mechanism routines...")
+        profile['mechanism_s'], profile['completion_timeouts'] = \
+            calibrate_mechanism(unit, args.runs)
+    profile['calibrated_at'] = datetime.now().isoformat(timespec='seconds')
+    print(f"\nProfile saved to {save_profile(unit['code'], profile)}; "
+          f"the unit uses it from its next start")
+
+
+if __name__ == "__main__":
+    main()
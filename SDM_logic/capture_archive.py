@@ -0,0 +1,231 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+import cv2
+
+from event_store import DATABASE_FILE, connect, migrate
+from paths import data_path
+
+ARCHIVE_DIR = os.environ.get('SDM_ARCHIVE_DIR', data_path('archive'))
+
+# WebP where OpenCV was built with it, JPEG otherwise
+THUMB_EXT = '.webp' if cv2.haveImageWriter('thumb.webp') else '.jpg'
+THUMB_PARAMS = [cv2.IMWRITE_WEBP_QUALITY, 60] if THUMB_EXT == '.webp' \
+    else [cv2.IMWRITE_JPEG_QUALITY, 70]
+
+
+def file_hash(path):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CaptureArchive:
+    """
+    Archive of item captures on the device.
+
+    Captures are stored once per content hash, under a directory per day
+    (captures/YYYY/MM/DD/<hash>.jpg), with a small thumbnail written at
+    ingest (thumbs/YYYY/MM/DD/<hash>.webp). The index lives in the event
+    store database, and events refer to their capture by hash.
+
+    Retention runs in a background thread: captures not seen for
+    max_age_days are deleted, then the least recently seen ones until the
+    archive fits in max_bytes, and finally files missing from the index
+    and empty day directories are removed.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR, db_path=DATABASE_FILE, max_bytes=1 << 30,
+                 max_age_days=90, thumb_width=160, compact_interval=600):
+        self.root = root
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.thumb_width = thumb_width
+        self.compact_interval = compact_interval
+        self.local = threading.local()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.db_path)
+            migrate(conn)
+        return conn
+
+    def full_path(self, relative):
+        return os.path.join(self.root, relative) if relative else None
+
+    # Ingest
+    def ingest(self, image_path, ts=None):
+        """
+        Archive a capture; the source file is moved into the archive (or
+        left alone if the same content is archived already). Returns the
+        capture (see lookup) or None if it could not be archived.
+        """
+        ts = time.time() if ts is None else ts
+        try:
+            digest = file_hash(image_path)
+            conn = self.connection()
+            with conn:
+                updated = conn.execute(
+                    "UPDATE captures SET last_seen = max(last_seen, ?) WHERE hash = ?",
+                    (ts, digest)).rowcount
+            if updated:
+                return self.lookup(digest)
+
+            day = time.strftime('%Y/%m/%d', time.localtime(ts))
+            ext = os.path.splitext(image_path)[1] or '.jpg'
+            path = os.path.join('captures', day, digest + ext)
+            thumb = os.path.join('thumbs', day, digest + THUMB_EXT)
+            os.makedirs(os.path.dirname(self.full_path(path)), exist_ok=True)
+            shutil.move(image_path, self.full_path(path))
+            if not self.write_thumbnail(self.full_path(path), self.full_path(thumb)):
+                thumb = None
+
+            size = sum(os.path.getsize(self.full_path(p)) for p in (path, thumb) if p)
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO captures (hash, path, thumb, size, first_seen, "
+                    "last_seen) VALUES (?, ?, ?, ?, ?, ?)",
+                    (digest, path, thumb, size, ts, ts))
+            return self.lookup(digest)
+
+        except Exception as e:
+            print(f"Error archiving {image_path}: {e}")
+            return None
+
+    def write_thumbnail(self, image_path, thumb_path):
+        frame = cv2.imread(image_path)
+        if frame is None:
+            return False
+        height, width = frame.shape[:2]
+        size = (self.thumb_width, max(1, round(height * self.thumb_width / width)))
+        thumb = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        # Written next to the target and renamed, so readers never see half a file
+        tmp_path = f"{thumb_path}.tmp{THUMB_EXT}"
+        if not cv2.imwrite(tmp_path, thumb, THUMB_PARAMS):
+            return False
+        os.replace(tmp_path, thumb_path)
+        return True
+
+    def lookup(self, digest):
+        """Capture by hash: hash, path and thumb (absolute), size, first/last seen"""
+        if not digest:
+            return None
+        row = self.connection().execute(
+            "SELECT * FROM captures WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        capture = dict(row)
+        capture['path'] = self.full_path(capture['path'])
+        capture['thumb'] = self.full_path(capture['thumb'])
+        return capture
+
+    # Retention
+    def start(self):
+        """Run retention and compaction every compact_interval seconds"""
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name="capture-archive",
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting capture archive: {e}")
+
+    def compact(self, now=None):
+        """Apply retention, then remove unindexed files and empty directories"""
+        counts = self.enforce_retention(now)
+        counts['orphans'] = self.remove_orphans()
+        return counts
+
+    def enforce_retention(self, now=None):
+        """Delete expired captures, then the oldest until under max_bytes"""
+        now = time.time() if now is None else now
+        conn = self.connection()
+        counts = {'expired': 0, 'evicted': 0, 'bytes_freed': 0}
+
+        expired = conn.execute(
+            "SELECT hash, path, thumb, size FROM captures WHERE last_seen < ?",
+            (now - self.max_age_days * 86400,)).fetchall()
+        for row in expired:
+            self.delete(row)
+            counts['expired'] += 1
+            counts['bytes_freed'] += row['size']
+
+        total = conn.execute("SELECT coalesce(sum(size), 0) FROM captures").fetchone()[0]
+        if total > self.max_bytes:
+            for row in conn.execute(
+                    "SELECT hash, path, thumb, size FROM captures ORDER BY last_seen"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.delete(row)
+                total -= row['size']
+                counts['evicted'] += 1
+                counts['bytes_freed'] += row['size']
+        return counts
+
+    def delete(self, row):
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM captures WHERE hash = ?", (row['hash'],))
+        for relative in (row['path'], row['thumb']):
+            if relative and os.path.exists(self.full_path(relative)):
+                os.remove(self.full_path(relative))
+
+    def remove_orphans(self, min_age_s=3600):
+        """
+        Remove files the index does not know (left by a crash mid-ingest)
+        and empty day directories. Files younger than min_age_s may still
+        be being ingested and are kept.
+        """
+        conn = self.connection()
+        removed = 0
+        for top in ('captures', 'thumbs'):
+            column = 'path' if top == 'captures' else 'thumb'
+            for dirpath, dirnames, filenames in os.walk(self.full_path(top), topdown=False):
+                for filename in filenames:
+                    full = os.path.join(dirpath, filename)
+                    relative = os.path.relpath(full, self.root)
+                    if time.time() - os.path.getmtime(full) < min_age_s:
+                        continue
+                    # File names are <hash><ext>
+                    digest = os.path.splitext(filename)[0]
+                    row = conn.execute(
+                        f"SELECT {column} FROM captures WHERE hash = ?", (digest,)).fetchone()
+                    if row is None or row[0] != relative:
+                        os.remove(full)
+                        removed += 1
+                if dirpath != self.full_path(top) and not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+        return removed
+
+    def usage(self):
+        """Number of captures and bytes used"""
+        count, size = self.connection().execute(
+            "SELECT count(*), coalesce(sum(size), 0) FROM captures").fetchone()
+        return {'captures': count, 'bytes': size}
+
+
+# Archive used by app.py, multi_unit.py and the dashboard
+default_archive = CaptureArchive()
@@ -1,4 +1,4 @@
-from change_detection import detect_new_object, capture_reference_frame
+from change_detection import detect_new_object, capture_reference_frame, release_camera
 from time import sleep
 
 # Capture the reference frame before checking for new objects
@@ -6,6 +6,7 @@ capture_reference_frame()
 
 while True:
     if detect_new_object(0.01):
+        release_camera()
         print("🔴 Object detected, camera released!")
         break  # Stop loop after detection
     else:
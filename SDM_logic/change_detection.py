@@ -1,10 +1,15 @@
 import cv2
 import numpy as np
+import os
+import threading
 import time
 
-# Global variables
-reference_frame = None
-cap = None  # Global camera instance
+# Debug windows of the single-bin detector; set to 0 on headless units
+SHOW_DEBUG = os.environ.get('SDM_SHOW_DEBUG', '1') == '1'
+
+
+class CameraError(RuntimeError):
+    """The camera could not be opened or stopped delivering frames"""
 
 
 def find_camera():
@@ -23,100 +28,241 @@ def find_camera():
         except:
             continue
 
-    raise RuntimeError("❌ No working camera found!")
+    raise CameraError("❌ No working camera found!")
 
 
-def init_camera():
-    """Initialize the camera only once and keep it open globally."""
-    global cap
-    if cap is None:
-        camera_port = find_camera()
-        cap = cv2.VideoCapture(camera_port)
-        time.sleep(2)  # Allow camera to stabilize
+def preprocess(frame):
+    """Grayscale and blur a frame for comparison with the reference frame"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(gray, (21, 21), 0)
 
 
-def capture_reference_frame():
-    """Capture a reference frame and preprocess it."""
-    global reference_frame, cap
+def change_features(reference_frame, gray_frame, pixel_threshold=25):
+    """
+    Compare a preprocessed frame with the reference frame.
+    Returns (change factor, largest changed area in pixels, diff, thresholded):
+    the change factor is the fraction of pixels that differ by more than
+    pixel_threshold.
+    """
+    # Compute absolute difference between reference frame and new frame
+    frame_diff = cv2.absdiff(reference_frame, gray_frame)
+
+    # Apply threshold to highlight differences
+    _, thresh = cv2.threshold(frame_diff, pixel_threshold, 255, cv2.THRESH_BINARY)
 
-    if cap is None:
-        init_camera()  # Ensure the camera is initialized
+    # Compute the change factor (percentage of changed pixels)
+    change_factor = float(np.count_nonzero(thresh) / (thresh.shape[0] * thresh.shape[1]))
 
-    ret, frame = cap.read()
-    if not ret:
-        raise RuntimeError("❌ Could not capture reference frame")
+    # Find contours (objects that changed)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    largest_area = max((cv2.contourArea(c) for c in contours), default=0.0)
+    return change_factor, largest_area, frame_diff, thresh
 
-    # Convert to grayscale and apply Gaussian blur
-    reference_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    reference_frame = cv2.GaussianBlur(reference_frame, (21, 21), 0)
 
-    print("📸 Reference frame captured!")
+class ChangeDetector:
+    """Reference-frame change detection for one camera."""
 
+    def __init__(self, camera_port=None, name=None, show_debug=True,
+                 max_read_failures=5, pixel_threshold=25, min_area=500):
+        """
+        camera_port: camera index to use, or None to pick the first working one.
+        name: shown in debug window titles so several units can run side by side.
+        max_read_failures: consecutive failed reads before detect_new_object
+                           raises CameraError instead of returning False.
+        pixel_threshold: grey level difference at which a pixel counts as changed.
+        min_area: changed area (pixels) an object must cover to be detected.
+                  Both can be calibrated per unit (see calibrate.py).
+        """
+        self.camera_port = camera_port
+        self.name = name
+        self.show_debug = show_debug
+        self.max_read_failures = max_read_failures
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.reference_frame = None
+        self.cap = None
+        self.read_failures = 0
+        # Detection runs in worker threads; a restart must not release mid-read
+        self.lock = threading.RLock()
+        # Called with every frame read for detection (e.g. the live view)
+        self.frame_listener = None
 
-def detect_new_object(change_threshold=0.01):
-    """
-    Detect if a new object has appeared in the frame.
+    def init_camera(self):
+        """Initialize the camera only once and keep it open."""
+        with self.lock:
+            if self.cap is None:
+                if self.camera_port is None:
+                    self.camera_port = find_camera()
+                self.cap = cv2.VideoCapture(self.camera_port)
+                if not self.cap.isOpened():
+                    self.cap = None
+                    raise CameraError(f"❌ Could not open camera {self.camera_port}")
+                self.wait_until_settled()
 
-    change_threshold: Determines how much of the frame must change to trigger detection.
-                      Example: 0.01 means 1% of the frame must change.
-    """
-    global reference_frame, cap
+    def wait_until_settled(self, max_wait=2.0, tolerance=1.0, steady_frames=3):
+        """
+        Read frames until auto exposure has settled (mean brightness within
+        tolerance for steady_frames reads in a row), at most max_wait
+        seconds, instead of always sleeping max_wait.
+        """
+        deadline = time.monotonic() + max_wait
+        previous, steady = None, 0
+        while time.monotonic() < deadline:
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.05)
+                continue
+            brightness = cv2.mean(frame)[0]
+            steady = steady + 1 if previous is not None and \
+                abs(brightness - previous) < tolerance else 0
+            if steady >= steady_frames:
+                return
+            previous = brightness
 
-    if reference_frame is None:
-        raise ValueError(
-            "❌ Reference frame not set. Call capture_reference_frame() first.")
+    def capture_still(self):
+        """
+        Frame of a detected item from the open camera, read once the picture
+        has settled (the item may still be moving), or None if the read failed.
+        """
+        with self.lock:
+            if self.cap is None:
+                self.init_camera()
+            self.wait_until_settled()
+            ret, frame = self.cap.read()
+        return frame if ret else None
 
-    if cap is None:
-        init_camera()  # Ensure camera is initialized
+    def healthy(self):
+        """False once reads keep failing"""
+        return self.read_failures < self.max_read_failures
 
-    ret, frame = cap.read()
-    if not ret:
-        return False  # Could not capture a new frame
+    def reopen(self):
+        """Reopen the camera at the known port, keeping the reference frame."""
+        with self.lock:
+            self.release_camera()
+            self.read_failures = 0
+            self.init_camera()
 
-    # Convert new frame to grayscale and apply Gaussian blur
-    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    gray_frame = cv2.GaussianBlur(gray_frame, (21, 21), 0)
+    def capture_reference_frame(self):
+        """Capture a reference frame and preprocess it."""
+        with self.lock:
+            if self.cap is None:
+                self.init_camera()  # Ensure the camera is initialized
 
-    # Compute absolute difference between reference frame and new frame
-    frame_diff = cv2.absdiff(reference_frame, gray_frame)
+            ret, frame = self.cap.read()
+        if not ret:
+            raise CameraError("❌ Could not capture reference frame")
 
-    # Apply threshold to highlight differences
-    _, thresh = cv2.threshold(
-        frame_diff, 25, 255, cv2.THRESH_BINARY)  # Adjusted threshold
+        # Convert to grayscale and apply Gaussian blur
+        self.reference_frame = preprocess(frame)
 
-    # Compute the change factor (percentage of changed pixels)
-    change_factor = np.count_nonzero(
-        thresh) / (thresh.shape[0] * thresh.shape[1])
+        print(f"📸 Reference frame captured{self.label()}!")
 
-    # Find contours (objects that changed)
-    contours, _ = cv2.findContours(
-        thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    def read_frame(self):
+        """
+        Read one frame, or None if the read failed. Raises CameraError
+        after max_read_failures failed reads in a row.
+        """
+        with self.lock:
+            if self.cap is None:
+                self.init_camera()  # Ensure camera is initialized
 
-    # Debugging: Show processed frames
-    cv2.imshow("Frame Difference", frame_diff)
-    cv2.imshow("Threshold", thresh)
+            ret, frame = self.cap.read()
+        if not ret:
+            self.read_failures += 1
+            if not self.healthy():
+                raise CameraError(
+                    f"❌ Camera{self.label()} failed {self.read_failures} reads in a row")
+            return None  # Could not capture a new frame
+        self.read_failures = 0
+        if self.frame_listener:
+            try:
+                self.frame_listener(frame)
+            except Exception as e:
+                print(f"Frame listener error{self.label()}: {e}")
+        return frame
 
-    # Print debug values
-    print(f"Change Factor: {change_factor:.4f}")
+    def measure(self, frame, pixel_threshold=None):
+        """(change factor, largest changed area, diff, thresholded) of a frame"""
+        return change_features(
+            self.reference_frame, preprocess(frame),
+            self.pixel_threshold if pixel_threshold is None else pixel_threshold)
 
-    # If change factor is above threshold, check for significant contour area
-    if change_factor > change_threshold:
-        for contour in contours:
-            # Lowered area threshold for better detection
-            if cv2.contourArea(contour) > 500:
-                print(f"🚨 New object detected! Change Factor: {
-                      change_factor:.4f}")
-                release_camera()  # Automatically release camera
-                return True  # New object detected
+    def detect_new_object(self, change_threshold=0.01):
+        """
+        Detect if a new object has appeared in the frame.
 
-    return False  # No new object detected
+        change_threshold: Determines how much of the frame must change to trigger detection.
+                          Example: 0.01 means 1% of the frame must change.
+        """
+        if self.reference_frame is None:
+            raise ValueError(
+                "❌ Reference frame not set. Call capture_reference_frame() first.")
+
+        frame = self.read_frame()
+        if frame is None:
+            return False  # Could not capture a new frame
+
+        change_factor, largest_area, frame_diff, thresh = self.measure(frame)
+
+        # Debugging: Show processed frames
+        if self.show_debug:
+            cv2.imshow(f"Frame Difference{self.label()}", frame_diff)
+            cv2.imshow(f"Threshold{self.label()}", thresh)
+            cv2.waitKey(1)  # Handle window events; unhandled ones pile up
+
+        # Print debug values
+        print(f"Change Factor{self.label()}: {change_factor:.4f}")
+
+        # If change factor is above threshold, check for significant contour area
+        if change_factor > change_threshold and largest_area > self.min_area:
+            print(f"🚨 New object detected{self.label()}! Change Factor: {
+                  change_factor:.4f}")
+            # The camera stays open: the classifier captures from it (capture_still)
+            return True  # New object detected
+
+        return False  # No new object detected
+
+    def release_camera(self):
+        """Gracefully release the camera when done."""
+        with self.lock:
+            if self.cap is None:
+                return
+            self.cap.release()
+            self.cap = None
+        if self.show_debug and self.name:
+            # Leave the other units' debug windows open
+            for window in ("Frame Difference", "Threshold"):
+                try:
+                    cv2.destroyWindow(f"{window}{self.label()}")
+                except cv2.error:
+                    pass  # Window was never shown
+        elif self.show_debug:
+            cv2.destroyAllWindows()
+        print(f"📷 Camera released for other programs{self.label()}.")
+
+    def label(self):
+        return f" [{self.name}]" if self.name else ""
+
+
+# Default detector used by the single-bin scripts (app.py, cd_test.py)
+default_detector = ChangeDetector(show_debug=SHOW_DEBUG)
+
+
+def init_camera():
+    """Initialize the default camera only once and keep it open globally."""
+    default_detector.init_camera()
+
+
+def capture_reference_frame():
+    """Capture a reference frame on the default camera."""
+    default_detector.capture_reference_frame()
+
+
+def detect_new_object(change_threshold=0.01):
+    """Detect a new object on the default camera (see ChangeDetector.detect_new_object)."""
+    return default_detector.detect_new_object(change_threshold)
 
 
 def release_camera():
-    """Gracefully release the camera when done."""
-    global cap
-    if cap is not None:
-        cap.release()
-        cap = None
-        cv2.destroyAllWindows()
-        print("📷 Camera released for other programs.")
+    """Gracefully release the default camera when done."""
+    default_detector.release_camera()
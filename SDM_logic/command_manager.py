@@ -1,141 +1,515 @@
-from arduino_port_finder import get_arduino_ports
+from arduino_port_finder import get_arduino_ports, load_port_config, CONFIG_FILE
+from serial_protocol import LEGACY_BAUDRATE, FAST_BAUDRATE, open_channel, wait_for_board
+from telemetry import TelemetryCache, parse_levels
+from serial_stats import SerialStats
+from mechanism_interlock import InterlockError, MechanismInterlock
+from paths import data_path
 import serial
+import serial.tools.list_ports
+import asyncio
+import math
+import os
+import threading
 import time
 import json
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# How long each mechanism routine may take before its completion counts as
+# lost: hardware time plus a margin. None waits indefinitely.
+COMPLETION_TIMEOUTS = {
+    "COMPRESS": 20,     # 11.6 s stroke and return
+    "BR": 15,           # 8 s routing and settling
+    "BNR": 15,
+    "NBR": 15,
+    "NBNR": 15,
+    "FLUSH": 10,        # 4 s with all bin flaps open
+    "disk_reset": 5,
+    "RESTART": None,    # Waits for the user to put the next item in
+}
+
+
+def port_present(port):
+    """True if the device exists (a serial port the OS lists, or a PTY path)"""
+    return os.path.exists(port) or any(
+        p.device == port for p in serial.tools.list_ports.comports())
+
+
+def find_ports():
+    """
+    Port settings from arduino_ports.json. The port finder's scan (1.5 s
+    per port) only runs when no ports are saved or the saved devices are
+    gone; otherwise the handshake in connect() checks the saved ports.
+    """
+    stepper_port, mechanism_port = load_port_config()
+    if not (stepper_port and mechanism_port
+            and port_present(stepper_port) and port_present(mechanism_port)):
+        print("Running port finder...")
+        get_arduino_ports()
+        print("Port finder completed")
+    with open(CONFIG_FILE, 'r') as f:
+        return json.load(f)
+
+
+class CompletionTimeout(TimeoutError):
+    """A mechanism command did not report completion in time"""
+
+
+class Completion:
+    """
+    A mechanism command in flight. wait() blocks until the board reports
+    that the routine finished; asyncio code can await it instead.
+    """
+
+    def __init__(self, command, future):
+        self.command = command
+        self.future = future
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        """Return the completion reply; raises CompletionTimeout or the serial error"""
+        return self.future.result(timeout)
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
 
 
 class CommandManager:
-    def __init__(self):
-        """Initialize serial connections to both Arduinos"""
+    def __init__(self, ports=None):
+        """
+        Initialize serial connections to both Arduinos.
+
+        ports: optional dict with the same keys as arduino_ports.json. When
+        given, those ports are used as-is and the port finder is skipped,
+        which is what a multi-unit host needs: every unit's boards answer
+        ARDUINO1/ARDUINO2, so a port scan could grab another unit's board.
+        """
         try:
-            # Run arduino_port_finder.py and wait for completion
-            print("Running port finder...")
-            subprocess.run(['python3', 'arduino_port_finder.py'], check=True)
-            print("Port finder completed")
-
-            # Read the saved port configuration
-            with open('arduino_ports.json', 'r') as f:
-                data = json.load(f)
-                self.stepper_port = data['stepper_port']
-                self.mechanism_port = data['mechanism_port']
+            # Saved ports (scanning only if needed) unless the caller gives them
+            data = find_ports() if ports is None else ports
+
+            self.stepper_port = data['stepper_port']
+            self.mechanism_port = data['mechanism_port']
+            # "auto" tries the framed protocol first, "text" forces legacy
+            self.protocol = data.get('protocol', 'auto')
+            self.baudrate = data.get('baudrate', FAST_BAUDRATE)
+            # Bin level push period (0 disables telemetry) and how old
+            # a cached reading may be before get_sensor_data asks again
+            self.telemetry_period_ms = data.get('telemetry_period_ms', 5000)
+            self.max_sensor_age = data.get('max_sensor_age_s', 15)
+            # Where and how often to dump serial statistics (0 disables)
+            self.stats_file = data.get('stats_file', data_path('serial_stats.json'))
+            stats_interval = data.get('stats_interval_s', 60)
+            # Throughput mode accepts the next item while the previous one
+            # is routed; route_timeout_s bounds one background routing run
+            self.throughput_requested = data.get('throughput_mode', False)
+            self.route_timeout = data.get('route_timeout_s', 30)
+            self.throughput_mode = False
+            # Per-command completion timeouts (seconds) overriding the defaults
+            self.completion_timeouts = dict(
+                COMPLETION_TIMEOUTS, **data.get('completion_timeouts', {}))
 
             if not self.stepper_port or not self.mechanism_port:
                 raise ConnectionError("Could not find one or both Arduinos")
 
-            # Initialize serial connections
-            self.arduino1 = serial.Serial(self.stepper_port, 9600, timeout=1)
-            self.arduino2 = serial.Serial(self.mechanism_port, 9600, timeout=1)
-
-            # Wait for connections to establish
-            time.sleep(2)
-
-            print(f"Connected to stepper at {self.stepper_port}")
-            print(f"Connected to mechanism at {self.mechanism_port}")
+            # State that outlives a reconnect
+            self.telemetry = TelemetryCache()
+            self.interlock = MechanismInterlock()
+            self.executors = self.create_executors()
+            # Record latency, timeouts, bytes and retries of every command
+            self.stats = SerialStats()
+            if stats_interval > 0:
+                self.stats.start_periodic_dump(self.stats_file, stats_interval)
+            # Consecutive failed commands; the link counts as unhealthy after a few
+            self.link_failures = 0
+
+            self.connect(verify=ports is None)
+            if ports is None and not self.boards_answered:
+                # Saved ports are reused unchecked; a board swap shows up here
+                print("Saved Arduino ports did not answer, running port finder...")
+                self.disconnect()
+                self.stepper_port, self.mechanism_port = get_arduino_ports()
+                if not self.stepper_port or not self.mechanism_port:
+                    raise ConnectionError("Could not find one or both Arduinos")
+                for executor in self.executors.values():
+                    executor.shutdown()
+                self.executors = self.create_executors()
+                self.connect()
 
         except Exception as e:
             print(f"Error during initialization: {e}")
             self.close()  # Close any open connections
             raise
 
-    def send_command(self, arduino, command):
+    def create_executors(self):
+        """Mechanism commands run in order on one thread per board"""
+        return {
+            port: ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+            for port, name in ((self.stepper_port, "arduino1"),
+                               (self.mechanism_port, "arduino2"))
+        }
+
+    def connect(self, verify=False):
+        """
+        Open both serial links, upgrade the protocol and start listening.
+        verify: stop after opening if a board does not answer with its name
+        (boards_answered tells), instead of trying anyway.
+        """
+        # Initialize serial connections (boards always boot in text mode)
+        self.arduino1 = serial.Serial(
+            self.stepper_port, LEGACY_BAUDRATE, timeout=1)
+        self.arduino2 = serial.Serial(
+            self.mechanism_port, LEGACY_BAUDRATE, timeout=1)
+
+        # Opening the ports resets the boards; wait until they answer
+        self.boards_answered = True
+        for arduino, name in ((self.arduino1, "ARDUINO1"), (self.arduino2, "ARDUINO2")):
+            if not wait_for_board(arduino, name):
+                print(f"{name} did not answer after reset"
+                      f"{'' if verify else ', trying anyway'}")
+                self.boards_answered = False
+        if verify and not self.boards_answered:
+            return
+
+        # Upgrade each link to the framed protocol where supported
+        self.channels = {
+            self.arduino1.port: open_channel(
+                self.arduino1, "ARDUINO1", self.protocol, self.baudrate),
+            self.arduino2.port: open_channel(
+                self.arduino2, "ARDUINO2", self.protocol, self.baudrate,
+                on_event=self.handle_mechanism_event),
+        }
+        for channel in self.channels.values():
+            channel.stats = self.stats
+
+        # Boards with current firmware report when each routine has finished
+        self.completions = {
+            arduino.port: self.probe_completions(arduino)
+            for arduino in (self.arduino1, self.arduino2)
+        }
+
+        print(f"Connected to stepper at {self.stepper_port} "
+              f"({self.channels[self.arduino1.port].describe()})")
+        print(f"Connected to mechanism at {self.mechanism_port} "
+              f"({self.channels[self.arduino2.port].describe()})")
+
+        self.start_telemetry(self.telemetry_period_ms)
+        self.throughput_mode = False
+        if self.throughput_requested:
+            self.enable_throughput_mode()
+        if self.telemetry_enabled or self.throughput_mode:
+            self.start_listener()
+        self.link_failures = 0
+
+    def disconnect(self):
+        """Stop listening and close both serial links"""
+        if hasattr(self, 'listener_thread'):
+            self.listener_stop.set()
+            self.listener_thread.join(timeout=1)
+            del self.listener_thread
+        try:
+            if hasattr(self, 'arduino1'):
+                self.arduino1.close()
+            if hasattr(self, 'arduino2'):
+                self.arduino2.close()
+        except serial.SerialException as e:
+            print(f"Error closing connections: {e}")
+
+    def reconnect(self):
+        """
+        Reopen the links to the same ports, without running the port finder
+        again. Reopening resets the boards, so nothing is left mid-routine.
+        """
+        print("Reconnecting to the Arduinos...")
+        self.disconnect()
+        # The boards reset: no item is in the disk any more
+        self.interlock.release_disk()
+        self.connect()
+
+    def link_healthy(self, max_failures=3):
+        """Both ports open and commands are going through"""
+        return (self.arduino1.is_open and self.arduino2.is_open
+                and self.link_failures < max_failures)
+
+    def probe_completions(self, arduino):
+        """True if the board's firmware answers STATUS (and so reports completions)"""
+        reply = self.send_command(arduino, "STATUS")
+        if reply == "IDLE" or (reply or "").startswith("BUSY"):
+            return True
+        print(f"Firmware on {arduino.port} reports no completions, not waiting for routines")
+        return False
+
+    def start_telemetry(self, period_ms):
+        """Ask arduino2 to push bin levels"""
+        self.telemetry_enabled = False
+        if period_ms <= 0:
+            return
+
+        reply = self.send_command(self.arduino2, f"TELEMETRY {period_ms}")
+        if reply != "TELEMETRY ON":
+            print("Mechanism firmware has no telemetry mode, polling with GETD")
+            return
+
+        self.telemetry_enabled = True
+        print(f"Bin level telemetry every {period_ms} ms")
+
+    def enable_throughput_mode(self):
+        """
+        Let arduino2 run the lid from the proximity sensors and route items
+        in the background, so the next item can be put in and classified
+        while the previous one is still being sorted.
+        """
+        reply = self.send_command(self.arduino2, "LID AUTO")
+        if reply != "LID AUTO":
+            print("Mechanism firmware has no throughput mode, sorting one item at a time")
+            return False
+
+        self.throughput_mode = True
+        print("Throughput mode: next item accepted while the previous one is routed")
+        return True
+
+    def start_listener(self):
+        """Listen for events pushed by arduino2 in the background"""
+        self.listener_stop = threading.Event()
+        self.listener_thread = threading.Thread(
+            target=self.listen_events, name="mechanism-events", daemon=True)
+        self.listener_thread.start()
+
+    def listen_events(self):
+        """Pick up pushed bin levels and mechanism events while no command is running"""
+        channel = self.channels[self.arduino2.port]
+        while not self.listener_stop.wait(0.05):
+            try:
+                channel.poll()
+            except serial.SerialException as e:
+                print(f"Event listener stopped: {e}")
+                self.telemetry_enabled = False
+                return
+
+    def handle_mechanism_event(self, message):
+        """Channel event callback for arduino2: bin levels, routing and lid events"""
+        return (self.telemetry.handle_message(message)
+                or self.interlock.handle_message(message))
+
+    def send_command(self, arduino, command, timeout=None):
         """Send a command to the specified Arduino"""
         try:
-            arduino.write(f"{command}\n".encode())
-            arduino.flush()  # Ensure command is sent
-            response = arduino.readline().decode().strip()
-            return response
+            reply = self.channels[arduino.port].request(command, timeout)
         except serial.SerialException as e:
             print(f"Error sending command: {e}")
+            self.link_failures += 1
             return None
+        self.link_failures = 0
+        return reply
+
+    def complete(self, arduino, command, timeout=None):
+        """
+        Send a mechanism command and block until the board reports that
+        the routine finished ("DONE <command>"). timeout defaults to the
+        command's entry in COMPLETION_TIMEOUTS.
+        """
+        channel = self.channels[arduino.port]
+        if not self.completions[arduino.port]:
+            # Old firmware reports nothing; don't wait for the routine
+            return channel.request(command)
+
+        if timeout is None:
+            timeout = self.completion_timeouts.get(command)
+        reply = channel.request(command, math.inf if timeout is None else timeout)
+        if reply != f"DONE {command}":
+            raise CompletionTimeout(
+                f"{command} on {channel.name} did not complete within {timeout} s "
+                f"(reply {reply!r})")
+        return reply
+
+    def submit(self, arduino, command, timeout=None):
+        """Start a mechanism command without waiting; returns a Completion"""
+        future = self.executors[arduino.port].submit(
+            self.complete, arduino, command, timeout)
+        return Completion(command, future)
+
+    def run_command(self, arduino, command, timeout=None):
+        """Run a mechanism command to completion; returns its reply, or None on failure"""
+        try:
+            reply = self.complete(arduino, command, timeout)
+        except (serial.SerialException, CompletionTimeout) as e:
+            print(f"Error running {command}: {e}")
+            self.link_failures += 1
+            return None
+        self.link_failures = 0
+        return reply
+
+    def wait_idle(self, timeout=30):
+        """
+        Wait until both boards have finished their current routine, e.g.
+        before retrying after an error. Returns False on timeout.
+        """
+        if not all(self.completions.values()):
+            time.sleep(2)  # Old firmware reports nothing; give it time
+            return True
+
+        deadline = time.time() + timeout
+        for arduino in (self.arduino1, self.arduino2):
+            # Boards only read STATUS once the running routine has returned
+            reply = self.send_command(arduino, "STATUS", max(deadline - time.time(), 0))
+            if not reply:
+                return False
+            if reply.startswith("BUSY "):
+                # Background routing run (throughput mode)
+                self.interlock.route_running(reply[len("BUSY "):])
+                if not self.wait_routed(max(deadline - time.time(), 0)):
+                    return False
+        return True
 
     # Mechanism Commands (Handled by arduino2)
     def open_br(self):
         """Open Biodegradable & Recyclable bin"""
         print("Opening BR bin command sent")
-        return self.send_command(self.arduino2, "BR")
+        return self.run_command(self.arduino2, "BR")
 
     def open_bnr(self):
         """Open Biodegradable & Non-Recyclable bin"""
         print("Opening BNR bin command sent")
-        return self.send_command(self.arduino2, "BNR")
+        return self.run_command(self.arduino2, "BNR")
 
     def open_nbr(self):
         """Open Non-Biodegradable & Recyclable bin"""
         print("Opening NBR bin command sent")
-        return self.send_command(self.arduino2, "NBR")
+        return self.run_command(self.arduino2, "NBR")
 
     def open_nbnr(self):
         """Open Non-Biodegradable & Non-Recyclable bin"""
         print("Opening NBNR bin command sent")
-        return self.send_command(self.arduino2, "NBNR")
+        return self.run_command(self.arduino2, "NBNR")
+
+    def get_sensor_data(self, max_age=None):
+        """
+        Return the latest bin levels.
+
+        With telemetry on, readings pushed by arduino2 are returned straight
+        from the cache as long as they are at most max_age seconds old
+        (default: max_sensor_age_s from arduino_ports.json). Otherwise a GETD
+        request is sent once and we wait for valid sensor data.
+        """
+        if getattr(self, 'telemetry_enabled', False):
+            values = self.telemetry.get(
+                self.max_sensor_age if max_age is None else max_age)
+            self.stats.record_cache("ARDUINO2", values is not None)
+            if values is not None:
+                return values
+            print("Cached sensor data is stale, requesting fresh values")
 
-    def get_sensor_data(self):
-        """Send request once and wait for valid sensor data before proceeding."""
         print("Sending sensor data request...")
         try:
-            # Set a shorter timeout for the request
-            self.arduino2.timeout = 1
-            self.send_command(self.arduino2, "GETD")  # Send request only once
-
-            print("Waiting for sensor data...")
-            start_time = time.time()
-            timeout = 5  # 5 second timeout
-
-            while (time.time() - start_time) < timeout:
-                if self.arduino2.in_waiting > 0:  # Check if data is available
-                    response = self.arduino2.readline().decode().strip()  # Read available data
-                    if response:
-                        try:
-                            # Convert to integers
-                            values = [int(x) for x in response.split(',')]
-                            print("Received sensor data:", values)
-                            return values  # Return list of integers
-                        except ValueError:
-                            print("Invalid sensor data received, retrying...")
-                time.sleep(0.1)  # Small delay to prevent excessive CPU usage
-
-            # If we get here, we timed out
-            print("Timeout waiting for sensor data")
-            return None
+            # 5 second timeout for the reply
+            response = self.send_command(self.arduino2, "GETD", timeout=5)
+            if not response:
+                print("Timeout waiting for sensor data")
+                return None
+
+            values = parse_levels(response)
+            if values is None:
+                print(f"Invalid sensor data received: {response}")
+                return None
+
+            self.telemetry.update(values)
+            print("Received sensor data:", values)
+            return values  # Return list of integers
 
         except Exception as e:
             print(f"Error getting sensor data: {e}")
             return None
-        finally:
-            # Reset timeout to default
-            self.arduino2.timeout = 1
+
+    # Throughput mode (see mechanism_interlock.MechanismInterlock)
+    def claim_disk(self):
+        """Wait for the previous item to leave the disk, then reserve it"""
+        if not self.interlock.acquire_disk(self.route_timeout):
+            raise InterlockError("Previous item is still in the disk")
+
+    def release_disk(self):
+        """The item is sorted; the next one may be compressed into the disk"""
+        self.interlock.release_disk()
+
+    def hold_lid(self, timeout=None):
+        """Keep the lid closed while compressing; waits for an open lid to close"""
+        reply = self.send_command(self.arduino2, "LID HOLD")
+        if reply == "LID OPEN":
+            self.interlock.set_lid_open(True)
+            print("Waiting for the lid to close...")
+            return self.interlock.wait_lid_closed(timeout)
+        return reply == "LID HELD"
+
+    def release_lid(self):
+        """Let the lid open for the next item"""
+        return self.send_command(self.arduino2, "LID AUTO")
+
+    def wait_lid_closed(self, timeout=None):
+        """True once nobody is putting an item in"""
+        return self.interlock.wait_lid_closed(timeout)
+
+    def route_in_background(self, category_code):
+        """Start routing the item in the disk to its bin without waiting"""
+        self.interlock.route_started(category_code)
+        reply = self.send_command(self.arduino2, f"ROUTE {category_code}")
+        if not reply:
+            # The reply was lost; the board may still have started (or even
+            # finished, if ROUTED already arrived) the routing run
+            status = self.send_command(self.arduino2, "STATUS")
+            if status == f"BUSY {category_code}" or not self.interlock.is_routing():
+                reply = f"ROUTING {category_code}"
+        if reply != f"ROUTING {category_code}":
+            self.interlock.route_finished()
+            raise InterlockError(f"Mechanism did not start routing to {category_code}: {reply}")
+        print(f"Routing to {category_code} bin in the background")
+
+    def wait_routed(self, timeout=None):
+        """Wait for the background routing run to end; False on timeout"""
+        timeout = self.route_timeout if timeout is None else timeout
+        if self.interlock.wait_routed(timeout):
+            return True
+        # The ROUTED event may have been lost; ask the board directly
+        if self.send_command(self.arduino2, "STATUS") == "IDLE":
+            self.interlock.route_finished()
+            return True
+        return False
+
+    def get_stats(self):
+        """Per-board, per-command latency histograms, timeouts, bytes and retries"""
+        return self.stats.snapshot()
 
     def reset_disk(self):
         """Reset disk position"""
         print("Reset disk command sent")
-        return self.send_command(self.arduino2, "disk_reset")
+        return self.run_command(self.arduino2, "disk_reset")
 
     def flush_bins(self):
         """Flush all bins"""
         print("Flush bins command sent")
-        return self.send_command(self.arduino2, "FLUSH")
+        return self.run_command(self.arduino2, "FLUSH")
 
     def restart_mechanism(self):
         """Restart mechanism"""
         print("Restart mechanism command sent")
-        return self.send_command(self.arduino2, "RESTART")
+        return self.run_command(self.arduino2, "RESTART")
 
     # Stepper Commands (Handled by arduino1)
     def run_stepper(self):
         """Run stepper motor"""
         print("Run stepper command sent")
-        return self.send_command(self.arduino1, "COMPRESS")
+        return self.run_command(self.arduino1, "COMPRESS")
 
     def close(self):
         """Close serial connections"""
-        try:
-            if hasattr(self, 'arduino1'):
-                self.arduino1.close()
-            if hasattr(self, 'arduino2'):
-                self.arduino2.close()
-        except serial.SerialException as e:
-            print(f"Error closing connections: {e}")
+        self.disconnect()
+        for executor in getattr(self, 'executors', {}).values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        if hasattr(self, 'stats'):
+            self.stats.stop()
+            try:
+                self.stats.dump(self.stats_file)
+            except OSError as e:
+                print(f"Error writing serial stats: {e}")
 
 
 def test_all_functions():
@@ -149,7 +523,6 @@ def test_all_functions():
             # Close connections
             print("Closing serial connections...")
             cmd.close()
-            time.sleep(1)
 
             # Reinitialize connections
             print("Restarting serial connections...")
@@ -166,19 +539,13 @@ def test_all_functions():
 
         print("\nTesting bins:")
         print("Directed to BR bin", cmd.open_br())
-        time.sleep(2)
         print("Directed to BNR bin", cmd.open_bnr())
-        time.sleep(2)
         print("Directed to NBR bin", cmd.open_nbr())
-        time.sleep(2)
         print("Directed to NBNR bin", cmd.open_nbnr())
-        time.sleep(2)
 
         print("\nTesting system commands:")
         print("Reset disk:", cmd.reset_disk())
-        time.sleep(1)
         print("Flush bins:", cmd.flush_bins())
-        time.sleep(2)
         print("Restart mechanism:", cmd.restart_mechanism())
 
     except Exception as e:
@@ -0,0 +1,294 @@
+import asyncio
+import time
+
+import serial
+
+from change_detection import CameraError
+from mechanism_interlock import InterlockError
+
+
+class Backoff:
+    """Exponential backoff delays: base, 2 x base, 4 x base, ... up to max_delay"""
+
+    def __init__(self, base=0.5, max_delay=60.0, factor=2.0):
+        self.base = base
+        self.max_delay = max_delay
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.base * self.factor ** self.attempts, self.max_delay)
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self.attempts = 0
+
+
+class Component:
+    """
+    One part of a bin unit that can be restarted on its own.
+
+    errors: exception types that mean this component failed.
+    live_restart: True if restart() is safe while the pipeline is running.
+    """
+
+    name = "component"
+    errors = ()
+    live_restart = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def healthy(self):
+        return True
+
+    def settle(self):
+        """Called after another component failed; False if this one needs a restart too"""
+        return True
+
+    def owns(self, exc):
+        return isinstance(exc, self.errors)
+
+
+class SerialLinkComponent(Component):
+    """Serial links to both Arduinos; a restart reopens the same ports"""
+
+    name = "serial"
+    errors = (serial.SerialException, TimeoutError, InterlockError)
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+
+    def stop(self):
+        self.cmd.disconnect()
+
+    def restart(self):
+        self.cmd.reconnect()
+
+    def healthy(self):
+        return self.cmd.link_healthy()
+
+    def settle(self):
+        # Let the boards finish whatever routine was running
+        return self.cmd.wait_idle()
+
+
+class CameraComponent(Component):
+    """Camera session of a ChangeDetector; a restart keeps the reference frame"""
+
+    name = "camera"
+    errors = (CameraError,)
+
+    def __init__(self, detector, max_capture_failures=3):
+        self.detector = detector
+        self.max_capture_failures = max_capture_failures
+        self.capture_failures = 0
+
+    def start(self):
+        if self.detector.reference_frame is None:
+            self.detector.capture_reference_frame()
+        else:
+            self.detector.init_camera()
+
+    def stop(self):
+        self.detector.release_camera()
+
+    def restart(self):
+        self.capture_failures = 0
+        self.detector.reopen()
+        if self.detector.reference_frame is None:
+            self.detector.capture_reference_frame()
+
+    def healthy(self):
+        return self.detector.healthy() and self.capture_failures < self.max_capture_failures
+
+    def report_capture(self, ok):
+        """The classifier reports whether it could capture an image"""
+        self.capture_failures = 0 if ok else self.capture_failures + 1
+
+
+class ClassifierComponent(Component):
+    """
+    Classifier client. Wraps the pipeline's classify stage to count
+    failed classifications; a restart resets the client.
+    """
+
+    name = "classifier"
+    live_restart = True
+
+    def __init__(self, classify, reset=None, camera=None, max_failures=3):
+        self.classify_fn = classify
+        self.reset = reset
+        self.camera = camera
+        self.max_failures = max_failures
+        self.failures = 0
+
+    async def classify(self, detector):
+        result, image_path = await self.classify_fn(detector)
+        if image_path is None:
+            # Nothing was captured: the camera's fault, not the classifier's
+            if self.camera:
+                self.camera.report_capture(False)
+        else:
+            if self.camera:
+                self.camera.report_capture(True)
+            if result is None or result.startswith("Error"):
+                self.failures += 1
+            else:
+                self.failures = 0
+        return result, image_path
+
+    def restart(self):
+        if self.reset:
+            self.reset()
+        self.failures = 0
+
+    def healthy(self):
+        return self.failures < self.max_failures
+
+
+class ComponentSupervisor:
+    """
+    Keeps a unit's components running underneath its work (the item pipeline).
+
+    When the work fails, only the components the failure belongs to are
+    restarted, each with its own exponential backoff; the others keep
+    their open camera, serial links and clients. Components are also
+    health-checked every check_interval seconds: those that can restart
+    live are restarted on the spot, the others once the work is idle.
+    """
+
+    def __init__(self, components, name=None, check_interval=2.0,
+                 base_delay=0.5, max_delay=60.0, stable_s=60.0):
+        self.components = list(components)
+        self.name = name
+        self.check_interval = check_interval
+        # Work that ran this long without failing resets the backoffs
+        self.stable_s = stable_s
+        self.backoff = {c.name: Backoff(base_delay, max_delay) for c in self.components}
+        self.work_backoff = Backoff(base_delay, max_delay)
+        self.not_before = {c.name: 0.0 for c in self.components}
+        self.restarts = {c.name: 0 for c in self.components}
+
+    def label(self):
+        return f"[{self.name}] " if self.name else ""
+
+    def start(self):
+        for component in self.components:
+            component.start()
+
+    def stop(self):
+        for component in reversed(self.components):
+            try:
+                component.stop()
+            except Exception as e:
+                print(f"{self.label()}Error stopping {component.name}: {e}")
+
+    def status(self):
+        """Health and restart count of every component"""
+        return {
+            c.name: {'healthy': c.healthy(), 'restarts': self.restarts[c.name]}
+            for c in self.components
+        }
+
+    async def run(self, work, idle=None):
+        """
+        Run work() (a coroutine function) until cancelled, restarting the
+        components behind its failures. idle() tells when the work can be
+        interrupted to restart an unhealthy component.
+        """
+        while True:
+            started = time.monotonic()
+            failed = await self.run_until_failure(work, idle)
+            if time.monotonic() - started > self.stable_s:
+                for backoff in self.backoff.values():
+                    backoff.reset()
+                self.work_backoff.reset()
+            await self.recover(failed)
+
+    async def run_until_failure(self, work, idle):
+        """Run work once; returns the components to restart"""
+        task = asyncio.create_task(work())
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.check_interval)
+                if done:
+                    exc = task.exception()
+                    if exc is None:
+                        return []
+                    print(f"{self.label()}Error in main loop: {exc}")
+                    return self.blame(exc)
+
+                await self.restart_live()
+                unhealthy = [c for c in self.components
+                             if not c.live_restart and not c.healthy()]
+                if unhealthy and (idle is None or idle()):
+                    names = ", ".join(c.name for c in unhealthy)
+                    print(f"{self.label()}Unhealthy: {names}, pausing work")
+                    return unhealthy
+        finally:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+    def blame(self, exc):
+        """Components a failure belongs to, plus any that report unhealthy"""
+        return [c for c in self.components if c.owns(exc) or not c.healthy()]
+
+    async def restart_live(self):
+        now = time.monotonic()
+        for component in self.components:
+            if not component.live_restart or component.healthy():
+                continue
+            if now < self.not_before[component.name]:
+                continue
+            delay = self.backoff[component.name].next_delay()
+            self.not_before[component.name] = now + delay
+            print(f"{self.label()}{component.name} unhealthy, restarting "
+                  f"(next attempt no sooner than {delay:.1f} s)")
+            try:
+                await asyncio.to_thread(component.restart)
+                self.restarts[component.name] += 1
+            except Exception as e:
+                print(f"{self.label()}{component.name} restart failed: {e}")
+
+    async def recover(self, failed):
+        if not failed:
+            delay = self.work_backoff.next_delay()
+            print(f"{self.label()}Retrying in {delay:.1f} s")
+            await asyncio.sleep(delay)
+
+        for component in failed:
+            await self.restart(component)
+
+        # Healthy components may still be finishing something the failure interrupted
+        for component in self.components:
+            if component not in failed and not await asyncio.to_thread(component.settle):
+                await self.restart(component)
+
+    async def restart(self, component):
+        """Restart one component, backing off until it comes back"""
+        backoff = self.backoff[component.name]
+        while True:
+            delay = backoff.next_delay()
+            print(f"{self.label()}Restarting {component.name} in {delay:.1f} s")
+            await asyncio.sleep(delay)
+            try:
+                await asyncio.to_thread(component.restart)
+            except Exception as e:
+                print(f"{self.label()}{component.name} restart failed: {e}")
+                continue
+            self.restarts[component.name] += 1
+            print(f"{self.label()}{component.name} restarted")
+            return
@@ -1,10 +1,11 @@
 import streamlit as st
-import os
 from PIL import Image
-import time
 import plotly.graph_objects as go
 from datetime import datetime
-import base64
+import time
+
+from dashboard_data import (ALERT_LEVEL, LIVE_INTERVAL_S, capture_image, load_sensor_data,
+                            read_live, store_version, watch_store)
 
 # Set page config
 st.set_page_config(page_title="GREEN GUARDIAN",
@@ -62,73 +63,13 @@ st.markdown(
 )
 
 
-def get_base64_encoded_image(image_path):
-    """Encodes image to Base64 for proper embedding in HTML"""
-    with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode("utf-8")
-
-
-def parse_line(line):
-    """Parse a line from data_base.txt into a dictionary"""
-    data = {}
-    current_key = None
-    current_value = []
-    parts = line.split(', ')
-
-    for part in parts:
-        if ': ' in part:
-            # If we have a stored key and value, save it
-            if current_key:
-                data[current_key] = ', '.join(current_value)
-                current_value = []
-
-            # Split new key-value pair
-            key, value = part.split(': ', 1)
-            current_key = key
-            current_value.append(value)
-        else:
-            # This is a continuation of the previous value
-            current_value.append(part)
-
-    # Save the last key-value pair
-    if current_key:
-        data[current_key] = ', '.join(current_value)
-
-    return data
-
-
-def get_sensor_data():
-    """Read sensor data from data_base.txt"""
+def get_sensor_data(version, bin_code=None):
+    """Latest sensor data from the event store (cached per store version)"""
     try:
-        # print("Attempting to read data_base.txt")  # Debug print
-
-        if not os.path.exists('data_base.txt'):
-            print("data_base.txt does not exist")  # Debug print
-            raise FileNotFoundError("data_base.txt not found")
-
-        with open('data_base.txt', 'r') as f:
-            lines = f.readlines()
-            # print(f"Number of lines read: {len(lines)}")  # Debug print
-            if lines:
-                # print(f"First line: {lines[0]}")  # Debug print
-                latest_data = parse_line(lines[0])
-                # print(f"Parsed data: {latest_data}")  # Debug print
-                return {
-                    'code': latest_data['Dustbin Code'],
-                    'location': latest_data['Dustbin Location'],
-                    'BR': float(latest_data['BR']),
-                    'BNR': float(latest_data['BNR']),
-                    'NBR': float(latest_data['NBR']),
-                    'NBNR': float(latest_data['NBNR']),
-                    'last_used': latest_data['Last used'],
-                    'recycle_tips': latest_data['Recyclable tips'],
-                    'bio_facts': latest_data['Bio degradable facts'],
-                    'last_item': latest_data.get('Item', 'Unknown'),
-                    'last_category': latest_data.get('Category', 'Unknown')
-                }
-            else:
-                print("File is empty")  # Debug print
-                raise ValueError("data_base.txt is empty")
+        data = load_sensor_data(version, bin_code)
+        if data is None:
+            raise ValueError("No items recorded yet")
+        return data
     except Exception as e:
         print(f"Error in get_sensor_data: {e}")  # Debug print
         st.error(f"Error reading data: {e}")
@@ -138,10 +79,67 @@ def get_sensor_data():
             'last_used': 'Unknown',
             'recycle_tips': '', 'bio_facts': '',
             'last_item': 'Unknown',
-            'last_category': 'Unknown'
+            'last_category': 'Unknown',
+            'capture_hash': None
         }
 
 
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_pie_figure(label, value, color):
+    """Fill level pie; identical levels reuse the same figure"""
+    fig = go.Figure(data=[go.Pie(
+        labels=["Filled", "Empty"],
+        values=[value, 100 - value],
+        marker_colors=[color, "#ecf0f1"],
+        hole=.3
+    )])
+    fig.update_layout(
+        title={
+            'text': label,
+            'x': 0.5,
+            'xanchor': 'center',
+            'y': 0.95,
+            'pad': {'b': 20}
+        },
+        width=180,
+        height=180,
+        margin=dict(t=40, b=20, l=20, r=20),
+        showlegend=False
+    )
+    return fig
+
+
+@st.fragment(run_every=LIVE_INTERVAL_S)
+def live_panel(bin_code):
+    """Camera view (opt-in) and component health straight from the worker"""
+    live = read_live(bin_code, frame=False)
+    if live is None:
+        return
+    st.markdown("<div class='header'>🎥 Live</div>", unsafe_allow_html=True)
+    if st.toggle("Show camera", key=f"live_camera_{bin_code}") and live['frame_at']:
+        # Copy the frame only when the worker published a new one; the same
+        # bytes map to the same media URL, so browsers do not fetch it again
+        key = f"live_frame_{bin_code}"
+        frame_at, jpeg = st.session_state.get(key, (None, None))
+        if frame_at != live['frame_at']:
+            fresh = read_live(bin_code)
+            if fresh and fresh['frame']:
+                frame_at, jpeg = fresh['frame_at'], fresh['frame']
+                st.session_state[key] = (frame_at, jpeg)
+        if jpeg:
+            st.image(jpeg, use_container_width=True)
+    status = live['status']
+    if status is None:
+        st.info("Unit starting...")
+        return
+    age = time.time() - live['status_at']
+    if age > 10:
+        st.warning(f"No update from the unit for {age:.0f} s")
+    for name, component in status['components'].items():
+        icon = "🟢" if component['healthy'] else "🔴"
+        st.markdown(f"{icon} {name} · {component['restarts']} restarts")
+
+
 def get_type_description(type_code):
     """Convert type code to full description"""
     type_mapping = {
@@ -157,8 +155,10 @@ def get_type_description(type_code):
 st.markdown("<div class='title'>🌏 GREEN GUARDIAN</div>",
             unsafe_allow_html=True)
 
-# Get sensor data
-sensor_data = get_sensor_data()
+# Get sensor data; the page is only re-rendered when the store changes
+version = store_version()
+# ?bin=CODE shows one bin (the fleet page links here); default: the last one used
+sensor_data = get_sensor_data(version, st.query_params.get('bin'))
 
 # Display bin info below title
 st.markdown(f"""
@@ -199,25 +199,7 @@ pie_cols = st.columns(4)
 
 for i, col in enumerate(pie_cols):
     with col:
-        fig = go.Figure(data=[go.Pie(
-            labels=["Filled", "Empty"],
-            values=[sensor_data[bins[i]], 100 - sensor_data[bins[i]]],
-            marker_colors=[colors[i], "#ecf0f1"],
-            hole=.3
-        )])
-        fig.update_layout(
-            title={
-                'text': labels[i],
-                'x': 0.5,
-                'xanchor': 'center',
-                'y': 0.95,
-                'pad': {'b': 20}
-            },
-            width=180,
-            height=180,
-            margin=dict(t=40, b=20, l=20, r=20),
-            showlegend=False
-        )
+        fig = get_pie_figure(labels[i], sensor_data[bins[i]], colors[i])
         st.plotly_chart(fig, use_container_width=True)
         st.markdown(f"<div style='text-align: center;'><b>{
                     sensor_data[bins[i]]}%</b> filled</div>", unsafe_allow_html=True)
@@ -247,20 +229,10 @@ st.markdown("<br>", unsafe_allow_html=True)
 img_col, map_col = st.columns(2)
 
 with img_col:
-    image_path = 'last_item.png'
-    if os.path.exists(image_path):
-        encoded_image = get_base64_encoded_image(
-            image_path)  # Convert to Base64
-
-        # Center-align the image with proper Base64 embedding
-        st.markdown(
-            f"""
-            <div style="display: flex; justify-content: center; align-items: center; padding-right: 10px;padding-bottom: 10px; padding-top: 10px;padding-left: 10px;">
-                <img src="data:image/png;base64,{encoded_image}" style="width: 1000px; max-width: 103%; border-radius: 10px; box-shadow: 0px 4px 6px rgba(0,0,0,0.1);" />
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
+    # A status API URL or bytes served by the dashboard; cached either way
+    image = capture_image(sensor_data['capture_hash'])
+    if image is not None:
+        st.image(image, use_container_width=True)
     else:
         st.info("No item detected yet")
 
@@ -325,11 +297,12 @@ st.markdown("<br>", unsafe_allow_html=True)
 with st.sidebar:
     st.markdown("<div class='header'>🚨 Alerts</div>", unsafe_allow_html=True)
     alerts = [f"⚠️ {label} bin is {sensor_data[b]}% full" for b,
-              label in zip(bins, labels) if sensor_data[b] > 80]
+              label in zip(bins, labels) if sensor_data[b] > ALERT_LEVEL]
     for alert in alerts:
         st.warning(alert)
     if not alerts:
         st.success("All bins are at safe levels")
+    live_panel(sensor_data['code'])
 
 # Refresh Button
 st.markdown("<br>", unsafe_allow_html=True)
@@ -337,6 +310,5 @@ col1, col2, col3 = st.columns([1, 1, 1])
 with col2:
     if st.button("🔄 Refresh Data"):
         st.rerun()
-# Auto-refresh every 5 seconds
-time.sleep(5)
-st.rerun()
+# Check for new data every 5 seconds, re-rendering only if there is some
+watch_store(version)
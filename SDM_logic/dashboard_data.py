@@ -0,0 +1,212 @@
+import base64
+import ipaddress
+import math
+import os
+import time
+from urllib.parse import urlsplit
+
+import streamlit as st
+
+from capture_archive import default_archive
+from event_store import BINS, default_store
+from live_channel import LiveChannel, channel_name
+from status_api import IMAGE_TYPES, STATUS_HOST, STATUS_PORT, capture_url
+
+# How often open dashboards check the store for changes
+POLL_INTERVAL_S = 5
+
+# Bins fuller than this (%) raise an alert
+ALERT_LEVEL = 80
+
+# Base URL of the status API as browsers see it, if not this host
+MEDIA_URL = os.environ.get('SDM_MEDIA_URL')
+
+# How often the live view reads the worker's shared memory
+LIVE_INTERVAL_S = float(os.environ.get('SDM_LIVE_INTERVAL_S', '2'))
+
+# Live channels by bin code, attached once per dashboard process
+live_channels = {}
+
+
+def store_version():
+    """Version of the event store; cached data below is keyed by it"""
+    return default_store.version()
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_sensor_data(version, bin_code=None):
+    """
+    Dashboard state of one bin (default: the most recently used) for one
+    store version, or None if nothing was recorded. Cached across
+    sessions, so every kiosk on a site shares one read per change
+    instead of reading the store on each refresh.
+    """
+    latest = default_store.latest(bin_code)
+    if latest is None:
+        return None
+    capture = default_archive.lookup(latest['capture_hash'])
+    return {
+        'code': latest['bin_code'],
+        'location': latest['location'],
+        # NULL when the levels could not be read
+        **{b: float(latest[b.lower()] or 0) for b in BINS},
+        'last_used': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(latest['ts'])),
+        'recycle_tips': latest['tips'] or '',
+        'bio_facts': latest['facts'] or '',
+        'last_item': latest['item'] or 'Unknown',
+        'last_category': latest['category'] or 'Unknown',
+        # Shown (see capture_image) only if still archived
+        'capture_hash': capture['hash'] if capture and os.path.exists(capture['path'])
+        else None,
+    }
+
+
+def loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+def media_base_url():
+    """
+    Where browsers fetch images from the status API: SDM_MEDIA_URL, or the
+    API on the host the browser reached the dashboard on if it is bound
+    beyond loopback (SDM_STATUS_HOST). None if browsers cannot reach it,
+    as by default; the dashboard then serves the images itself.
+    """
+    if MEDIA_URL:
+        return MEDIA_URL
+    if loopback(STATUS_HOST):
+        return None
+    host = urlsplit('//' + st.context.headers.get('Host', 'localhost')).hostname or 'localhost'
+    if ':' in host:
+        host = f"[{host}]"  # IPv6
+    return f"http://{host}:{STATUS_PORT}"
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_capture(digest, thumb=False):
+    """
+    (bytes, media type) of an archived capture or its thumbnail, or None
+    if it is no longer archived. Keyed by the content hash, so a capture
+    is read once per dashboard process.
+    """
+    capture = default_archive.lookup(digest)
+    path = capture and (capture['thumb'] if thumb else capture['path'])
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data, IMAGE_TYPES.get(os.path.splitext(path)[1].lower(), 'image/jpeg')
+
+
+def capture_image(digest, thumb=False):
+    """
+    An archived capture for st.image: its versioned status API URL, which
+    browsers cache, or else its cached bytes, which Streamlit serves from
+    this process as a media file (the page only carries the file's URL).
+    """
+    if not digest:
+        return None
+    base = media_base_url()
+    if base:
+        return capture_url(base, digest, thumb)
+    capture = load_capture(digest, thumb)
+    return capture[0] if capture else None
+
+
+def capture_image_url(digest, thumb=False):
+    """
+    An archived capture for image columns, which only take URLs: the
+    status API URL, or else a data URL of the cached bytes (meant for
+    thumbnails).
+    """
+    if not digest:
+        return None
+    base = media_base_url()
+    if base:
+        return capture_url(base, digest, thumb)
+    capture = load_capture(digest, thumb)
+    if capture is None:
+        return None
+    data, media_type = capture
+    return f"data:{media_type};base64,{base64.b64encode(data).decode()}"
+
+
+def read_live(bin_code, frame=True):
+    """
+    Live frame and unit status from the worker (see live_channel.py), or
+    None if the worker is not running under supervisor.py. With
+    frame=False only frame_at tells whether there is a new frame.
+    """
+    channel = live_channels.get(bin_code)
+    if channel is None:
+        channel = LiveChannel.open(channel_name(bin_code))
+        if channel is None:
+            return None
+        live_channels[bin_code] = channel
+    return channel.read(frame)
+
+
+def range_end(now=None):
+    """Now, rounded up to the minute so history queries hit the cache"""
+    now = time.time() if now is None else now
+    return math.ceil(now / 60) * 60
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_bins(version):
+    return default_store.bins()
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_time_range(version):
+    return default_store.time_range()
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_trend(version, since, until, bin_code=None, max_points=300):
+    """Fill levels and item counts, downsampled in the store to max_points"""
+    return default_store.trend(since, until, bin_code, max_points=max_points)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_category_trend(version, since, until, bin_code=None, max_points=300):
+    return default_store.category_trend(since, until, bin_code, max_points=max_points)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_top_items(version, since, until, bin_code=None, limit=10):
+    return default_store.top_items(since, until, bin_code, limit)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_fleet(version, offset, limit, sort='code', descending=False, search=None,
+               alerts_only=False):
+    """One page of the fleet table: (total, rows); sorted and paged in the store"""
+    return default_store.fleet(offset, limit, sort, descending, search, alerts_only,
+                               ALERT_LEVEL)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_fleet_summary(version, stale_before):
+    return default_store.fleet_summary(ALERT_LEVEL, stale_before)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_fleet_map(version):
+    return default_store.fleet_map()
+
+
+@st.fragment(run_every=POLL_INTERVAL_S)
+def watch_store(version):
+    """
+    Rerun the page when the store has moved past version. Only this
+    fragment runs every POLL_INTERVAL_S; the page re-renders on changes.
+    """
+    if store_version() != version:
+        st.rerun()
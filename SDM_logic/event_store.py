@@ -0,0 +1,651 @@
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import EVENT_WRITE_ERRORS, EVENTS_LOST
+from paths import data_path
+
+DATABASE_FILE = os.environ.get('SDM_DATABASE_FILE', data_path('sdm_events.db'))
+
+BINS = ('BR', 'BNR', 'NBR', 'NBNR')
+
+# Backoff between attempts to commit a batch while the database is locked,
+# full or unavailable; on close a failing batch is given up after a few
+WRITE_RETRY_S = 0.5
+WRITE_RETRY_MAX_S = 30.0
+CLOSE_RETRIES = 5
+# OperationalErrors that pass on their own; any other (no such table,
+# malformed SQL, ...) fails every retry, so its events are rejected
+TRANSIENT_ERRORS = ('database is locked', 'database table is locked', 'database is busy',
+                    'disk i/o error', 'database or disk is full', 'unable to open')
+
+
+def transient(error):
+    """True for write errors worth retrying (see TRANSIENT_ERRORS)"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and \
+        any(text in message for text in TRANSIENT_ERRORS)
+
+# Rollup bucket widths in seconds: 1 minute, 1 hour, 1 day (local time)
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+
+
+def create_rollups(conn):
+    """
+    Schema step 3: per-bin, per-category item counts and fill level
+    min/sum/max for each rollup resolution, backfilled from the events
+    already stored. Levels are aggregated over the events that have them
+    (samples), so avg = sum / samples.
+    """
+    level_columns = "".join(
+        f"{b}_min INTEGER, {b}_max INTEGER, {b}_sum INTEGER NOT NULL DEFAULT 0, "
+        for b in (b.lower() for b in BINS))
+    conn.execute(
+        "CREATE TABLE rollups ("
+        "resolution INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+        "bin_code TEXT NOT NULL, category TEXT NOT NULL, "
+        "items INTEGER NOT NULL, samples INTEGER NOT NULL, "
+        f"{level_columns}"
+        "PRIMARY KEY (resolution, bin_code, bucket, category)) WITHOUT ROWID")
+    # Fleet-wide trends (all bins)
+    conn.execute("CREATE INDEX rollups_bucket ON rollups(resolution, bucket)")
+    rebuild_rollups(conn)
+
+
+# Schema versions, applied in order and tracked with PRAGMA user_version.
+# A step is SQL or a function taking the connection. Never edit a released
+# step; append a new one instead.
+MIGRATIONS = [
+    # 1: events with typed columns, tips/facts stored once and referenced
+    """
+    CREATE TABLE texts (
+        id INTEGER PRIMARY KEY,
+        body TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE events (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,               -- Unix time the item was recorded
+        bin_code TEXT NOT NULL,
+        location TEXT NOT NULL,
+        br INTEGER,                     -- Fill levels, NULL if unknown
+        bnr INTEGER,
+        nbr INTEGER,
+        nbnr INTEGER,
+        item TEXT,
+        category TEXT,
+        tips_id INTEGER REFERENCES texts(id),
+        facts_id INTEGER REFERENCES texts(id)
+    );
+    CREATE INDEX events_ts ON events(ts);
+    CREATE INDEX events_bin_ts ON events(bin_code, ts);
+    -- Newest event per bin, so latest() never scans events
+    CREATE TABLE latest (
+        bin_code TEXT PRIMARY KEY,
+        event_id INTEGER NOT NULL REFERENCES events(id)
+    );
+    """,
+    # 2: key of the source record, so imports can be re-run safely
+    """
+    ALTER TABLE events ADD COLUMN source_key TEXT;
+    CREATE UNIQUE INDEX events_source_key ON events(source_key);
+    """,
+    create_rollups,
+    # 4: archived captures (see capture_archive.py) and the event's capture
+    """
+    CREATE TABLE captures (
+        hash TEXT PRIMARY KEY,          -- SHA-256 of the image file
+        path TEXT NOT NULL,             -- Relative to the archive root
+        thumb TEXT,
+        size INTEGER NOT NULL,          -- Bytes on disk, image and thumbnail
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL
+    );
+    CREATE INDEX captures_last_seen ON captures(last_seen);
+    ALTER TABLE events ADD COLUMN capture_hash TEXT;
+    """,
+    # 5: where each bin is, from the unit registry (for the fleet map)
+    """
+    CREATE TABLE sites (
+        bin_code TEXT PRIMARY KEY,
+        location TEXT NOT NULL,
+        lat REAL,
+        lon REAL
+    );
+    """,
+]
+
+EVENT_COLUMNS = """
+    e.id, e.ts, e.bin_code, e.location, e.br, e.bnr, e.nbr, e.nbnr,
+    e.item, e.category, t.body AS tips, f.body AS facts, e.capture_hash
+"""
+EVENT_JOINS = """
+    LEFT JOIN texts t ON t.id = e.tips_id
+    LEFT JOIN texts f ON f.id = e.facts_id
+"""
+
+
+def connect(path=DATABASE_FILE):
+    """Open a connection in WAL mode (readers never block the writer)"""
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Bring the schema up to date. Each step runs in its own write
+    transaction, so processes opening the database at the same time
+    (app, dashboard, importer) apply it once.
+    """
+    while schema_version(conn) < len(MIGRATIONS):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)  # May have moved while we waited
+            if version < len(MIGRATIONS):
+                step = MIGRATIONS[version]
+                if callable(step):
+                    step(conn)
+                else:
+                    for statement in step.split(';'):
+                        if statement.strip():
+                            conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def make_event(bin_code, location, levels, result_data, ts=None, capture_hash=None):
+    """Build an event dict from a classification result and bin levels"""
+    if not levels or len(levels) != 4:
+        levels = (None, None, None, None)
+    return {
+        'ts': time.time() if ts is None else ts,
+        'bin_code': bin_code,
+        'location': location,
+        **{b.lower(): level for b, level in zip(BINS, levels)},
+        'item': result_data.get('Item', 'Unknown'),
+        'category': result_data.get('Category', 'Unknown'),
+        'tips': result_data.get('Recyclable tips', 'No recycling information available'),
+        'facts': result_data.get(
+            'Bio degradable facts', 'No biodegradable information available'),
+        'capture_hash': capture_hash,
+    }
+
+
+class EventStore:
+    """
+    Append-only store of sorted items in SQLite.
+
+    record() only queues the event; a writer thread commits queued events
+    in batches of up to batch_size, or after flush_interval seconds. At
+    most max_pending events wait; record() blocks beyond that. Each
+    thread reads through its own connection. The database is opened on
+    first use, so creating an EventStore has no side effects.
+    """
+
+    def __init__(self, path=DATABASE_FILE, batch_size=64, flush_interval=0.5,
+                 max_pending=4096):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.writer = None
+        self.start_lock = threading.Lock()
+        self.local = threading.local()
+
+    def connection(self):
+        """This thread's read connection"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+            migrate(conn)
+        return conn
+
+    # Writing
+    def record(self, event):
+        """Queue one event (see make_event) for the writer thread"""
+        self.start_writer()
+        self.pending.put(event)
+
+    def start_writer(self):
+        with self.start_lock:
+            if self.writer is None:
+                migrate(self.connection())  # Create the schema before the first batch
+                self.writer = threading.Thread(
+                    target=self.write_loop, name="event-store", daemon=True)
+                self.writer.start()
+
+    def write_loop(self):
+        conn = connect(self.path)
+        stop = False
+        while not stop:
+            batch = [self.pending.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = [event for event in batch if event is not None]
+            try:
+                self.commit(conn, batch, stop)
+            finally:
+                for _ in range(len(batch) + int(stop)):
+                    self.pending.task_done()
+        conn.close()
+
+    def commit(self, conn, batch, closing=False):
+        """
+        Write a batch, retrying with backoff while the database is
+        transiently unwritable (new events wait in the bounded queue
+        meanwhile). Any other error rejects the batch: its events are
+        tried one by one and those that fail are dropped. Every failure
+        is counted in the metrics registry.
+        """
+        delay = WRITE_RETRY_S
+        attempts = 0
+        while True:
+            try:
+                self.write_batch(conn, batch)
+                if attempts:
+                    print(f"Event store writable again after {attempts} failed attempts")
+                return
+            except sqlite3.Error as e:
+                if not transient(e):
+                    EVENT_WRITE_ERRORS.labels('rejected').inc()
+                    break
+                EVENT_WRITE_ERRORS.labels('unavailable').inc()
+                attempts += 1
+                if attempts == 1:
+                    print(f"Event store not writable, retrying: {e}")
+                if closing and attempts >= CLOSE_RETRIES:
+                    EVENTS_LOST.inc(len(batch))
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, WRITE_RETRY_MAX_S)
+        for event in batch:
+            try:
+                self.write_batch(conn, [event])
+            except sqlite3.Error:
+                EVENTS_LOST.inc()
+
+    def write_batch(self, conn, events):
+        """Insert events in one transaction"""
+        with conn:
+            for event in events:
+                insert_event(conn, event)
+
+    def flush(self):
+        """Wait until every queued event has been committed"""
+        if self.writer is not None:
+            self.pending.join()
+
+    def close(self):
+        """Commit queued events and stop the writer"""
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    # Reading
+    def version(self):
+        """
+        Changes whenever a write is committed: mtime and size of the
+        database and its WAL file. Two stat calls, cheap enough to poll.
+        """
+        stamps = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def latest(self, bin_code=None):
+        """Newest event for one bin (or for any bin), or None"""
+        conn = self.connection()
+        if bin_code is not None:
+            row = conn.execute(
+                f"SELECT {EVENT_COLUMNS} FROM latest l JOIN events e ON e.id = l.event_id "
+                f"{EVENT_JOINS} WHERE l.bin_code = ?", (bin_code,)).fetchone()
+        else:
+            # One row per bin in latest, so this stays small
+            row = conn.execute(
+                f"SELECT {EVENT_COLUMNS} FROM latest l JOIN events e ON e.id = l.event_id "
+                f"{EVENT_JOINS} ORDER BY e.ts DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
+
+    def latest_all(self):
+        """Newest event of every bin, by bin code, in one query"""
+        rows = self.connection().execute(
+            f"SELECT {EVENT_COLUMNS} FROM latest l JOIN events e ON e.id = l.event_id "
+            f"{EVENT_JOINS} ORDER BY l.bin_code")
+        return [dict(row) for row in rows]
+
+    def history(self, bin_code=None, since=None, until=None, limit=100):
+        """Events newest first, optionally for one bin and a time range"""
+        clauses, args = [], []
+        if bin_code is not None:
+            clauses.append("e.bin_code = ?")
+            args.append(bin_code)
+        if since is not None:
+            clauses.append("e.ts >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("e.ts < ?")
+            args.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection().execute(
+            f"SELECT {EVENT_COLUMNS} FROM events e {EVENT_JOINS} {where} "
+            f"ORDER BY e.ts DESC LIMIT ?", (*args, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def events_after(self, event_id, bin_code=None, limit=100):
+        """Events stored after event_id, oldest first (for tailing new events)"""
+        clause, args = ("AND e.bin_code = ?", [bin_code]) if bin_code is not None else ("", [])
+        rows = self.connection().execute(
+            f"SELECT {EVENT_COLUMNS} FROM events e {EVENT_JOINS} WHERE e.id > ? {clause} "
+            f"ORDER BY e.id LIMIT ?", (event_id, *args, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def last_id(self):
+        """Id of the newest stored event, 0 if there are none"""
+        return self.connection().execute(
+            "SELECT coalesce(max(id), 0) FROM events").fetchone()[0]
+
+    def bins(self):
+        """Every bin code with at least one event"""
+        return [row[0] for row in self.connection().execute(
+            "SELECT bin_code FROM latest ORDER BY bin_code")]
+
+    def trend(self, since, until=None, bin_code=None, category=None,
+              resolution=None, max_points=500):
+        """
+        Item counts and fill levels per time bucket, oldest first, read
+        from the rollups, downsampled on the server: neighbouring rollup
+        buckets are merged so that at most max_points rows come back for
+        any range (see pick_resolution). Each row has bucket, items, and
+        <bin>_min/_avg/_max for every bin (None when no levels were
+        recorded in the bucket).
+        """
+        bucket, where, args = self.rollup_range(
+            since, until, bin_code, category, resolution, max_points)
+        levels = ", ".join(
+            f"MIN({b}_min) AS {b}_min, "
+            f"SUM({b}_sum) * 1.0 / NULLIF(SUM(samples), 0) AS {b}_avg, "
+            f"MAX({b}_max) AS {b}_max"
+            for b in ROLLUP_LEVELS)
+        rows = self.connection().execute(
+            f"SELECT {bucket} AS bucket, SUM(items) AS items, {levels} FROM rollups "
+            f"WHERE {where} GROUP BY 1 ORDER BY 1", args)
+        return [dict(row) for row in rows]
+
+    def category_trend(self, since, until=None, bin_code=None, resolution=None,
+                       max_points=500):
+        """Items per category per time bucket, oldest first: bucket, category, items"""
+        bucket, where, args = self.rollup_range(
+            since, until, bin_code, None, resolution, max_points)
+        rows = self.connection().execute(
+            f"SELECT {bucket} AS bucket, category, SUM(items) AS items FROM rollups "
+            f"WHERE {where} GROUP BY 1, 2 ORDER BY 1, 2", args)
+        return [dict(row) for row in rows]
+
+    def rollup_range(self, since, until, bin_code, category, resolution, max_points):
+        """Bucket expression, WHERE clause and arguments for a rollup query"""
+        until = time.time() if until is None else until
+        if resolution is None:
+            resolution = pick_resolution(since, until, max_points)
+        start = bucket_start(since, resolution)
+        width = bucket_width(since, until, max_points, resolution)
+        clauses = ["resolution = ?", "bucket >= ?", "bucket < ?"]
+        args = [start, width, width, start, resolution, start, until]
+        if bin_code is not None:
+            clauses.append("bin_code = ?")
+            args.append(bin_code)
+        if category is not None:
+            clauses.append("category = ?")
+            args.append(category)
+        return "(bucket - ?) / ? * ? + ?", " AND ".join(clauses), args
+
+    def category_counts(self, since, until=None, bin_code=None):
+        """Items per category between since and until (day resolution)"""
+        until = time.time() if until is None else until
+        resolution = ROLLUP_RESOLUTIONS[-1]
+        clauses = ["resolution = ?", "bucket >= ?", "bucket < ?"]
+        args = [resolution, bucket_start(since, resolution), until]
+        if bin_code is not None:
+            clauses.append("bin_code = ?")
+            args.append(bin_code)
+        rows = self.connection().execute(
+            f"SELECT category, SUM(items) FROM rollups WHERE {' AND '.join(clauses)} "
+            f"GROUP BY category ORDER BY SUM(items) DESC", args)
+        return dict(rows.fetchall())
+
+    def top_items(self, since=None, until=None, bin_code=None, limit=10):
+        """Most frequent items: item, category, count and when last seen"""
+        clauses, args = [], []
+        if bin_code is not None:
+            clauses.append("bin_code = ?")
+            args.append(bin_code)
+        if since is not None:
+            clauses.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            args.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection().execute(
+            f"SELECT item, category, COUNT(*) AS count, MAX(ts) AS last_seen FROM events "
+            f"{where} GROUP BY item, category ORDER BY count DESC, last_seen DESC LIMIT ?",
+            (*args, limit))
+        return [dict(row) for row in rows]
+
+    def register_sites(self, units):
+        """Record where each registry unit is ({'code', 'location', 'coordinates'})"""
+        conn = self.connection()
+        with conn:
+            for unit in units:
+                lat, lon = unit.get('coordinates') or (None, None)
+                conn.execute(
+                    "INSERT INTO sites (bin_code, location, lat, lon) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(bin_code) DO UPDATE SET location = excluded.location, "
+                    "lat = excluded.lat, lon = excluded.lon",
+                    (unit['code'], unit['location'], lat, lon))
+
+    def fleet(self, offset=0, limit=50, sort='code', descending=False, search=None,
+              alerts_only=False, alert_level=80):
+        """
+        One page of the fleet: every bin with a site or an event, with its
+        latest levels, fullest level, last item and coordinates. Sorting,
+        filtering and paging all happen in one query.
+        Returns (total matching bins, rows).
+        """
+        where, args = fleet_filter(search, alerts_only, alert_level)
+        order = FLEET_SORTS[sort]
+        direction = "DESC" if descending else "ASC"
+        conn = self.connection()
+        total = conn.execute(f"SELECT COUNT(*) FROM ({FLEET_QUERY}) {where}", args).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM ({FLEET_QUERY}) {where} "
+            f"ORDER BY {order} IS NULL, {order} {direction}, code LIMIT ? OFFSET ?",
+            (*args, limit, offset))
+        return total, [dict(row, alert=row['max_level'] > alert_level) for row in rows]
+
+    def fleet_summary(self, alert_level=80, stale_before=None):
+        """Bins in total, over alert_level, never seen, and not seen since stale_before"""
+        row = self.connection().execute(
+            f"SELECT COUNT(*), "
+            f"COALESCE(SUM(max_level > ?), 0), "
+            f"COALESCE(SUM(last_seen IS NULL), 0), "
+            f"COALESCE(SUM(last_seen < ?), 0) FROM ({FLEET_QUERY})",
+            (alert_level, stale_before if stale_before is not None else 0)).fetchone()
+        return dict(zip(('bins', 'alerts', 'never_seen', 'stale'), row))
+
+    def fleet_map(self):
+        """Code, coordinates and fullest level of every bin with coordinates"""
+        rows = self.connection().execute(
+            f"SELECT code, location, lat, lon, max_level, last_seen FROM ({FLEET_QUERY}) "
+            f"WHERE lat IS NOT NULL AND lon IS NOT NULL")
+        return [dict(row) for row in rows]
+
+    def time_range(self):
+        """(oldest, newest) event time, or (None, None) if there are no events"""
+        return tuple(self.connection().execute(
+            "SELECT MIN(ts), MAX(ts) FROM events").fetchone())
+
+
+# Every known bin with its latest event and site
+FLEET_QUERY = """
+    SELECT b.bin_code AS code,
+           COALESCE(s.location, e.location) AS location,
+           e.br, e.bnr, e.nbr, e.nbnr,
+           MAX(COALESCE(e.br, 0), COALESCE(e.bnr, 0),
+               COALESCE(e.nbr, 0), COALESCE(e.nbnr, 0)) AS max_level,
+           e.ts AS last_seen, e.item, e.category, e.capture_hash, s.lat, s.lon
+    FROM (SELECT bin_code FROM latest UNION SELECT bin_code FROM sites) b
+    LEFT JOIN latest l ON l.bin_code = b.bin_code
+    LEFT JOIN events e ON e.id = l.event_id
+    LEFT JOIN sites s ON s.bin_code = b.bin_code
+"""
+
+# Sort keys accepted by fleet(), mapped to columns of FLEET_QUERY
+FLEET_SORTS = {
+    'code': 'code',
+    'location': 'location',
+    'fullest': 'max_level',
+    'last_seen': 'last_seen',
+    **{b: b.lower() for b in BINS},
+}
+
+
+def fleet_filter(search, alerts_only, alert_level):
+    clauses, args = [], []
+    if search:
+        clauses.append("(code LIKE ? OR location LIKE ?)")
+        args += [f"%{search}%"] * 2
+    if alerts_only:
+        clauses.append("max_level > ?")
+        args.append(alert_level)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), args
+
+
+def bucket_start(ts, resolution):
+    """Start of the rollup bucket holding ts; buckets follow local time"""
+    local = ts + time.localtime(ts).tm_gmtoff
+    return int(ts - local % resolution)
+
+
+def pick_resolution(since, until, max_points=500):
+    """
+    Coarsest rollup resolution no wider than a bucket needs to be for
+    max_points buckets; its buckets are then merged up to that width.
+    """
+    width = (until - since) / max_points
+    fitting = [r for r in ROLLUP_RESOLUTIONS if r <= width]
+    return fitting[-1] if fitting else ROLLUP_RESOLUTIONS[0]
+
+
+def bucket_width(since, until, max_points=500, resolution=None):
+    """Seconds per point of a trend: rollup buckets merged to fit max_points"""
+    if resolution is None:
+        resolution = pick_resolution(since, until, max_points)
+    span = until - bucket_start(since, resolution)
+    return resolution * max(1, math.ceil(span / resolution / max_points))
+
+
+ROLLUP_LEVELS = [b.lower() for b in BINS]
+ROLLUP_UPSERT = (
+    "INSERT INTO rollups (resolution, bucket, bin_code, category, items, samples, "
+    + ", ".join(f"{b}_min, {b}_max, {b}_sum" for b in ROLLUP_LEVELS)
+    + ") VALUES (?, ?, ?, ?, 1, ?, " + ", ".join("?, ?, ?" for _ in ROLLUP_LEVELS) + ") "
+    "ON CONFLICT (resolution, bin_code, bucket, category) DO UPDATE SET "
+    "items = items + 1, samples = samples + excluded.samples, "
+    # min()/max() of a NULL is NULL, hence the coalesce
+    + ", ".join(
+        f"{b}_min = coalesce(min({b}_min, excluded.{b}_min), {b}_min, excluded.{b}_min), "
+        f"{b}_max = coalesce(max({b}_max, excluded.{b}_max), {b}_max, excluded.{b}_max), "
+        f"{b}_sum = {b}_sum + excluded.{b}_sum"
+        for b in ROLLUP_LEVELS)
+)
+
+
+def update_rollups(conn, event):
+    """Add one event to its bucket at every rollup resolution"""
+    levels = [event[b] for b in ROLLUP_LEVELS]
+    if None in levels:
+        # Levels only count when all of them were read
+        samples, level_args = 0, [None, None, 0] * len(levels)
+    else:
+        samples, level_args = 1, [v for level in levels for v in (level, level, level)]
+    for resolution in ROLLUP_RESOLUTIONS:
+        conn.execute(ROLLUP_UPSERT, (
+            resolution, bucket_start(event['ts'], resolution),
+            event['bin_code'], event['category'] or 'Unknown', samples, *level_args))
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup from the events (schema step 3, or repairs)"""
+    conn.execute("DELETE FROM rollups")
+    columns = ", ".join(['ts', 'bin_code', 'category', *ROLLUP_LEVELS])
+    for row in conn.execute(f"SELECT {columns} FROM events ORDER BY id"):
+        update_rollups(conn, dict(zip(['ts', 'bin_code', 'category', *ROLLUP_LEVELS], row)))
+
+
+def text_id(conn, body):
+    """Id of a tips/facts text, storing it the first time it is seen"""
+    if body is None:
+        return None
+    cursor = conn.execute("INSERT OR IGNORE INTO texts (body) VALUES (?)", (body,))
+    if cursor.rowcount:
+        return cursor.lastrowid
+    return conn.execute("SELECT id FROM texts WHERE body = ?", (body,)).fetchone()[0]
+
+
+def insert_event(conn, event):
+    """
+    Insert one event and update the latest and rollup tables; returns the
+    event id, or None if an event with the same source_key is already stored.
+    """
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO events (ts, bin_code, location, br, bnr, nbr, nbnr, "
+        "item, category, tips_id, facts_id, source_key, capture_hash) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (event['ts'], event['bin_code'], event['location'],
+         event['br'], event['bnr'], event['nbr'], event['nbnr'],
+         event['item'], event['category'],
+         text_id(conn, event['tips']), text_id(conn, event['facts']),
+         event.get('source_key'), event.get('capture_hash')))
+    if cursor.rowcount == 0:
+        return None
+    event_id = cursor.lastrowid
+    conn.execute(
+        "INSERT INTO latest (bin_code, event_id) VALUES (?, ?) "
+        "ON CONFLICT(bin_code) DO UPDATE SET event_id = excluded.event_id "
+        "WHERE (SELECT ts FROM events WHERE id = latest.event_id) <= ?",
+        (event['bin_code'], event_id, event['ts']))
+    update_rollups(conn, event)
+    return event_id
+
+
+# Store used by app.py, multi_unit.py and the dashboard
+default_store = EventStore()
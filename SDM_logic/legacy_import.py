@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime
+
+from event_store import BINS, DATABASE_FILE, connect, insert_event, migrate
+
+# Fields of a data_base.txt line, in the order app.py wrote them. Tips
+# and facts are free text (commas and all), so each value is cut at the
+# next known key rather than at every ', '.
+LEADING_KEYS = ('Dustbin Code', 'Dustbin Location', *BINS, 'Last used', 'Recyclable tips')
+FACTS_KEY = 'Bio degradable facts'
+TRAILING_KEYS = ('Item', 'Category')  # Missing from the oldest lines
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class MalformedLine(ValueError):
+    """A data_base.txt line that does not follow the legacy format"""
+
+
+def marker(key):
+    return f", {key}: "
+
+
+# (key, marker that ends its value) for the leading fields
+LEADING_MARKERS = [(key, marker(next_key))
+                   for key, next_key in zip(LEADING_KEYS, LEADING_KEYS[1:])]
+TRAILING_MARKERS = [(key, marker(key)) for key in reversed(TRAILING_KEYS)]
+FACTS_MARKER = marker(FACTS_KEY)
+
+
+def parse_legacy_line(line):
+    """Parse one data_base.txt line into an event for the event store"""
+    line = line.strip()
+    first = f"{LEADING_KEYS[0]}: "
+    if not line.startswith(first):
+        raise MalformedLine(f"does not start with {first!r}")
+    pos = len(first)
+
+    values = {}
+    for key, end_marker in LEADING_MARKERS:
+        end = line.find(end_marker, pos)
+        if end < 0:
+            raise MalformedLine(f"missing {end_marker.strip(', :')!r}")
+        values[key] = line[pos:end]
+        pos = end + len(end_marker)
+
+    # Item and category are read from the end, so tips/facts may contain anything
+    rest = line[pos:]
+    for key, key_marker in TRAILING_MARKERS:
+        at = rest.rfind(key_marker)
+        values[key] = rest[at + len(key_marker):] if at >= 0 else None
+        if at >= 0:
+            rest = rest[:at]
+    at = rest.find(FACTS_MARKER)
+    if at < 0:
+        raise MalformedLine(f"missing {FACTS_KEY!r}")
+    values['Recyclable tips'] = rest[:at]
+    values[FACTS_KEY] = rest[at + len(FACTS_MARKER):]
+
+    try:
+        levels = [int(values[b]) for b in BINS]
+    except ValueError:
+        raise MalformedLine(f"bad fill level in {[values[b] for b in BINS]}")
+    if all(values[b] == '00' for b in BINS):
+        levels = [None] * len(BINS)  # app.py wrote '00' when the sensors were not read
+    try:
+        # Local time, like time.strftime in app.py; fromisoformat is much faster than strptime
+        ts = datetime.fromisoformat(values['Last used']).timestamp()
+    except ValueError:
+        raise MalformedLine(f"bad timestamp {values['Last used']!r}")
+
+    return {
+        'ts': ts,
+        'bin_code': values['Dustbin Code'],
+        'location': values['Dustbin Location'],
+        **{b.lower(): level for b, level in zip(BINS, levels)},
+        'item': values['Item'] or 'Unknown',
+        'category': values['Category'] or 'Unknown',
+        'tips': values['Recyclable tips'],
+        'facts': values[FACTS_KEY],
+        # Same line, same key: importing a file twice adds nothing
+        'source_key': "legacy:" + hashlib.sha1(line.encode()).hexdigest(),
+    }
+
+
+def import_legacy(path, db_path=DATABASE_FILE, batch_size=1000, rejects=None, verbose=True):
+    """
+    Import a data_base.txt file into the event store.
+
+    The file is read one line at a time and committed every batch_size
+    lines, so memory use does not depend on the file size. Malformed
+    lines are reported (and written to rejects, a text file, if given)
+    and skipped. Returns counts of lines, imported, duplicate and
+    malformed lines.
+    """
+    conn = connect(db_path)
+    migrate(conn)
+    counts = {'lines': 0, 'imported': 0, 'duplicates': 0, 'malformed': 0}
+
+    def write(batch):
+        with conn:
+            for event in batch:
+                if insert_event(conn, event) is None:
+                    counts['duplicates'] += 1
+                else:
+                    counts['imported'] += 1
+
+    try:
+        batch = []
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                counts['lines'] += 1
+                try:
+                    batch.append(parse_legacy_line(line))
+                except MalformedLine as e:
+                    counts['malformed'] += 1
+                    if verbose:
+                        print(f"{path}:{number}: skipped, {e}")
+                    if rejects:
+                        rejects.write(line if line.endswith('\n') else line + '\n')
+                    continue
+                if len(batch) >= batch_size:
+                    write(batch)
+                    batch = []
+        if batch:
+            write(batch)
+    finally:
+        conn.close()
+    return counts
+
+
+def format_legacy_line(event):
+    """A data_base.txt line as app.py used to write it (for the benchmark)"""
+    levels = ['00' if event[b.lower()] is None else str(event[b.lower()]) for b in BINS]
+    return (
+        f"Dustbin Code: {event['bin_code']}, "
+        f"Dustbin Location: {event['location']}, "
+        + "".join(f"{b}: {level}, " for b, level in zip(BINS, levels))
+        + f"Last used: {time.strftime(TIME_FORMAT, time.localtime(event['ts']))}, "
+        f"Recyclable tips: {event['tips']}, "
+        f"Bio degradable facts: {event['facts']}, "
+        f"Item: {event['item']}, "
+        f"Category: {event['category']}\n"
+    )
+
+
+def write_sample_history(path, lines, bins=20, malformed_rate=0.01, seed=0):
+    """Synthetic fleet history, newest line first like data_base.txt"""
+    rng = random.Random(seed)
+    words = ("plastic", "paper, cardboard", "glass", "foil, wrapper", "food waste",
+             "check with your local recycling program", "rinse it, then")
+    now = time.time()
+    with open(path, 'w') as f:
+        for i in range(lines):
+            if rng.random() < malformed_rate:
+                f.write(f"Dustbin Code: BIN{i % bins:03d}, truncated line\n")
+                continue
+            f.write(format_legacy_line({
+                'ts': now - i * 30,
+                'bin_code': f"BIN{i % bins:03d}",
+                'location': f"Campus, Block {i % bins}",
+                **{b.lower(): rng.randrange(100) for b in BINS},
+                'tips': ", ".join(rng.choices(words, k=12)),
+                'facts': ", ".join(rng.choices(words, k=12)),
+                'item': rng.choice(("Bottle", "Wrapper, chocolate", "Cup")),
+                'category': rng.choice(("Bio Degradable and Recyclable",
+                                        "Non Bio Degradable and Recyclable")),
+            }))
+
+
+def run_import_benchmark(lines, batch_size=1000):
+    """Import a synthetic history twice (fresh, then re-run) and report throughput"""
+    with tempfile.TemporaryDirectory() as tmp:
+        history = os.path.join(tmp, 'data_base.txt')
+        write_sample_history(history, lines)
+        size_mb = os.path.getsize(history) / 1e6
+        db_path = os.path.join(tmp, 'events.db')
+
+        print("\nLegacy import benchmark")
+        print("=======================")
+        print(f"History: {lines} lines, {size_mb:.1f} MB")
+        for run in ("Fresh import", "Re-import"):
+            start = time.time()
+            counts = import_legacy(history, db_path, batch_size, verbose=False)
+            elapsed = time.time() - start
+            print(f"{run}: {elapsed:.2f} s, {counts['lines'] / elapsed:.0f} lines/s, "
+                  f"{size_mb / elapsed:.1f} MB/s ({counts['imported']} imported, "
+                  f"{counts['duplicates']} duplicates, {counts['malformed']} malformed)")
+        # ru_maxrss is in kilobytes on Linux
+        print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import legacy data_base.txt histories into the event store")
+    parser.add_argument('files', nargs='*', help="data_base.txt files to import")
+    parser.add_argument('--db', default=DATABASE_FILE, help="Event store database")
+    parser.add_argument('--batch', type=int, default=1000, help="Lines per transaction")
+    parser.add_argument('--rejects', metavar='FILE',
+                        help="Write malformed lines to FILE for fixing and re-importing")
+    parser.add_argument('--bench', type=int, metavar='LINES',
+                        help="Benchmark importing a synthetic history of LINES lines and exit")
+    args = parser.parse_args()
+
+    if args.bench:
+        run_import_benchmark(args.bench, args.batch)
+        return
+    if not args.files:
+        parser.error("no files to import")
+
+    rejects = open(args.rejects, 'a') if args.rejects else None
+    try:
+        for path in args.files:
+            start = time.time()
+            counts = import_legacy(path, args.db, args.batch, rejects)
+            print(f"{path}: {counts['imported']} imported, {counts['duplicates']} already "
+                  f"present, {counts['malformed']} malformed "
+                  f"({counts['lines']} lines in {time.time() - start:.2f} s)")
+    finally:
+        if rejects:
+            rejects.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import json
+import re
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+
+# Shared memory segments are named <prefix>_<bin code>
+LIVE_PREFIX = "sdm_live"
+
+# seq, status_at, frame_at, status length, frame length
+HEADER = struct.Struct('<QddII')
+STATUS_SIZE = 16 * 1024
+FRAME_SIZE = 512 * 1024
+STATUS_OFFSET = HEADER.size
+FRAME_OFFSET = STATUS_OFFSET + STATUS_SIZE
+SEGMENT_SIZE = FRAME_OFFSET + FRAME_SIZE
+
+
+def channel_name(bin_code):
+    return f"{LIVE_PREFIX}_{re.sub(r'[^A-Za-z0-9_-]', '_', bin_code)}"
+
+
+class LiveChannel:
+    """
+    Latest camera frame (JPEG) and unit status of one bin, in shared memory.
+
+    The supervisor creates the segment, the worker writes it and the
+    dashboard reads it, so the UI sees the live state without disk files
+    or a round trip through the store. Writes are guarded by a sequence
+    number (odd while a write is in progress); readers copy the data and
+    retry if the sequence moved underneath them.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        self.lock = threading.Lock()  # Writers in one process (loop, camera thread)
+
+    @classmethod
+    def create(cls, name):
+        """New, empty segment; replaces one left behind by a crashed supervisor"""
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=SEGMENT_SIZE)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=SEGMENT_SIZE)
+        HEADER.pack_into(shm.buf, 0, 0, 0.0, 0.0, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def open(cls, name):
+        """Attach to an existing segment; None if the supervisor did not create it"""
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            return None
+        # Only the creator may unlink it; otherwise it is removed when we exit
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # Writing
+    def publish_status(self, status):
+        """Replace the unit status (a JSON-serializable dict); also the heartbeat"""
+        data = json.dumps(status, separators=(',', ':')).encode()
+        if len(data) > STATUS_SIZE:
+            raise ValueError(f"Status is {len(data)} bytes, at most {STATUS_SIZE} fit")
+        self.write(status=data)
+
+    def publish_frame(self, jpeg):
+        """Replace the latest frame; False if it does not fit"""
+        if len(jpeg) > FRAME_SIZE:
+            return False
+        self.write(frame=jpeg)
+        return True
+
+    def write(self, status=None, frame=None):
+        now = time.time()
+        with self.lock:
+            seq, status_at, frame_at, status_len, frame_len = HEADER.unpack_from(self.buf)
+            struct.pack_into('<Q', self.buf, 0, seq + 1)
+            if status is not None:
+                self.buf[STATUS_OFFSET:STATUS_OFFSET + len(status)] = status
+                status_at, status_len = now, len(status)
+            if frame is not None:
+                self.buf[FRAME_OFFSET:FRAME_OFFSET + len(frame)] = frame
+                frame_at, frame_len = now, len(frame)
+            HEADER.pack_into(self.buf, 0, seq + 2, status_at, frame_at, status_len, frame_len)
+
+    # Reading
+    def updated_at(self):
+        """Time of the last status (the worker's heartbeat); 0.0 if none yet"""
+        return HEADER.unpack_from(self.buf)[1]
+
+    def read(self, frame=True, attempts=100):
+        """
+        {'status', 'status_at', 'frame', 'frame_at'} as last written, or None
+        if nothing was published yet or a consistent copy could not be made.
+        """
+        for _ in range(attempts):
+            seq, status_at, frame_at, status_len, frame_len = HEADER.unpack_from(self.buf)
+            if seq % 2:
+                time.sleep(0)  # Writer in progress
+                continue
+            status = bytes(self.buf[STATUS_OFFSET:STATUS_OFFSET + status_len])
+            jpeg = bytes(self.buf[FRAME_OFFSET:FRAME_OFFSET + frame_len]) \
+                if frame and frame_len else None
+            if struct.unpack_from('<Q', self.buf)[0] != seq:
+                continue
+            if not status_len and not frame_len:
+                return None
+            return {
+                'status': json.loads(status) if status_len else None,
+                'status_at': status_at or None,
+                'frame': jpeg,
+                'frame_at': frame_at or None,
+            }
+        return None
+
+
+class FramePublisher:
+    """
+    ChangeDetector frame listener: publishes at most max_fps frames,
+    downscaled and JPEG-encoded, so the camera loop stays cheap.
+    """
+
+    def __init__(self, channel, max_fps=2.0, width=640, quality=70):
+        self.channel = channel
+        self.interval = 1.0 / max_fps
+        self.width = width
+        self.quality = quality
+        self.last = 0.0
+
+    def __call__(self, frame):
+        now = time.monotonic()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        height, width = frame.shape[:2]
+        if width > self.width:
+            frame = cv2.resize(frame, (self.width, height * self.width // width),
+                               interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if ok:
+            self.channel.publish_frame(jpeg.tobytes())
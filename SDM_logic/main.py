@@ -1,12 +1,6 @@
-import subprocess
-import os
+# Starts the worker, status API and dashboard, and keeps them running
+# (see supervisor.py)
+from supervisor import main
 
-# Run app.py in the background
-app_process = subprocess.Popen(['python3', 'app.py'])
-
-# Run streamlit dashboard
-streamlit_process = subprocess.Popen(['streamlit', 'run', 'dashboard.py'])
-
-# Wait for both processes
-app_process.wait()
-streamlit_process.wait()
+if __name__ == "__main__":
+    main()
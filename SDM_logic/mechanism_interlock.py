@@ -0,0 +1,96 @@
+import threading
+
+# Events pushed by arduino2 in throughput mode
+ROUTED_PREFIX = "ROUTED "
+LID_OPEN = "LID OPEN"
+LID_CLOSED = "LID CLOSED"
+
+
+class InterlockError(RuntimeError):
+    """Raised when the mechanism would take items out of physical order"""
+
+
+class MechanismInterlock:
+    """
+    Keeps items in physical order when the mechanism is pipelined.
+
+    The disk and flaps hold one item at a time. An item claims the disk
+    before it is compressed into it and gives it back once it has been
+    routed and the bin levels were checked, so the next item can only be
+    compressed after the previous one has left the disk. The lid is held
+    closed while the compressor runs and reopens for the next item as
+    soon as the chamber is empty.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.disk_busy = False   # An item is in (or about to enter) the disk
+        self.routing = None      # Bin the board is routing to right now
+        self.lid_open = False
+
+    def acquire_disk(self, timeout=None):
+        """Wait until the disk is free and claim it; False on timeout"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: not self.disk_busy, timeout):
+                return False
+            self.disk_busy = True
+            return True
+
+    def release_disk(self):
+        with self.condition:
+            self.disk_busy = False
+            self.routing = None
+            self.condition.notify_all()
+
+    def route_started(self, bin_code):
+        with self.condition:
+            if not self.disk_busy:
+                raise InterlockError(f"Routing to {bin_code} without claiming the disk")
+            if self.routing is not None:
+                raise InterlockError(
+                    f"Routing to {bin_code} while still routing to {self.routing}")
+            self.routing = bin_code
+
+    def route_running(self, bin_code):
+        """Track a routing run the board reported through STATUS"""
+        with self.condition:
+            self.routing = bin_code
+
+    def route_finished(self, bin_code=None):
+        """The board reported the end of a routing run"""
+        with self.condition:
+            if bin_code is not None and self.routing not in (None, bin_code):
+                print(f"Mechanism routed {bin_code}, expected {self.routing}")
+            self.routing = None
+            self.condition.notify_all()
+
+    def is_routing(self):
+        with self.condition:
+            return self.routing is not None
+
+    def wait_routed(self, timeout=None):
+        """Wait for the current routing run to end; False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.routing is None, timeout)
+
+    def wait_lid_closed(self, timeout=None):
+        """Wait until nobody is using the lid; False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.lid_open, timeout)
+
+    def set_lid_open(self, is_open):
+        with self.condition:
+            self.lid_open = is_open
+            self.condition.notify_all()
+
+    def handle_message(self, message):
+        """Channel event callback; returns True if the message was a mechanism event"""
+        if message.startswith(ROUTED_PREFIX):
+            self.route_finished(message[len(ROUTED_PREFIX):].strip())
+        elif message == LID_OPEN:
+            self.set_lid_open(True)
+        elif message == LID_CLOSED:
+            self.set_lid_open(False)
+        else:
+            return False
+        return True
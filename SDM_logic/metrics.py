@@ -0,0 +1,368 @@
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from serial_stats import LATENCY_BUCKETS_MS
+
+# Local only: scraped by a Prometheus agent on the same host
+METRICS_HOST = os.environ.get('SDM_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('SDM_METRICS_PORT', '9600'))
+
+# Upper bounds (seconds) of the stage and API latency buckets
+LATENCY_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 60)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class CounterValue:
+    """One labelled counter; inc() is a locked add, cheap enough for the hot path"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class GaugeValue(CounterValue):
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    """Bucket counts, sum and count of one labelled histogram"""
+
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        return histogram_samples(name, labels, self.bounds, counts, total)
+
+
+def histogram_samples(name, labels, bounds, counts, total):
+    """Prometheus samples of per-bucket counts (the last bucket open-ended)"""
+    samples = []
+    cumulative = 0
+    for bound, n in zip(list(bounds) + [math.inf], counts):
+        cumulative += n
+        samples.append((f"{name}_bucket", dict(labels, le=format_value(bound)), cumulative))
+    samples.append((f"{name}_sum", labels, total))
+    samples.append((f"{name}_count", labels, cumulative))
+    return samples
+
+
+class Metric:
+    """
+    A named metric with a value per combination of label values.
+    labels(...) returns that value (created on first use); metrics
+    without labels are updated directly.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        (default_registry if registry is None else registry).register(self)
+
+    def new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **labels):
+        key = tuple(str(v) for v in (values or [labels[n] for n in self.labelnames]))
+        value = self.values.get(key)
+        if value is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self.lock:
+                value = self.values.setdefault(key, self.new_value())
+        return value
+
+    def collect(self):
+        samples = []
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            samples.extend(value.samples(self.name, dict(zip(self.labelnames, key))))
+        return [(self.name, self.type, self.help, samples)]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def new_value(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def new_value(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS_S, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def new_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry:
+    """
+    Metrics of one process. Collectors (key -> callable returning
+    [(name, type, help, samples)]) read state that is already kept
+    elsewhere, such as the serial statistics, only when scraped.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = {}
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def register_collector(self, key, collect):
+        """Add a collector; one registered under the same key is replaced"""
+        with self.lock:
+            self.collectors[key] = collect
+
+    def unregister_collector(self, key):
+        with self.lock:
+            self.collectors.pop(key, None)
+
+    def collect(self):
+        with self.lock:
+            metrics, collectors = list(self.metrics), list(self.collectors.items())
+        families = {}
+        for metric in metrics:
+            for family in metric.collect():
+                merge_family(families, family)
+        for key, collect in collectors:
+            try:
+                for family in collect():
+                    merge_family(families, family)
+            except Exception as e:
+                print(f"Metrics collector {key} failed: {e}")
+        return list(families.values())
+
+    def render(self):
+        """Everything in the Prometheus text exposition format"""
+        lines = []
+        for name, type, help, samples in self.collect():
+            help = help.replace('\\', '\\\\').replace('\n', '\\n')
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def merge_family(families, family):
+    """Collectors of several units report the same metric names"""
+    name, type, help, samples = family
+    if name in families:
+        families[name][3].extend(samples)
+    else:
+        families[name] = (name, type, help, list(samples))
+
+
+# Shared by the sorting runtime (app.py, multi_unit.py) and the status API
+default_registry = Registry()
+
+ITEMS_SORTED = Counter(
+    'sdm_items_sorted_total', "Items classified and routed into a bin", ['bin', 'category'])
+ITEMS_DROPPED = Counter(
+    'sdm_items_dropped_total', "Detections that were not sorted", ['bin', 'reason'])
+FALSE_TRIGGERS = Counter(
+    'sdm_false_triggers_total',
+    "Detections for which the classifier found nothing sortable", ['bin'])
+STAGE_SECONDS = Histogram(
+    'sdm_stage_seconds', "Time an item spent in each pipeline stage", ['bin', 'stage'])
+CYCLE_SECONDS = Histogram(
+    'sdm_cycle_seconds', "Time from detecting an item to recording it", ['bin'])
+CLASSIFIER_SECONDS = Histogram(
+    'sdm_classifier_request_seconds', "Classifier API call duration", ['provider'])
+CLASSIFIER_ERRORS = Counter(
+    'sdm_classifier_errors_total', "Failed classifier API calls", ['provider', 'kind'])
+EVENT_WRITE_ERRORS = Counter(
+    'sdm_event_store_write_errors_total',
+    "Failed event store batch writes (unavailable ones are retried)", ['kind'])
+EVENTS_LOST = Counter(
+    'sdm_event_store_events_lost_total', "Recorded items that were never stored")
+RESPONSE_CACHE = Counter(
+    'sdm_status_cache_requests_total', "Status API responses by cache result", ['result'])
+
+
+def error_kind(error):
+    """'timeout' for timeouts and deadline errors of any client library, else 'error'"""
+    name = type(error).__name__.lower()
+    if isinstance(error, TimeoutError) or 'timeout' in name or 'deadline' in name:
+        return 'timeout'
+    return 'error'
+
+
+@contextmanager
+def classifier_request(provider):
+    """Time one classifier API call and count it if it fails"""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        CLASSIFIER_ERRORS.labels(provider, error_kind(e)).inc()
+        raise
+    finally:
+        CLASSIFIER_SECONDS.labels(provider).observe(time.monotonic() - started)
+
+
+def unit_collector(bin_code, cmd):
+    """
+    Collector for a unit's serial statistics, sensor cache and bin
+    levels, read from its CommandManager at scrape time.
+    """
+    # Here, not at the top: vision imports this module before the store is configured
+    from event_store import BINS
+
+    bounds = [ms / 1000 for ms in LATENCY_BUCKETS_MS]
+
+    def collect():
+        snapshot = cmd.stats.snapshot()
+        requests, timeouts, errors, retries, latency = [], [], [], [], []
+        for board, commands in snapshot['boards'].items():
+            for command, stats in commands.items():
+                labels = {'bin': bin_code, 'board': board, 'command': command}
+                requests.append(('sdm_serial_requests_total', labels, stats['count']))
+                timeouts.append(('sdm_serial_timeouts_total', labels, stats['timeouts']))
+                errors.append(('sdm_serial_errors_total', labels, stats['errors']))
+                retries.append(('sdm_serial_retries_total', labels, stats['retries']))
+                latency.extend(histogram_samples(
+                    'sdm_serial_request_seconds', labels, bounds,
+                    list(stats['histogram_ms'].values()),
+                    (stats['mean_ms'] or 0) * stats['count'] / 1000))
+        cache = []
+        for board, counts in snapshot['sensor_cache'].items():
+            for result, key in (('hit', 'hits'), ('miss', 'misses')):
+                cache.append(('sdm_sensor_cache_requests_total',
+                              {'bin': bin_code, 'board': board, 'result': result}, counts[key]))
+        levels = cmd.telemetry.get() or []
+        age = cmd.telemetry.age()
+        return [
+            ('sdm_serial_requests_total', 'counter', "Serial requests per board and command", requests),
+            ('sdm_serial_timeouts_total', 'counter', "Serial requests that timed out", timeouts),
+            ('sdm_serial_errors_total', 'counter', "Serial requests that failed", errors),
+            ('sdm_serial_retries_total', 'counter', "Serial request retries", retries),
+            ('sdm_serial_request_seconds', 'histogram', "Serial request latency", latency),
+            ('sdm_sensor_cache_requests_total', 'counter',
+             "Bin level reads by telemetry cache result", cache),
+            ('sdm_bin_level', 'gauge', "Latest bin level reading per compartment",
+             [('sdm_bin_level', {'bin': bin_code, 'compartment': b}, level)
+              for b, level in zip(BINS, levels)]),
+            ('sdm_bin_level_age_seconds', 'gauge', "Age of the latest bin level reading",
+             [('sdm_bin_level_age_seconds', {'bin': bin_code}, round(age, 3))]
+             if age is not None else []),
+        ]
+
+    return collect
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics   Prometheus text format"""
+
+    server_version = "SDMMetrics/1.0"
+
+    def log_message(self, format, *args):
+        pass  # Scraped every few seconds
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, registry=None):
+        super().__init__(address, MetricsHandler)
+        self.registry = default_registry if registry is None else registry
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST, registry=None):
+    """
+    Serve /metrics from a background thread. Returns the server, or None
+    if the port cannot be bound (sorting carries on without metrics).
+    """
+    try:
+        server = MetricsServer((host, port), registry)
+    except OSError as e:
+        print(f"Metrics server not started on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
+
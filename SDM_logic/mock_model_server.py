@@ -0,0 +1,180 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Answers the mock gives, as the model would for the classification prompt
+ITEMS = [
+    ("Bio Degradable and Recyclable", "Cardboard box",
+     "Flatten it and put it in the paper recycling.", "Breaks down in a few months."),
+    ("Bio Degradable and Non Recyclable", "Banana peel",
+     None, "Composts within weeks."),
+    ("Non Bio Degradable and Recyclable", "Plastic bottle",
+     "Rinse it and recycle it with PET plastics.", "Takes ~450 years to break down."),
+    ("Non Bio Degradable and Non Recyclable", "Used face mask",
+     None, "Sheds microplastics for decades."),
+]
+# Response times kept for the percentiles; soak runs answer many more
+LATENCY_SAMPLES = 10000
+
+
+class LatencyModel:
+    """Log-normal response times given by their median and 95th percentile"""
+
+    def __init__(self, median_s=1.5, p95_s=4.0, seed=None):
+        self.median_s = median_s
+        # p95 = median * exp(1.645 sigma)
+        self.sigma = math.log(p95_s / median_s) / 1.645 if p95_s > median_s else 0.0
+        self.random = random.Random(seed)
+
+    def sample(self):
+        return self.median_s * math.exp(self.random.gauss(0.0, self.sigma))
+
+
+class MockModelHandler(BaseHTTPRequestHandler):
+    """
+    POST /v1beta/models/{model}:generateContent   Gemini REST
+    POST /v1/chat/completions                     OpenAI chat completions
+    """
+
+    server_version = "MockModel/1.0"
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        started = time.monotonic()
+        # Read the whole upload (the image), as a real endpoint would
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        if self.path.split('?')[0].endswith(':generateContent'):
+            provider = 'gemini'
+        elif self.path.split('?')[0] == '/v1/chat/completions':
+            provider = 'openai'
+        else:
+            self.send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        time.sleep(server.latency.sample())
+        failed = server.random.random() < server.error_rate
+        if failed:
+            self.send_json(server.error_status, {'error': {
+                'code': server.error_status, 'message': 'Injected error',
+                'status': 'UNAVAILABLE'}})
+        else:
+            text = server.answer()
+            self.send_json(200, gemini_response(text) if provider == 'gemini'
+                           else openai_response(text))
+        server.record(time.monotonic() - started, failed)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def gemini_response(text):
+    return {
+        'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'},
+                        'finishReason': 'STOP', 'index': 0}],
+        'usageMetadata': {'promptTokenCount': 300, 'candidatesTokenCount': 80},
+    }
+
+
+def openai_response(text):
+    return {
+        'id': 'chatcmpl-mock',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': 'mock',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                     'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 300, 'completion_tokens': 80, 'total_tokens': 380},
+    }
+
+
+class MockModelServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Gemini and OpenAI endpoints: answers the
+    classification prompt after a random latency, failing error_rate of
+    the requests with error_status.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=None, error_rate=0.0, error_status=503,
+                 fenced_rate=0.5, seed=None):
+        super().__init__(address, MockModelHandler)
+        self.latency = latency or LatencyModel(seed=seed)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        # Models often wrap the JSON in ```json fences
+        self.fenced_rate = fenced_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.answers = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.errors = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def answer(self):
+        with self.lock:
+            category, item, tips, facts = ITEMS[self.answers % len(ITEMS)]
+            self.answers += 1
+        text = json.dumps({'Category': category, 'Item': item,
+                           'Recyclable tips': tips, 'Bio degradable facts': facts},
+                          indent=4)
+        if self.random.random() < self.fenced_rate:
+            text = f"```json\n{text}\n```"
+        return text
+
+    def record(self, seconds, failed):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.errors += failed
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="mock-model", daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Gemini/OpenAI endpoint for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--median-s', type=float, default=1.5)
+    parser.add_argument('--p95-s', type=float, default=4.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockModelServer((args.host, args.port),
+                             LatencyModel(args.median_s, args.p95_s, args.seed),
+                             args.error_rate, args.error_status, seed=args.seed)
+    print(f"Mock model server on {server.url} "
+          f"(median {args.median_s} s, p95 {args.p95_s} s, errors {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
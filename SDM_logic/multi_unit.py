@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# First of the local imports, so the startup report includes the rest
+from startup import IMPORTED_AT, StartupReport
+from app import create_pipeline, create_supervisor, run_supervised
+from capture_archive import default_archive
+from change_detection import ChangeDetector
+from component_supervisor import CameraComponent
+from command_manager import CommandManager
+from event_store import default_store
+from live_channel import FramePublisher, LiveChannel, channel_name
+from metrics import default_registry, start_metrics_server, unit_collector
+from profiling import start_profiling_control
+from tuning import apply_detection, apply_mechanism, load_profile
+from unit_registry import UNITS_FILE, load_units
+from vision import capture_and_classify, warm_up
+
+
+class RateLimiter:
+    """Spaces out calls so all units together stay within the API quota"""
+
+    def __init__(self, rate_per_minute):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute else 0.0
+        self.next_slot = 0.0
+
+    async def acquire(self):
+        # No await between reading and moving next_slot, so concurrent
+        # callers on the same event loop always get distinct slots
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class ClassifierPool:
+    """
+    Classifier client pool shared by all units.
+
+    Requests are queued per unit and served round-robin, so when several
+    units trigger at the same moment each gets its turn before any unit
+    gets a second one.
+    """
+
+    def __init__(self, workers=2, rate_per_minute=30):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="classifier")
+        self.limiter = RateLimiter(rate_per_minute)
+        self.queues = {}      # unit code -> deque of (fn, args, future)
+        self.order = deque()  # units with queued requests, in serving order
+        self.pending = None
+        self.tasks = []
+
+    def start(self):
+        """Start the dispatcher tasks (call from inside the event loop)"""
+        self.pending = asyncio.Semaphore(0)
+        self.tasks = [asyncio.create_task(self.dispatch())
+                      for _ in range(self.workers)]
+
+    async def classify(self, unit_code, fn, *args):
+        """Queue fn(*args) for unit_code and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(unit_code, deque())
+        if not queue:
+            self.order.append(unit_code)
+        queue.append((fn, args, future))
+        self.pending.release()
+        return await future
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.pending.acquire()
+
+            # Take one request from the unit whose turn it is
+            unit_code = self.order.popleft()
+            queue = self.queues[unit_code]
+            fn, args, future = queue.popleft()
+            if queue:
+                self.order.append(unit_code)
+            if future.cancelled():
+                continue
+
+            await self.limiter.acquire()
+            try:
+                result = await loop.run_in_executor(self.executor, fn, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_unit(unit, pool, show_debug=False):
+    """Detect, classify and sort items for one bin unit, forever"""
+    code = unit['code']
+
+    async def classify(detector):
+        return await pool.classify(code, capture_and_classify, None, detector)
+
+    # Created by supervisor.py; None when run on its own
+    live = LiveChannel.open(channel_name(code))
+    report = StartupReport(IMPORTED_AT, name=code)
+    # Calibrated values (calibrate.py) override the registry's change_threshold
+    profile = load_profile(code)
+    while True:
+        cmd = None
+        supervisor = None
+        detector = ChangeDetector(unit['camera'], name=code, show_debug=show_debug)
+        change_threshold = apply_detection(detector, profile, unit['change_threshold'])
+        if live:
+            detector.frame_listener = FramePublisher(live)
+
+        def connect():
+            nonlocal cmd  # Closed below even if the camera fails
+            cmd = CommandManager(unit['ports'])
+            apply_mechanism(cmd, profile)
+
+        try:
+            print(f"[{code}] Initializing unit...")
+            # Serial links and camera come up side by side
+            await asyncio.to_thread(report.parallel, serial=connect,
+                                    camera=CameraComponent(detector).start)
+            default_registry.register_collector(code, unit_collector(code, cmd))
+            supervisor, supervised_classify = create_supervisor(
+                cmd, detector, classify, name=code)
+            await asyncio.to_thread(report.run, "components", supervisor.start)
+
+            pipeline = create_pipeline(
+                cmd, detector, code, unit['location'], classify=supervised_classify,
+                change_threshold=change_threshold)
+            report.report()
+            # Only the failed component restarts; other units are not affected
+            await run_supervised(supervisor, pipeline, live)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[{code}] Unit error: {e}, restarting unit in 5 s")
+            await asyncio.sleep(5)
+        finally:
+            if supervisor:
+                supervisor.stop()
+            else:
+                detector.release_camera()
+            if cmd:
+                cmd.close()
+            default_registry.unregister_collector(code)
+        report = StartupReport(name=code)  # Time the restart on its own
+
+
+async def warm_up_classifier():
+    """Import and configure the classifier client while the units start"""
+    try:
+        await asyncio.to_thread(warm_up)
+    except Exception as e:
+        print(f"Classifier warm-up failed, retrying on first use: {e}")
+
+
+async def run_units(units, classifier):
+    """Run every unit as its own task, sharing one classifier pool"""
+    # Each unit keeps up to two blocking calls (camera/serial) in flight
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=len(units) * 2 + 4))
+
+    pool = ClassifierPool(classifier['workers'], classifier['rate_per_minute'])
+    pool.start()
+    # OpenCV debug windows are only safe with a single unit
+    show_debug = len(units) == 1
+    try:
+        await asyncio.gather(warm_up_classifier(),
+                             *(run_unit(unit, pool, show_debug) for unit in units))
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several bin units from one host")
+    parser.add_argument('--units', default=UNITS_FILE, help="Unit registry (JSON)")
+    args = parser.parse_args()
+
+    units, classifier = load_units(args.units)
+    print("Multi-unit controller")
+    print("=====================")
+    for unit in units:
+        print(f"{unit['code']}: {unit['location']} "
+              f"(camera {unit['camera']}, ports {unit['ports'] or 'auto'})")
+    print(f"Classifier: {classifier['workers']} workers, "
+          f"{classifier['rate_per_minute']} requests/minute shared")
+
+    default_store.register_sites(units)  # For the fleet overview
+    default_archive.start()
+    start_metrics_server()  # One endpoint for all units, labelled by bin
+    # Profiling on demand: python profiling.py profile, or kill -USR1 <pid>
+    profiling = start_profiling_control()
+    try:
+        asyncio.run(run_units(units, classifier))
+    except KeyboardInterrupt:
+        print("\nSystem stopped by user")
+    finally:
+        if profiling:
+            profiling.stop()
+        default_archive.stop()
+        default_store.close()
+
+
+if __name__ == "__main__":
+    main()
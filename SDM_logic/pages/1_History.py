@@ -0,0 +1,126 @@
+import time
+from datetime import datetime
+
+import plotly.graph_objects as go
+import streamlit as st
+
+from dashboard_data import (load_bins, load_category_trend, load_time_range,
+                            load_top_items, load_trend, range_end, store_version,
+                            watch_store)
+from event_store import BINS, bucket_width
+
+st.set_page_config(page_title="GREEN GUARDIAN · History",
+                   page_icon="📈", layout="wide")
+
+# Points per chart; the store merges buckets down to this many
+MAX_POINTS = 300
+
+RANGES = {
+    "Last 24 hours": 86400,
+    "Last 7 days": 7 * 86400,
+    "Last 30 days": 30 * 86400,
+    "Last year": 365 * 86400,
+    "All time": None,
+}
+LABELS = {
+    'BR': "Bio & Recyclable",
+    'BNR': "Bio & Non-Recyclable",
+    'NBR': "Non-Bio & Recyclable",
+    'NBNR': "Non-Bio & Non-Recyclable",
+}
+COLORS = {'BR': '#2ecc71', 'BNR': '#e74c3c', 'NBR': '#3498db', 'NBNR': '#f1c40f'}
+
+
+def describe_width(seconds):
+    """'hour', '3 hours', '2 days', ... for chart titles"""
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= size and seconds % size == 0:
+            count = seconds // size
+            return unit if count == 1 else f"{count} {unit}s"
+    return f"{seconds // 60} minutes"
+
+
+def to_datetimes(rows):
+    return [datetime.fromtimestamp(row['bucket']) for row in rows]
+
+
+st.markdown("<h1 style='text-align: center;'>📈 Bin History</h1>",
+            unsafe_allow_html=True)
+
+version = store_version()
+bins = load_bins(version)
+if not bins:
+    st.info("No items recorded yet")
+    watch_store(version)
+    st.stop()
+
+control_col1, control_col2 = st.columns(2)
+with control_col1:
+    options = ["All bins"] + bins
+    requested = st.query_params.get('bin')  # Drill-down from the fleet page
+    choice = st.selectbox("Bin", options,
+                          index=options.index(requested) if requested in options else 0)
+    bin_code = None if choice == "All bins" else choice
+with control_col2:
+    range_label = st.radio("Range", list(RANGES), index=1, horizontal=True)
+
+until = range_end()
+if RANGES[range_label] is None:
+    oldest, _ = load_time_range(version)
+    since = oldest if oldest is not None else until - 86400
+else:
+    since = until - RANGES[range_label]
+width = describe_width(bucket_width(since, until, MAX_POINTS))
+
+# Fill levels over time (average per bucket, with the range in the hover)
+trend = load_trend(version, since, until, bin_code, MAX_POINTS)
+st.subheader(f"🗑️ Fill level over time (per {width})")
+if trend:
+    fig = go.Figure()
+    times = to_datetimes(trend)
+    for b in BINS:
+        key = b.lower()
+        fig.add_trace(go.Scatter(
+            x=times, y=[row[f'{key}_avg'] for row in trend],
+            customdata=[(row[f'{key}_min'], row[f'{key}_max']) for row in trend],
+            name=LABELS[b], mode='lines', line=dict(color=COLORS[b]), connectgaps=False,
+            hovertemplate="%{y:.0f}% (min %{customdata[0]}%, max %{customdata[1]}%)"))
+    fig.update_layout(yaxis=dict(title="Filled (%)", range=[0, 100]),
+                      height=380, margin=dict(t=20, b=20, l=20, r=20),
+                      legend=dict(orientation='h'))
+    st.plotly_chart(fig, use_container_width=True)
+else:
+    st.info("No items in this range")
+
+# Items per category per bucket
+categories = load_category_trend(version, since, until, bin_code, MAX_POINTS)
+st.subheader(f"📦 Items per category (per {width})")
+if categories:
+    fig = go.Figure()
+    for category in sorted({row['category'] for row in categories}):
+        rows = [row for row in categories if row['category'] == category]
+        fig.add_trace(go.Bar(x=to_datetimes(rows), y=[row['items'] for row in rows],
+                             name=category))
+    fig.update_layout(barmode='stack', yaxis=dict(title="Items"), height=380,
+                      margin=dict(t=20, b=20, l=20, r=20), legend=dict(orientation='h'))
+    st.plotly_chart(fig, use_container_width=True)
+else:
+    st.info("No items in this range")
+
+# Top items
+st.subheader("🏆 Top items")
+top = load_top_items(version, since, until, bin_code)
+if top:
+    st.dataframe([
+        {
+            "Item": row['item'],
+            "Category": row['category'],
+            "Count": row['count'],
+            "Last seen": time.strftime('%Y-%m-%d %H:%M', time.localtime(row['last_seen'])),
+        }
+        for row in top
+    ], use_container_width=True, hide_index=True)
+else:
+    st.info("No items in this range")
+
+watch_store(version)
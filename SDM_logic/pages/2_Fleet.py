@@ -0,0 +1,102 @@
+import math
+import time
+
+import plotly.graph_objects as go
+import streamlit as st
+
+from dashboard_data import (ALERT_LEVEL, capture_image_url, load_fleet, load_fleet_map,
+                            load_fleet_summary, range_end, store_version, watch_store)
+
+st.set_page_config(page_title="GREEN GUARDIAN · Fleet",
+                   page_icon="🗺️", layout="wide")
+
+# Bins not heard from for this long count as stale
+STALE_S = 86400
+
+SORTS = {
+    "Bin code": 'code',
+    "Location": 'location',
+    "Fullest compartment": 'fullest',
+    "Last seen": 'last_seen',
+}
+PAGE_SIZES = [25, 50, 100]
+
+
+def format_time(ts):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(ts)) if ts else "Never"
+
+
+st.markdown("<h1 style='text-align: center;'>🗺️ Fleet Overview</h1>",
+            unsafe_allow_html=True)
+
+version = store_version()
+summary = load_fleet_summary(version, range_end() - STALE_S)
+metric_cols = st.columns(4)
+metric_cols[0].metric("Bins", summary['bins'])
+metric_cols[1].metric(f"Over {ALERT_LEVEL}% full", summary['alerts'])
+metric_cols[2].metric("Not seen for 24 h", summary['stale'])
+metric_cols[3].metric("Never seen", summary['never_seen'])
+
+# One map for the whole fleet; nearby bins are clustered by the map itself
+points = load_fleet_map(version)
+if points:
+    fig = go.Figure(go.Scattermapbox(
+        lat=[p['lat'] for p in points],
+        lon=[p['lon'] for p in points],
+        text=[f"{p['code']} · {p['location']}<br>Fullest: {p['max_level']}%"
+              f"<br>Last seen: {format_time(p['last_seen'])}" for p in points],
+        hoverinfo='text',
+        marker=dict(size=12, color=[p['max_level'] for p in points], cmin=0, cmax=100,
+                    colorscale=[[0, '#2ecc71'], [0.8, '#f1c40f'], [1, '#e74c3c']]),
+        cluster=dict(enabled=True, size=20, step=[10, 100], color='#3498db'),
+    ))
+    fig.update_layout(
+        mapbox=dict(style='open-street-map', zoom=3,
+                    center=dict(lat=sum(p['lat'] for p in points) / len(points),
+                                lon=sum(p['lon'] for p in points) / len(points))),
+        height=450, margin=dict(t=0, b=0, l=0, r=0))
+    st.plotly_chart(fig, use_container_width=True)
+else:
+    st.info("No bins with coordinates; add them to units.json to see the map")
+
+# Bin table, sorted and paged by the store
+filter_cols = st.columns([2, 2, 1, 1, 1])
+search = filter_cols[0].text_input("Search code or location").strip() or None
+sort_label = filter_cols[1].selectbox("Sort by", list(SORTS), index=2)
+descending = filter_cols[2].toggle("Descending", value=True)
+alerts_only = filter_cols[3].toggle("Alerts only")
+page_size = filter_cols[4].selectbox("Per page", PAGE_SIZES)
+
+total, _ = load_fleet(version, 0, 0, SORTS[sort_label], descending, search, alerts_only)
+pages = max(1, math.ceil(total / page_size))
+page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+_, rows = load_fleet(version, (page - 1) * page_size, page_size,
+                     SORTS[sort_label], descending, search, alerts_only)
+
+st.dataframe(
+    [
+        {
+            "Bin": f"/?bin={row['code']}",
+            "Location": row['location'],
+            "Status": "⚠️ Alert" if row['alert'] else ("OK" if row['last_seen'] else "—"),
+            "BR": row['br'], "BNR": row['bnr'], "NBR": row['nbr'], "NBNR": row['nbnr'],
+            "Last seen": format_time(row['last_seen']),
+            "Last item": row['item'] or "",
+            "Photo": capture_image_url(row['capture_hash'], thumb=True),
+            "History": f"/History?bin={row['code']}",
+        }
+        for row in rows
+    ],
+    column_config={
+        # Drill-down into the per-bin dashboard and its history
+        "Bin": st.column_config.LinkColumn("Bin", display_text=r"bin=(.*)$"),
+        "History": st.column_config.LinkColumn("History", display_text="📈 History"),
+        # Thumbnails written at ingest, cached by the browser
+        "Photo": st.column_config.ImageColumn("Photo"),
+        **{b: st.column_config.ProgressColumn(b, format="%d%%", min_value=0, max_value=100)
+           for b in ("BR", "BNR", "NBR", "NBNR")},
+    },
+    use_container_width=True, hide_index=True)
+st.caption(f"{total} bins · page {page} of {pages}")
+
+watch_store(version)
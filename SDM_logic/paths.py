@@ -0,0 +1,12 @@
+import os
+
+# Runtime state: event store, capture archive, serial statistics, tuning
+# profiles, profiler output and the admin socket. Kept in one directory
+# (ignored by git) whatever directory the process was started from.
+DATA_DIR = os.environ.get(
+    'SDM_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+
+def data_path(name):
+    """Default location of a runtime file or directory"""
+    return os.path.join(DATA_DIR, name)
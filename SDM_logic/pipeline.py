@@ -0,0 +1,200 @@
+import asyncio
+import queue
+import threading
+import time
+
+from vision import capture_and_classify
+
+
+class RecordWorker:
+    """Runs record jobs (database, images, dashboard files) off the critical path"""
+
+    def __init__(self, handler, maxsize=16, name="record"):
+        self.handler = handler
+        self.jobs = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, job):
+        """Queue a job; blocks when the queue is full (back-pressure)"""
+        self.jobs.put(job)
+
+    def stop(self, timeout=30):
+        """Finish queued jobs, then stop the worker"""
+        self.jobs.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                self.handler(job)
+            except Exception as e:
+                print(f"Error recording item: {e}")
+
+
+async def classify_locally(detector):
+    """
+    Default classify stage: capture from the detector's open camera and
+    call the classifier from a worker thread
+    """
+    return await asyncio.to_thread(capture_and_classify, detector=detector)
+
+
+class ItemPipeline:
+    """
+    Sorting pipeline for one bin unit:
+
+        detect -> classify -> actuate -> record
+
+    Stages run concurrently and hand items over through bounded queues, so
+    a slow stage holds back the ones before it instead of fixed sleeps.
+    Detection of the next item starts as soon as the mechanism is free,
+    and recording (database, last item image) happens in a background
+    worker after the item has been routed.
+
+    With dispatch/finish (throughput mode) actuation is split in two:
+    dispatch compresses the item and starts routing it, which frees the
+    chamber for the next item, and a separate route stage waits for the
+    routing to finish. The command manager's interlock keeps the items
+    in physical order.
+    """
+
+    def __init__(self, cmd, detector, parse, actuate, record,
+                 bin_code, location, classify=classify_locally,
+                 change_threshold=0.01, poll_interval=1.0,
+                 queue_size=1, record_queue_size=16, dispatch=None, finish=None):
+        self.cmd = cmd
+        self.detector = detector
+        self.parse = parse
+        self.actuate = actuate
+        self.record = record
+        self.classify = classify
+        self.bin_code = bin_code
+        self.location = location
+        self.change_threshold = change_threshold
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.record_queue_size = record_queue_size
+        self.dispatch = dispatch
+        self.finish = finish
+        self.throughput = dispatch is not None and finish is not None
+        # Items between detection and recording
+        self.in_flight = 0
+
+    async def run(self):
+        """Run all stages until one of them fails"""
+        self.classify_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.actuate_queue = asyncio.Queue(maxsize=self.queue_size)
+        # Items routed in the background (throughput mode)
+        self.route_queue = asyncio.Queue(maxsize=self.queue_size)
+        # Cleared while an item occupies the mechanism
+        self.mechanism_free = asyncio.Event()
+        self.mechanism_free.set()
+        self.in_flight = 0
+
+        self.recorder = RecordWorker(
+            self.record, self.record_queue_size, name=f"record-{self.bin_code}")
+        self.recorder.start()
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(self.detect_stage())
+                tasks.create_task(self.classify_stage())
+                tasks.create_task(self.actuate_stage())
+                if self.throughput:
+                    tasks.create_task(self.route_stage())
+        except ExceptionGroup as group:
+            raise group.exceptions[0]  # Report the stage that failed
+        finally:
+            await asyncio.to_thread(self.recorder.stop)
+
+    def idle(self):
+        """True when no item is between detection and recording"""
+        return self.in_flight == 0
+
+    async def submit_record(self, item):
+        """Hand a finished (or dropped) item to the record worker"""
+        await asyncio.to_thread(self.recorder.submit, item)
+        self.in_flight -= 1
+
+    def item_done(self):
+        """The mechanism has finished with the current item"""
+        self.mechanism_free.set()
+        print(f"\n[{self.bin_code}] Ready for next item...")
+
+    async def detect_stage(self):
+        while True:
+            await self.mechanism_free.wait()
+            if self.throughput and not await asyncio.to_thread(
+                    self.cmd.wait_lid_closed, self.poll_interval):
+                continue  # Someone is putting an item in
+
+            detected = await asyncio.to_thread(
+                self.detector.detect_new_object, self.change_threshold)
+            if not detected:
+                print("✅ No new object detected")
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            print("🔴 Object detected!")
+            self.mechanism_free.clear()
+            self.in_flight += 1
+            await self.classify_queue.put({
+                'bin_code': self.bin_code,
+                'location': self.location,
+                'detected_at': time.time(),
+            })
+
+    async def classify_stage(self):
+        while True:
+            item = await self.classify_queue.get()
+
+            print("\nWaiting for trash...")
+            result, image_path = await self.classify(self.detector)
+            item['image_path'] = image_path
+            item['classified_at'] = time.time()
+
+            result_data = self.parse(result)
+            if result_data is None:
+                # Nothing to sort; drop the capture and look again
+                item['result'] = None
+                item['drop_reason'] = 'classifier_error' \
+                    if not result or result.startswith("Error") else 'unparsed'
+                await self.submit_record(item)
+                self.item_done()
+                continue
+
+            item['result'] = result_data
+            await self.actuate_queue.put(item)
+
+    async def actuate_stage(self):
+        while True:
+            item = await self.actuate_queue.get()
+            if self.throughput:
+                try:
+                    await asyncio.to_thread(self.dispatch, self.cmd, item['result'])
+                    item['dispatched_at'] = time.time()
+                finally:
+                    self.item_done()
+                await self.route_queue.put(item)
+                continue
+
+            try:
+                item['sensor_data'] = await asyncio.to_thread(
+                    self.actuate, self.cmd, item['result'])
+                item['actuated_at'] = time.time()
+            finally:
+                self.item_done()
+            await self.submit_record(item)
+
+    async def route_stage(self):
+        while True:
+            item = await self.route_queue.get()
+            item['sensor_data'] = await asyncio.to_thread(
+                self.finish, self.cmd, item['result'])
+            item['actuated_at'] = time.time()
+            await self.submit_record(item)
@@ -0,0 +1,358 @@
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+from paths import data_path
+
+# Local admin socket of the running worker (app.py / multi_unit.py)
+ADMIN_SOCKET = os.environ.get('SDM_ADMIN_SOCKET', data_path('admin.sock'))
+# Where profiles and memory snapshots are written
+PROFILE_DIR = os.environ.get('SDM_PROFILE_DIR', data_path('profiles'))
+# Duration of a profile started by SIGUSR1
+PROFILE_S = float(os.environ.get('SDM_PROFILE_S', '30'))
+SAMPLE_INTERVAL_S = 0.01
+# Bounds on what a profile may hold: frames kept per sampled stack,
+# distinct stacks (further ones are counted as "[other]") and
+# tracemalloc frames per allocation
+MAX_STACK_DEPTH = 128
+MAX_STACKS = 20000
+MAX_TRACE_FRAMES = 25
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=SAMPLE_INTERVAL_S, stop=None):
+    """
+    Sample every thread's stack each interval for seconds (wall clock, so
+    threads waiting on the camera, serial links or the API show up too).
+    Returns a Counter of collapsed stacks: "thread;outer;...;inner".
+    """
+    me = threading.get_ident()
+    stacks = Counter()
+    names = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not (stop and stop.is_set()):
+        frames = sys._current_frames()
+        if frames.keys() - names.keys():
+            names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in frames.items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)).replace(';', ':'))
+            key = ";".join(reversed(stack))
+            if key not in stacks and len(stacks) >= MAX_STACKS:
+                key = "[other]"
+            stacks[key] += 1
+        del frames, frame
+        time.sleep(interval)
+    return stacks
+
+
+def write_collapsed(stacks, path):
+    """Collapsed stacks, one "stack count" per line (flamegraph.pl, speedscope)"""
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+class ProfilingControl:
+    """
+    Profiling of a running worker without stopping it, one profile at a
+    time, controlled over a local Unix socket (see main()) or signals:
+    SIGUSR1 profiles for PROFILE_S seconds, SIGUSR2 takes a memory snapshot.
+
+    sample:   wall-clock stack sampling of all threads; writes collapsed stacks
+    cprofile: deterministic profile of all threads (Python 3.12 profiles
+              every thread from one place); writes .prof and a text summary
+    """
+
+    def __init__(self, socket_path=ADMIN_SOCKET, output_dir=PROFILE_DIR):
+        self.socket_path = socket_path
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.running = None     # {'mode', 'started_at', 'seconds', 'output'}
+        self.last = None        # Output of the last finished profile
+        self.stop_event = threading.Event()
+        self.snapshot = None    # Previous tracemalloc snapshot, for diffs
+        self.server = None
+
+    def output_path(self, kind, suffix):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return os.path.join(self.output_dir, f"{stamp}-{os.getpid()}-{kind}{suffix}")
+
+    # Profiles
+    def profile(self, seconds=PROFILE_S, mode='sample', interval=SAMPLE_INTERVAL_S):
+        """Start a profile in the background; returns where it will be written"""
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError(f"Unknown profile mode {mode}")
+        with self.lock:
+            if self.running:
+                raise RuntimeError(f"A {self.running['mode']} profile is already running")
+            output = self.output_path(mode, '.collapsed' if mode == 'sample' else '.prof')
+            self.running = {'mode': mode, 'started_at': time.time(), 'seconds': seconds,
+                            'output': output}
+        target = self.run_sample if mode == 'sample' else self.run_cprofile
+        threading.Thread(target=target, args=(seconds, output, interval),
+                         name=f"profile-{mode}", daemon=True).start()
+        print(f"Profiling ({mode}) for {seconds:g} s -> {output}")
+        return output
+
+    def run_sample(self, seconds, output, interval):
+        try:
+            write_collapsed(sample_stacks(seconds, interval, self.stop_event), output)
+        except Exception as e:
+            print(f"Sampling profile failed: {e}")
+        finally:
+            self.finish(output)
+
+    def run_cprofile(self, seconds, output, interval):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            self.stop_event.wait(seconds)
+            profiler.disable()
+            profiler.dump_stats(output)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+            with open(f"{os.path.splitext(output)[0]}.txt", 'w') as f:
+                f.write(summary.getvalue())
+        except Exception as e:
+            print(f"cProfile failed: {e}")
+        finally:
+            profiler.disable()
+            self.finish(output)
+
+    def finish(self, output):
+        with self.lock:
+            self.running = None
+            self.last = output
+        print(f"Profile written to {output}")
+
+    # Memory
+    def trace_memory(self, action='snapshot', frames=10):
+        """
+        start/stop tracing allocations, or snapshot: write the snapshot
+        and a summary of the top allocation sites (and the growth since
+        the previous snapshot). A snapshot starts tracing if needed.
+        """
+        frames = max(1, min(frames, MAX_TRACE_FRAMES))
+        if action == 'start':
+            tracemalloc.start(frames)
+            return {'tracing': True, 'frames': frames}
+        if action == 'stop':
+            tracemalloc.stop()
+            self.snapshot = None
+            return {'tracing': False}
+        if action != 'snapshot':
+            raise ValueError(f"Unknown tracemalloc action {action}")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            return {'tracing': True, 'frames': frames,
+                    'note': "Tracing started; take another snapshot later"}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        output = self.output_path('tracemalloc', '.snapshot')
+        snapshot.dump(output)
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced: {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB)", "",
+                 "Top allocation sites:"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:25]]
+        if self.snapshot is not None:
+            lines += ["", "Growth since the previous snapshot:"]
+            lines += [str(stat) for stat in snapshot.compare_to(self.snapshot, 'lineno')[:25]]
+        self.snapshot = snapshot
+        with open(f"{os.path.splitext(output)[0]}.txt", 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        print(f"Memory snapshot written to {output}")
+        return {'tracing': True, 'output': output, 'traced_mb': round(current / 1e6, 1)}
+
+    def threads(self):
+        """Current stack of every thread, innermost call last"""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = {}
+        for ident, frame in sys._current_frames().items():
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame_name(frame)} line {frame.f_lineno}")
+                frame = frame.f_back
+            stacks[names.get(ident, str(ident))] = list(reversed(stack))
+        return stacks
+
+    def status(self):
+        with self.lock:
+            return {'pid': os.getpid(), 'running': self.running, 'last': self.last,
+                    'tracemalloc': tracemalloc.is_tracing()}
+
+    # Control surface
+    def handle(self, command):
+        """Run one admin command: [name, args...] -> JSON-friendly reply"""
+        name, args = command[0], command[1:]
+        if name == 'profile':
+            seconds = float(args[0]) if args else PROFILE_S
+            mode = args[1] if len(args) > 1 else 'sample'
+            interval = float(args[2]) / 1000 if len(args) > 2 else SAMPLE_INTERVAL_S
+            return {'output': self.profile(seconds, mode, interval)}
+        if name == 'tracemalloc':
+            return self.trace_memory(args[0] if args else 'snapshot',
+                                     int(args[1]) if len(args) > 1 else 10)
+        if name == 'threads':
+            return self.threads()
+        if name == 'status':
+            return self.status()
+        raise ValueError(f"Unknown command {name}")
+
+    def start(self):
+        """Listen on the admin socket and install the signal handlers"""
+        if os.path.exists(self.socket_path):
+            try:
+                with socket.socket(socket.AF_UNIX) as probe:
+                    probe.connect(self.socket_path)
+                print(f"Admin socket {self.socket_path} is in use; profiling by signal only")
+                self.install_signal_handlers()
+                return self
+            except OSError:
+                os.remove(self.socket_path)  # Left behind by a worker that died
+        os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+        self.server = AdminServer(self.socket_path, self)
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self.server.serve_forever, name="admin", daemon=True).start()
+        self.install_signal_handlers()
+        return self
+
+    def install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return  # Signal handlers can only be set from the main thread
+        signal.signal(signal.SIGUSR1, lambda *_: self.safely(self.profile))
+        signal.signal(signal.SIGUSR2, lambda *_: self.safely(self.trace_memory))
+
+    def safely(self, action):
+        # From a signal handler: report, never raise into the sorting loop
+        try:
+            action()
+        except Exception as e:
+            print(f"Profiling: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+
+class AdminHandler(socketserver.StreamRequestHandler):
+    """One command per line, e.g. "profile 30 cprofile"; one JSON reply per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode().split()
+            if not command:
+                continue
+            try:
+                reply = {'ok': True, 'result': self.server.control.handle(command)}
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class AdminServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, control):
+        super().__init__(path, AdminHandler)
+        self.control = control
+
+
+def start_profiling_control(socket_path=ADMIN_SOCKET, output_dir=PROFILE_DIR):
+    """Start the profiling control surface; None if it could not be started"""
+    try:
+        return ProfilingControl(socket_path, output_dir).start()
+    except OSError as e:
+        print(f"Profiling control not started: {e}")
+        return None
+
+
+def send(command, socket_path=ADMIN_SOCKET, timeout=10.0):
+    """Send one command to a running worker; returns its reply"""
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(" ".join(command).encode() + b"\n")
+        with sock.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Profile a running worker (app.py / multi_unit.py) without stopping it")
+    parser.add_argument('--socket', default=ADMIN_SOCKET, help="Worker admin socket")
+    commands = parser.add_subparsers(dest='command', required=True)
+    profile = commands.add_parser('profile', help="Profile for a number of seconds")
+    profile.add_argument('--seconds', type=float, default=PROFILE_S)
+    profile.add_argument('--mode', choices=['sample', 'cprofile'], default='sample')
+    profile.add_argument('--interval-ms', type=float, default=SAMPLE_INTERVAL_S * 1000,
+                         help="Sampling interval")
+    profile.add_argument('--wait', action='store_true', help="Wait until it is written")
+    memory = commands.add_parser('tracemalloc', help="Trace allocations / take a snapshot")
+    memory.add_argument('action', choices=['start', 'snapshot', 'stop'], nargs='?',
+                        default='snapshot')
+    memory.add_argument('--frames', type=int, default=10, help="Stack depth to record")
+    commands.add_parser('threads', help="Print every thread's current stack")
+    commands.add_parser('status', help="Show the running profile, if any")
+    args = parser.parse_args()
+
+    if args.command == 'profile':
+        command = ['profile', str(args.seconds), args.mode, str(args.interval_ms)]
+    elif args.command == 'tracemalloc':
+        command = ['tracemalloc', args.action, str(args.frames)]
+    else:
+        command = [args.command]
+    try:
+        reply = send(command, args.socket)
+    except OSError as e:
+        sys.exit(f"Could not reach the worker at {args.socket}: {e}")
+    if not reply['ok']:
+        sys.exit(f"Error: {reply['error']}")
+
+    if args.command == 'threads':
+        for name, stack in reply['result'].items():
+            print(f"{name}:")
+            for frame in stack:
+                print(f"  {frame}")
+        return
+    print(json.dumps(reply['result'], indent=4))
+    if args.command == 'profile' and args.wait:
+        time.sleep(args.seconds)
+        while send(['status'], args.socket)['result']['running']:
+            time.sleep(0.5)
+        print(f"Written: {reply['result']['output']}")
+
+
+if __name__ == "__main__":
+    main()
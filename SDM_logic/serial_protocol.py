@@ -0,0 +1,429 @@
+import math
+import threading
+import time
+from collections import deque
+
+import serial
+
+# Legacy protocol (v1): newline-terminated ASCII at 9600 baud.
+# Framed protocol (v2): length-prefixed binary frames at 115200 baud.
+#
+# Frame layout (keep in sync with arduino1.ino / arduino2.ino):
+#   SOF(0xA5) | version | type | seq | len | payload[len] | crc16 (big-endian)
+# The CRC is CRC-16/CCITT-FALSE over version..payload.
+
+LEGACY_BAUDRATE = 9600
+FAST_BAUDRATE = 115200
+PROTOCOL_VERSION = 2
+
+FRAME_SOF = 0xA5
+FRAME_CMD = 0x01    # host -> board: command text
+FRAME_ACK = 0x02    # board -> host: command received
+FRAME_DONE = 0x03   # board -> host: command finished, payload is the reply
+FRAME_NAK = 0x04    # board -> host: frame rejected (bad CRC / too long)
+FRAME_EVENT = 0x05  # board -> host: unsolicited message (seq 0)
+
+MAX_PAYLOAD = 64
+HEADER_SIZE = 5
+CRC_SIZE = 2
+
+# Serial receive buffer of the boards (Uno and Mega). A board busy with a
+# blocking routine does not read; bytes beyond this are lost.
+BOARD_RX_BUFFER = 64
+
+# Boards drop back to the text protocol if no valid frame arrives
+# within this many seconds after switching baud rate.
+BINARY_REVERT_S = 2.0
+
+
+class ProtocolError(serial.SerialException):
+    """Raised when a board stops answering the framed protocol"""
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)"""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def encode_frame(frame_type, seq, payload=b''):
+    """Build one frame ready to be written to the serial port"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload too long ({len(payload)} > {MAX_PAYLOAD})")
+
+    body = bytes([PROTOCOL_VERSION, frame_type, seq & 0xFF, len(payload)]) + payload
+    crc = crc16(body)
+    return bytes([FRAME_SOF]) + body + bytes([crc >> 8, crc & 0xFF])
+
+
+class FrameDecoder:
+    """Incremental decoder that turns a byte stream into frames"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """Add received bytes and return a list of (type, seq, payload)"""
+        self.buffer.extend(data)
+        frames = []
+
+        while True:
+            # Drop noise until the next start-of-frame byte
+            start = self.buffer.find(FRAME_SOF)
+            if start < 0:
+                self.buffer.clear()
+                break
+            if start:
+                del self.buffer[:start]
+
+            if len(self.buffer) < HEADER_SIZE:
+                break
+
+            version, frame_type, seq, length = self.buffer[1:HEADER_SIZE]
+            if version != PROTOCOL_VERSION or length > MAX_PAYLOAD:
+                del self.buffer[0]  # Not a real frame, resync
+                continue
+
+            total = HEADER_SIZE + length + CRC_SIZE
+            if len(self.buffer) < total:
+                break
+
+            body = bytes(self.buffer[1:HEADER_SIZE + length])
+            received_crc = (self.buffer[total - 2] << 8) | self.buffer[total - 1]
+            if crc16(body) != received_crc:
+                self.crc_errors += 1
+                del self.buffer[0]
+                continue
+
+            frames.append((frame_type, seq, bytes(body[4:])))
+            del self.buffer[:total]
+
+        return frames
+
+
+class Channel:
+    """Common request bookkeeping for both protocols"""
+
+    protocol = None
+
+    def __init__(self, ser, name, on_event=None):
+        self.ser = ser
+        self.name = name
+        # Called with unsolicited messages (e.g. telemetry); returns True if handled
+        self.on_event = on_event
+        # Optional SerialStats that every request is recorded into
+        self.stats = None
+        self.lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def write(self, data):
+        self.ser.write(data)
+        self.ser.flush()
+        self.bytes_out += len(data)
+
+    def read(self, size):
+        data = self.ser.read(size)
+        self.bytes_in += len(data)
+        return data
+
+    def request(self, command, timeout=None):
+        """
+        Send a command and return its reply text.
+        Returns '' when no reply arrived within the timeout.
+        """
+        with self.lock:
+            start = time.time()
+            bytes_in, bytes_out = self.bytes_in, self.bytes_out
+            reply, retries, timed_out = None, 0, False
+            try:
+                reply, retries, timed_out = self.transact(command, timeout)
+                return reply
+            except ProtocolError:
+                retries = self.retries
+                raise
+            finally:
+                if self.stats is not None:
+                    self.stats.record(
+                        self.name, command.split(' ')[0], time.time() - start,
+                        bytes_out=self.bytes_out - bytes_out,
+                        bytes_in=self.bytes_in - bytes_in,
+                        retries=retries,
+                        timed_out=timed_out,
+                        error=reply is None)
+
+    def transact(self, command, timeout):
+        """Run one request with the lock held; returns (reply, retries, timed_out)"""
+        raise NotImplementedError
+
+    def poll(self):
+        """Handle unsolicited messages waiting on the port without blocking"""
+        if not self.lock.acquire(blocking=False):
+            return  # A request is running and will dispatch events itself
+        try:
+            waiting = self.ser.in_waiting
+            if waiting:
+                self.drain(self.read(waiting))
+        finally:
+            self.lock.release()
+
+    def drain(self, data):
+        raise NotImplementedError
+
+
+class TextChannel(Channel):
+    """Legacy newline-terminated ASCII protocol"""
+
+    protocol = "text"
+    retries = 0
+
+    def __init__(self, ser, name, on_event=None):
+        super().__init__(ser, name, on_event)
+        self.partial = b''
+
+    def describe(self):
+        return f"text protocol @ {self.ser.baudrate} baud"
+
+    def transact(self, command, timeout):
+        timeout = self.ser.timeout if timeout is None else timeout
+        self.write(f"{command}\n".encode())
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            line = self.read_line()
+            if line and not self.dispatch(line):
+                return line, 0, False
+        return '', 0, True
+
+    def read_line(self):
+        """Read one full line, keeping partial reads for the next call"""
+        if b'\n' not in self.partial:
+            # Timed out mid-line; never hand out half a reply
+            chunk = self.ser.readline()
+            self.bytes_in += len(chunk)
+            self.partial += chunk
+        return self.pop_line()
+
+    def pop_line(self):
+        line, sep, rest = self.partial.partition(b'\n')
+        if not sep:
+            return ''
+        self.partial = rest
+        return line.decode(errors='ignore').strip()
+
+    def dispatch(self, line):
+        return bool(self.on_event and self.on_event(line))
+
+    def drain(self, data):
+        self.partial += data
+        while b'\n' in self.partial:
+            line = self.pop_line()
+            if line and not self.dispatch(line):
+                print(f"{self.name}: ignoring unexpected message '{line}'")
+
+
+class FramedChannel(Channel):
+    """Framed binary protocol with sequence numbers, ACK and DONE"""
+
+    protocol = "framed"
+
+    def __init__(self, ser, name, ack_timeout=0.25, retries=3, done_retry_s=1.0,
+                 on_event=None):
+        super().__init__(ser, name, on_event)
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        # First resend of an acknowledged command whose DONE has not arrived
+        self.done_retry_s = done_retry_s
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+        self.seq = 0
+
+        # Keep the caller's timeout as the default reply wait, then use a
+        # short port timeout so reads never overshoot our own deadlines
+        self.default_timeout = ser.timeout if ser.timeout and ser.timeout > 0.01 else 1
+        self.ser.timeout = 0.01
+
+    def describe(self):
+        return f"framed protocol v{PROTOCOL_VERSION} @ {self.ser.baudrate} baud"
+
+    def next_seq(self):
+        # 0 is reserved for unsolicited EVENT frames
+        self.seq = self.seq % 255 + 1
+        return self.seq
+
+    def read_frame(self, deadline):
+        """Return the next decoded reply frame, or None once the deadline passes"""
+        while True:
+            while self.pending:
+                received = self.pending.popleft()
+                if received[0] == FRAME_EVENT:
+                    self.dispatch(received[2])
+                else:
+                    return received
+            if time.time() >= deadline:
+                return None
+            data = self.read(self.ser.in_waiting or 1)
+            if data:
+                self.pending.extend(self.decoder.feed(data))
+
+    def dispatch(self, payload):
+        message = payload.decode(errors='ignore')
+        if not (self.on_event and self.on_event(message)):
+            print(f"{self.name}: ignoring unexpected event '{message}'")
+
+    def drain(self, data):
+        self.pending.extend(self.decoder.feed(data))
+        # Replies that arrive here belong to requests that already timed out
+        self.pending = deque(f for f in self.pending if f[0] == FRAME_EVENT)
+        self.read_frame(0)
+
+    def transact(self, command, timeout):
+        """
+        Send a command and wait for its DONE reply.
+        The reply is '' if the board acknowledged the command but did not
+        finish it within the timeout.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        seq = self.next_seq()
+        frame = encode_frame(FRAME_CMD, seq, command)
+        deadline = time.time() + timeout
+        acked = False
+
+        for attempt in range(self.retries + 1):
+            self.write(frame)
+
+            ack_deadline = time.time() + self.ack_timeout
+            while not acked:
+                received = self.read_frame(ack_deadline)
+                if received is None:
+                    break
+                frame_type, frame_seq, payload = received
+                if frame_seq != seq:
+                    continue  # Stale reply to an earlier command
+                if frame_type == FRAME_ACK:
+                    acked = True
+                elif frame_type == FRAME_DONE:
+                    return payload.decode(errors='ignore'), attempt, False
+                elif frame_type == FRAME_NAK:
+                    break
+            if acked:
+                break
+
+        if not acked:
+            raise ProtocolError(
+                f"{self.name} did not acknowledge '{command}' after {self.retries + 1} attempts")
+
+        # A lost or garbled DONE is recovered by resending the same seq: the
+        # board answers a repeated seq with its cached reply instead of
+        # running the command again. A board still busy with a routine
+        # (RESTART waits for a person) buffers the resends unread, so they
+        # stop once they would overflow its receive buffer; a truncated
+        # frame there would corrupt the next command.
+        max_resends = BOARD_RX_BUFFER // len(frame)
+        resends = 0
+        resend_at = time.time() + self.done_retry_s if max_resends else math.inf
+        while True:
+            received = self.read_frame(min(deadline, resend_at))
+            if received is None:
+                if time.time() >= deadline:
+                    return '', attempt + resends, True
+                self.write(frame)
+                resends += 1
+                resend_at = time.time() + self.done_retry_s * 2 ** resends \
+                    if resends < max_resends else math.inf
+                continue
+            frame_type, frame_seq, payload = received
+            if frame_type == FRAME_DONE and frame_seq == seq:
+                return payload.decode(errors='ignore'), attempt + resends, False
+
+
+def wait_for_board(ser, name, timeout=5.0, interval=0.25):
+    """
+    Wait for a freshly opened board to come out of reset, instead of a
+    fixed sleep. Opening the port resets most Arduinos; the board is ready
+    once it prints its boot banner or answers HANDSHAKE. Returns False if
+    it stayed silent for timeout seconds.
+    """
+    old_timeout = ser.timeout
+    ser.timeout = interval
+    deadline = time.time() + timeout
+    try:
+        while time.time() < deadline:
+            # The bootloader swallows anything sent while it runs
+            ser.write(b"HANDSHAKE\n")
+            ser.flush()
+            line = ser.readline().decode(errors='ignore').strip()
+            if line == name:
+                ser.reset_input_buffer()
+                return True
+        return False
+    finally:
+        ser.timeout = old_timeout
+
+
+def negotiate(ser, name, baudrate=FAST_BAUDRATE, timeout=1.0):
+    """
+    Try to switch a freshly opened legacy link to the framed protocol.
+    Returns the confirmed FramedChannel, or None if the board only
+    understands the legacy text protocol (old firmware).
+    """
+    ser.reset_input_buffer()
+    ser.write(f"PROTO {PROTOCOL_VERSION} {baudrate}\n".encode())
+    ser.flush()
+
+    expected = f"PROTO {PROTOCOL_VERSION} OK"
+    deadline = time.time() + timeout
+    accepted = False
+    while time.time() < deadline:
+        # Old firmware ignores PROTO; skip boot banners while we wait
+        line = ser.readline().decode(errors='ignore').strip()
+        if line == expected:
+            accepted = True
+            break
+    if not accepted:
+        return None
+
+    ser.baudrate = baudrate
+    time.sleep(0.05)
+    ser.reset_input_buffer()
+
+    old_timeout = ser.timeout
+    channel = FramedChannel(ser, name)
+    for _ in range(3):
+        try:
+            if channel.request("HANDSHAKE", timeout=timeout) == name:
+                return channel
+        except ProtocolError:
+            break
+
+    # Board never confirmed; let it time out back to text mode. Boards that
+    # did see a frame switch back when they receive the next text HANDSHAKE.
+    print(f"{name}: framed protocol not confirmed, falling back to text")
+    ser.timeout = old_timeout
+    time.sleep(BINARY_REVERT_S + 0.5)
+    ser.baudrate = LEGACY_BAUDRATE
+    ser.reset_input_buffer()
+    ser.write(b"HANDSHAKE\n")
+    ser.flush()
+    ser.readline()
+    return None
+
+
+def open_channel(ser, name, protocol="auto", baudrate=FAST_BAUDRATE, on_event=None):
+    """Return the best channel the board on this port supports"""
+    if protocol != "text":
+        channel = negotiate(ser, name, baudrate)
+        if channel:
+            channel.on_event = on_event
+            return channel
+    return TextChannel(ser, name, on_event)
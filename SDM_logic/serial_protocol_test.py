@@ -0,0 +1,94 @@
+import unittest
+
+from serial_protocol import (BOARD_RX_BUFFER, FRAME_ACK, FRAME_CMD, FRAME_DONE,
+                             FrameDecoder, FramedChannel, encode_frame)
+
+
+class FakeBoard:
+    """
+    In-memory serial port answering framed commands like the firmware,
+    except that the first DONE of each command is lost or garbled, or
+    (busy) the board stays in the routine and reads nothing more.
+    """
+
+    def __init__(self, fault='drop'):
+        self.fault = fault
+        self.timeout = 1
+        self.baudrate = 115200
+        self.decoder = FrameDecoder()
+        self.incoming = bytearray()
+        self.last_seq = 0
+        self.last_reply = ''
+        self.executed = []
+        self.unread = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.incoming)
+
+    def flush(self):
+        pass
+
+    def read(self, size):
+        data = bytes(self.incoming[:size])
+        del self.incoming[:size]
+        return data
+
+    def write(self, data):
+        if self.fault == 'busy' and self.executed:
+            self.unread += len(data)  # Still running the routine, not reading
+            return
+        for frame_type, seq, payload in self.decoder.feed(data):
+            if frame_type != FRAME_CMD:
+                continue
+            if seq == self.last_seq:
+                self.incoming += encode_frame(FRAME_ACK, seq)
+                self.incoming += encode_frame(FRAME_DONE, seq, self.last_reply)
+                continue
+            command = payload.decode()
+            self.executed.append(command)
+            self.last_seq = seq
+            self.last_reply = f"DONE {command}"
+            self.incoming += encode_frame(FRAME_ACK, seq)
+            done = bytearray(encode_frame(FRAME_DONE, seq, self.last_reply))
+            if self.fault == 'garble':
+                done[-1] ^= 0xFF
+                self.incoming += done
+            elif self.fault is None:
+                self.incoming += done
+
+
+class LostDoneTest(unittest.TestCase):
+    def request(self, board):
+        channel = FramedChannel(board, "arduino2", done_retry_s=0.05)
+        return channel, channel.request("COMPRESS", timeout=2.0)
+
+    def test_dropped_done_is_replayed(self):
+        board = FakeBoard('drop')
+        channel, reply = self.request(board)
+        self.assertEqual(reply, "DONE COMPRESS")
+        self.assertEqual(board.executed, ["COMPRESS"])  # Not run a second time
+
+    def test_garbled_done_is_replayed(self):
+        board = FakeBoard('garble')
+        channel, reply = self.request(board)
+        self.assertEqual(reply, "DONE COMPRESS")
+        self.assertEqual(board.executed, ["COMPRESS"])
+        self.assertEqual(channel.decoder.crc_errors, 1)
+
+    def test_no_resend_when_done_arrives(self):
+        board = FakeBoard(None)
+        channel, reply = self.request(board)
+        self.assertEqual(reply, "DONE COMPRESS")
+        self.assertEqual(channel.bytes_out, len(encode_frame(FRAME_CMD, 1, "COMPRESS")))
+
+    def test_resends_fit_a_busy_board_buffer(self):
+        board = FakeBoard('busy')
+        channel = FramedChannel(board, "arduino2", done_retry_s=0.01)
+        self.assertEqual(channel.request("RESTART", timeout=1.0), '')
+        self.assertGreater(board.unread, 0)
+        self.assertLessEqual(board.unread, BOARD_RX_BUFFER)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500,
+                      5000, 10000, 20000, 30000)
+
+
+class CommandStats:
+    """Counters and latency histogram for one command on one board"""
+
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, latency_ms):
+        self.count += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'mean_ms': round(self.total_ms / self.count, 1) if self.count else None,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_ms, 1),
+            'histogram_ms': {
+                **{f"<={b}": n for b, n in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                f">{LATENCY_BUCKETS_MS[-1]}": self.buckets[-1],
+            },
+        }
+
+
+class SerialStats:
+    """Per-board, per-command serial statistics shared by all channels"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}  # (board, command) -> CommandStats
+        self.cache = {}     # board -> [hits, misses] for cached sensor reads
+        self.started_at = time.time()
+        self.dump_thread = None
+        self.dump_stop = threading.Event()
+
+    def record(self, board, command, latency_s, bytes_out=0, bytes_in=0,
+               retries=0, timed_out=False, error=False):
+        """Record one finished request"""
+        with self.lock:
+            stats = self.commands.get((board, command))
+            if stats is None:
+                stats = self.commands[(board, command)] = CommandStats()
+            stats.add(latency_s * 1000)
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            stats.retries += retries
+            stats.timeouts += int(timed_out)
+            stats.errors += int(error)
+
+    def record_cache(self, board, hit):
+        """Record whether a sensor read was served from the telemetry cache"""
+        with self.lock:
+            counts = self.cache.setdefault(board, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def snapshot(self):
+        """Return all statistics as a JSON-friendly dict"""
+        with self.lock:
+            boards = {}
+            for (board, command), stats in sorted(self.commands.items()):
+                boards.setdefault(board, {})[command] = stats.to_dict()
+            return {
+                'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+                'boards': boards,
+                'sensor_cache': {
+                    board: {'hits': hits, 'misses': misses}
+                    for board, (hits, misses) in self.cache.items()
+                },
+            }
+
+    def format_report(self):
+        """Human readable table of the current statistics"""
+        snap = self.snapshot()
+        lines = [f"Serial statistics since {snap['since']}"]
+        for board, commands in snap['boards'].items():
+            lines.append(f"{board}:")
+            for command, s in commands.items():
+                lines.append(
+                    f"  {command:<12} n={s['count']:<5} mean={s['mean_ms']}ms "
+                    f"p50<={s['p50_ms']}ms p95<={s['p95_ms']}ms max={s['max_ms']}ms "
+                    f"timeouts={s['timeouts']} errors={s['errors']} retries={s['retries']} "
+                    f"out={s['bytes_out']}B in={s['bytes_in']}B")
+        for board, c in snap['sensor_cache'].items():
+            lines.append(f"{board} sensor cache: {c['hits']} hits, {c['misses']} misses")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Write the current statistics to a JSON file atomically"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_periodic_dump(self, path, interval_s=60):
+        """Dump statistics to path every interval_s seconds in the background"""
+        def run():
+            while not self.dump_stop.wait(interval_s):
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    print(f"Error writing serial stats: {e}")
+
+        self.dump_thread = threading.Thread(target=run, name="serial-stats", daemon=True)
+        self.dump_thread.start()
+
+    def stop(self):
+        self.dump_stop.set()
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+from benchmark import print_report, run_benchmark
+from paths import data_path
+
+# Samples kept per run; when full every other one is dropped and the
+# sampling interval doubles, so a run of any length stays bounded
+MAX_SAMPLES = 2000
+# Allowed growth from the start to the end of the steady state
+RSS_BUDGET_MB = 25.0
+FD_BUDGET = 4
+THREAD_BUDGET = 2
+
+
+def process_resources(pid='self'):
+    """RSS (MB), open file descriptors and threads of a process, from /proc"""
+    with open(f"/proc/{pid}/status") as f:
+        status = dict(line.split(':', 1) for line in f if ':' in line)
+    return {
+        'rss_mb': round(int(status['VmRSS'].split()[0]) / 1024, 1),
+        'fds': len(os.listdir(f"/proc/{pid}/fd")),
+        'threads': int(status['Threads']),
+    }
+
+
+class ResourceMonitor:
+    """
+    Samples this process's resources every interval_s in the background,
+    until target cycles are done (not while the run is torn down).
+    """
+
+    def __init__(self, target, interval_s=5.0, max_samples=MAX_SAMPLES):
+        self.target = target
+        self.interval_s = interval_s
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.samples = []
+        self.cycles = 0
+        self.dropped = 0
+        self.started_at = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="soak-monitor", daemon=True)
+
+    def progress(self, sorted_items, dropped):
+        """benchmark.run_benchmark on_record callback"""
+        self.cycles = sorted_items
+        self.dropped = dropped
+        if sorted_items >= self.target and not self.stop_event.is_set():
+            self.sample()
+            self.stop_event.set()
+
+    def sample(self):
+        entry = dict(t=round(time.monotonic() - self.started_at, 1),
+                     cycles=self.cycles, **process_resources())
+        with self.lock:
+            self.samples.append(entry)
+            if len(self.samples) >= self.max_samples:
+                self.samples = self.samples[::2]
+                self.interval_s *= 2
+
+    def run(self):
+        while not self.stop_event.wait(self.interval_s):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def check_growth(samples, warmup_cycles, budgets, window=0.1):
+    """
+    Growth of each resource over the steady state (after warmup_cycles):
+    the median of its last `window` of samples minus that of its first.
+    Returns [(resource, start, end, growth, budget, over budget)], or
+    None if there are too few steady-state samples to tell.
+    """
+    steady = [s for s in samples if s['cycles'] >= warmup_cycles]
+    if len(steady) < 4:
+        return None
+    n = max(2, int(len(steady) * window))
+    rows = []
+    for key, budget in budgets.items():
+        start = statistics.median(s[key] for s in steady[:n])
+        end = statistics.median(s[key] for s in steady[-n:])
+        rows.append((key, start, end, round(end - start, 1), budget, end - start > budget))
+    return rows
+
+
+def rss_trend(samples, warmup_cycles):
+    """RSS slope over the steady state in MB per 1000 cycles, or None"""
+    steady = [s for s in samples if s['cycles'] >= warmup_cycles]
+    if len({s['cycles'] for s in steady}) < 2:
+        return None
+    slope, _ = statistics.linear_regression([s['cycles'] for s in steady],
+                                            [s['rss_mb'] for s in steady])
+    return round(slope * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Soak test: thousands of simulated sorting cycles, failing if "
+                    "memory, file descriptors or threads keep growing")
+    parser.add_argument('--cycles', type=int, default=2000, help="Items to sort")
+    parser.add_argument('--time-scale', type=float, default=0.01,
+                        help="Multiply the simulated hardware delays")
+    parser.add_argument('--provider', choices=['gemini', 'openai'], default='gemini')
+    parser.add_argument('--median-s', type=float, default=0.05, help="Median model latency")
+    parser.add_argument('--p95-s', type=float, default=0.2, help="95th percentile model latency")
+    parser.add_argument('--error-rate', type=float, default=0.02,
+                        help="Fraction of model requests that fail (exercises the drop path)")
+    parser.add_argument('--throughput', action='store_true', help="Use throughput mode")
+    parser.add_argument('--frames', help="Directory of captures to replay (default: images/)")
+    parser.add_argument('--arrival-gap-s', type=float, default=0.2)
+    parser.add_argument('--interval-s', type=float, default=5.0,
+                        help="Seconds between resource samples")
+    parser.add_argument('--warmup-cycles', type=int,
+                        help="Cycles before growth is measured (default: 10%% of --cycles)")
+    parser.add_argument('--rss-budget-mb', type=float, default=RSS_BUDGET_MB)
+    parser.add_argument('--fd-budget', type=int, default=FD_BUDGET)
+    parser.add_argument('--thread-budget', type=int, default=THREAD_BUDGET)
+    parser.add_argument('--output', default=data_path('soak_report.json'),
+                        help="Report with the resource samples over time")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    warmup = args.warmup_cycles if args.warmup_cycles is not None else args.cycles // 10
+    monitor = ResourceMonitor(args.cycles, args.interval_s)
+    print(f"Soak test: {args.cycles} cycles, resources sampled every {args.interval_s:g} s")
+    monitor.start()
+    try:
+        results, workdir = run_benchmark(
+            args.cycles, args.time_scale, args.provider, args.median_s, args.p95_s,
+            args.error_rate, args.throughput, args.frames, args.arrival_gap_s,
+            seed=args.seed, timeout_s=args.cycles * 30, on_record=monitor.progress)
+    finally:
+        monitor.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+    print_report(results)
+
+    budgets = {'rss_mb': args.rss_budget_mb, 'fds': args.fd_budget,
+               'threads': args.thread_budget}
+    rows = check_growth(monitor.samples, warmup, budgets)
+    trend = rss_trend(monitor.samples, warmup)
+    report = {
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'cycles': monitor.cycles,
+        'dropped': monitor.dropped,
+        'warmup_cycles': warmup,
+        'budgets': budgets,
+        'growth': [dict(zip(('resource', 'start', 'end', 'growth', 'budget', 'failed'), row))
+                   for row in rows or []],
+        'rss_mb_per_1000_cycles': trend,
+        'samples': monitor.samples,
+        'benchmark': {k: v for k, v in results.items() if k != 'log'},
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nSoak: {monitor.cycles} cycles, {len(monitor.samples)} resource samples "
+          f"(report: {args.output})")
+    if rows is None:
+        print("⚠️ Too few samples after warmup to measure growth; run more cycles")
+        sys.exit(1)
+    print(f"{'Resource':<10} {'start':>8} {'end':>8} {'growth':>8} {'budget':>8}")
+    for key, start, end, growth, budget, failed in rows:
+        print(f"{key:<10} {start:>8g} {end:>8g} {growth:>+8g} {budget:>8g}"
+              + ("  ❌ over budget" if failed else ""))
+    if trend is not None:
+        print(f"RSS trend: {trend:+.2f} MB per 1000 cycles")
+    if monitor.cycles < args.cycles:
+        print(f"❌ Only {monitor.cycles} of {args.cycles} cycles completed")
+        sys.exit(1)
+    if any(row[5] for row in rows):
+        sys.exit(1)
+    print("✅ Resource use stayed within budget")
+
+
+if __name__ == "__main__":
+    main()
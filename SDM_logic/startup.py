@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Imported first by the entry points, so close to when the process started
+IMPORTED_AT = time.monotonic()
+
+# Target time from start to accepting items; a bin rebooting after a
+# power cut should be back in service within this many seconds
+STARTUP_BUDGET_S = float(os.environ.get('SDM_STARTUP_BUDGET_S', '10'))
+
+
+class StartupReport:
+    """
+    Time-to-ready of a bin: when each startup step ran and for how long,
+    and whether the total stayed within the budget.
+    """
+
+    def __init__(self, started_at=None, budget_s=STARTUP_BUDGET_S, name=None):
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.budget_s = budget_s
+        self.name = name
+        self.steps = []  # (name, start, end) in seconds since started_at
+        self.lock = threading.Lock()
+        self.last_end = 0.0
+
+    def label(self):
+        return f"[{self.name}] " if self.name else ""
+
+    def add(self, name, start, end):
+        with self.lock:
+            self.steps.append((name, start - self.started_at, end - self.started_at))
+            self.last_end = max(self.last_end, end - self.started_at)
+
+    def mark(self, name):
+        """Record a step that began where the last one ended and ends now"""
+        self.add(name, self.started_at + self.last_end, time.monotonic())
+
+    def run(self, name, fn, *args):
+        """Run one timed step"""
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            self.add(name, start, time.monotonic())
+
+    def parallel(self, **steps):
+        """
+        Run the steps (name=callable) side by side and return their results
+        by name. Waits for all of them; then raises the first failure.
+        """
+        with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="startup") as pool:
+            futures = {name: pool.submit(self.run, name, fn) for name, fn in steps.items()}
+        for future in futures.values():
+            if future.exception() is not None:
+                raise future.exception()
+        return {name: future.result() for name, future in futures.items()}
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def report(self):
+        """Print the timings; returns the time to ready"""
+        total = self.elapsed()
+        print(f"{self.label()}Ready in {total:.1f} s (budget {self.budget_s:g} s)")
+        for name, start, end in sorted(self.steps, key=lambda step: step[1]):
+            print(f"{self.label()}  {name:<12} {start:6.2f} -> {end:6.2f} s  ({end - start:.2f} s)")
+        if total > self.budget_s:
+            slowest = max(self.steps, key=lambda step: step[2] - step[1], default=None)
+            print(f"{self.label()}⚠️ Startup over budget by {total - self.budget_s:.1f} s"
+                  + (f"; slowest step: {slowest[0]}" if slowest else ""))
+        return total
@@ -0,0 +1,371 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from capture_archive import CaptureArchive, default_archive
+from event_store import BINS, EventStore, default_store
+from metrics import CONTENT_TYPE, RESPONSE_CACHE, default_registry
+
+# Local only: the API has no authentication. The dashboard serves capture
+# images itself unless SDM_STATUS_HOST binds a wider interface (which also
+# exposes /events, /metrics and the bin histories to that network) or
+# SDM_MEDIA_URL points browsers at a proxy for it.
+STATUS_HOST = os.environ.get('SDM_STATUS_HOST', '127.0.0.1')
+STATUS_PORT = int(os.environ.get('SDM_STATUS_PORT', '8600'))
+
+MAX_HISTORY = 1000
+
+HASH_RE = re.compile(r'[0-9a-f]{64}')
+IMAGE_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+               '.webp': 'image/webp'}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class BadRequest(ValueError):
+    """Invalid query parameters; answered with 400"""
+
+
+def parse_time(value):
+    """Unix seconds or an ISO 8601 date/time (local time unless it has an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise BadRequest(f"Invalid time {value!r}")
+
+
+def event_json(event):
+    """Public JSON form of a stored event"""
+    return {
+        'id': event['id'],
+        'code': event['bin_code'],
+        'location': event['location'],
+        'levels': {b: event[b.lower()] for b in BINS},
+        'last_used': datetime.fromtimestamp(event['ts']).isoformat(timespec='seconds'),
+        'ts': event['ts'],
+        'item': event['item'],
+        'category': event['category'],
+        'capture': event['capture_hash'],
+    }
+
+
+@functools.lru_cache(maxsize=64)
+def read_image(path):
+    """Bytes of an archived image; paths are content hashes, so safe to cache"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def capture_url(base_url, digest, thumb=False):
+    """URL of an archived capture on the status API"""
+    return f"{base_url.rstrip('/')}/captures/{digest}{'/thumb' if thumb else ''}"
+
+
+class EventBroadcaster:
+    """
+    Tails the event store for new events and hands them to the SSE
+    streams. One thread polls the store version, so the number of open
+    streams does not add load on the store.
+    """
+
+    def __init__(self, store, poll_interval=0.5, backlog=256):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.backlog = backlog
+        self.condition = threading.Condition()
+        self.recent = []   # Newest events, oldest first, at most backlog
+        self.last_id = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.last_id = self.store.last_id()
+        self.thread = threading.Thread(target=self.run, name="status-events", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def run(self):
+        version = None
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                current = self.store.version()
+                if current == version:
+                    continue
+                version = current
+                while events := self.store.events_after(self.last_id):
+                    with self.condition:
+                        self.recent = (self.recent + events)[-self.backlog:]
+                        self.last_id = events[-1]['id']
+                        self.condition.notify_all()
+            except Exception as e:
+                print(f"Error reading new events: {e}")
+
+    def wait_after(self, event_id, timeout, bin_code=None):
+        """
+        Events newer than event_id, waiting up to timeout for some. A
+        stream that fell behind the backlog (a burst, e.g. a legacy import)
+        gets the events it missed from the store, a page at a time.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.last_id > event_id or self.stop_event.is_set(), timeout)
+            recent = self.recent
+        if recent and event_id < recent[0]['id'] - 1:
+            page = self.store.events_after(event_id, bin_code, MAX_HISTORY)
+            missed = [e for e in page if e['id'] < recent[0]['id']]
+            if len(missed) == MAX_HISTORY:
+                return missed  # More of the gap on the next call
+            return missed + recent
+        return [e for e in recent if e['id'] > event_id]
+
+
+class ResponseCache:
+    """JSON bodies and ETags by request, valid until the store changes"""
+
+    def __init__(self, store, max_entries=1024):
+        self.store = store
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = {}
+
+    def get(self, key, build):
+        """(status, body, etag) for key, calling build() on a miss"""
+        version = self.store.version()
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            entry = self.entries.get(key)
+        RESPONSE_CACHE.labels('miss' if entry is None else 'hit').inc()
+        if entry is None:
+            status, payload = build()
+            body = json.dumps(payload, separators=(',', ':')).encode()
+            entry = (status, body, f'"{hashlib.sha1(body).hexdigest()}"')
+            with self.lock:
+                if self.version == version and len(self.entries) < self.max_entries:
+                    self.entries[key] = entry
+        return entry
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """
+    GET /bins                              every bin with its latest status
+    GET /bins/{code}/status                latest record of one bin
+    GET /bins/{code}/history?from=&to=&limit=
+    GET /events[?bin=code]                 Server-Sent Events, new records only
+    GET /captures/{hash}[/thumb]           archived capture or its thumbnail
+    GET /health                            liveness check for the supervisor
+    GET /metrics                           Prometheus metrics of this process
+    """
+
+    server_version = "SDMStatus/1.0"
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without this keep-alive
+    # clients wait ~40 ms for the delayed ACK on every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # Polled many times a second; errors are still printed
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/')]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if parts == ['health']:
+                self.send_json(200, {'ok': True})
+            elif parts == ['metrics']:
+                self.send_body(200, default_registry.render().encode(), content_type=CONTENT_TYPE)
+            elif parts == ['events']:
+                self.stream_events(query.get('bin'))
+            elif parts == ['bins']:
+                self.send_cached(self.path, self.bins)
+            elif len(parts) == 3 and parts[0] == 'bins' and parts[2] == 'status':
+                self.send_cached(self.path, lambda: self.status(parts[1]))
+            elif len(parts) == 3 and parts[0] == 'bins' and parts[2] == 'history':
+                self.send_cached(self.path, lambda: self.history(parts[1], query))
+            elif len(parts) == 2 and parts[0] == 'captures':
+                self.send_capture(parts[1], thumb=False)
+            elif len(parts) == 3 and parts[0] == 'captures' and parts[2] == 'thumb':
+                self.send_capture(parts[1], thumb=True)
+            else:
+                self.send_json(404, {'error': 'Not found'})
+        except BadRequest as e:
+            self.send_json(400, {'error': str(e)})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            print(f"Status API error on {self.path}: {e}")
+            self.send_json(500, {'error': 'Internal error'})
+
+    # Endpoints
+    def bins(self):
+        return 200, [event_json(event) for event in self.server.store.latest_all()]
+
+    def status(self, code):
+        latest = self.server.store.latest(code)
+        if latest is None:
+            return 404, {'error': f"Unknown bin {code}"}
+        return 200, event_json(latest)
+
+    def history(self, code, query):
+        since = parse_time(query['from']) if 'from' in query else None
+        until = parse_time(query['to']) if 'to' in query else None
+        try:
+            limit = min(int(query.get('limit', 100)), MAX_HISTORY)
+        except ValueError:
+            raise BadRequest(f"Invalid limit {query['limit']!r}")
+        events = self.server.store.history(code, since, until, limit)
+        return 200, {'code': code, 'events': [event_json(e) for e in events]}
+
+    def stream_events(self, bin_code):
+        broadcaster = self.server.broadcaster
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        # A reconnecting client first gets everything it missed
+        try:
+            last_id = int(self.headers.get('Last-Event-ID'))
+        except (TypeError, ValueError):
+            last_id = None
+        if last_id is None:
+            last_id = broadcaster.last_id
+        else:
+            while missed := self.server.store.events_after(last_id, bin_code, MAX_HISTORY):
+                for event in missed:
+                    self.send_event(event)
+                    last_id = event['id']
+                if len(missed) < MAX_HISTORY:
+                    break
+
+        last_write = time.monotonic()
+        while not broadcaster.stop_event.is_set():
+            for event in broadcaster.wait_after(
+                    last_id, self.server.heartbeat_s, bin_code):
+                last_id = event['id']
+                if bin_code is None or event['bin_code'] == bin_code:
+                    self.send_event(event)
+                    last_write = time.monotonic()
+            if time.monotonic() - last_write >= self.server.heartbeat_s:
+                self.wfile.write(b": keep-alive\n\n")  # Also notices closed clients
+                last_write = time.monotonic()
+            self.wfile.flush()
+
+    def send_capture(self, digest, thumb):
+        """
+        Archived images never change (the URL is their content hash), so
+        browsers may keep them for good and never ask again.
+        """
+        capture = self.server.archive.lookup(digest) if HASH_RE.fullmatch(digest) else None
+        path = capture and (capture['thumb'] if thumb else capture['path'])
+        if not path or not os.path.exists(path):
+            self.send_json(404, {'error': 'Unknown capture'})
+            return
+        etag = f'"{digest}{"-thumb" if thumb else ""}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', IMMUTABLE)
+            self.end_headers()
+            return
+        body = read_image(path)
+        self.send_response(200)
+        self.send_header('Content-Type', IMAGE_TYPES.get(os.path.splitext(path)[1], 'image/jpeg'))
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', IMMUTABLE)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Responses
+    def send_event(self, event):
+        data = json.dumps(event_json(event), separators=(',', ':'))
+        self.wfile.write(f"id: {event['id']}\nevent: item\ndata: {data}\n\n".encode())
+
+    def send_cached(self, key, build):
+        status, body, etag = self.server.cache.get(key, build)
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_body(status, body, etag)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload).encode())
+
+    def send_body(self, status, body, etag=None, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        # Clients may keep the body but must check it is still current
+        self.send_header('Cache-Control', 'no-cache')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StatusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store=default_store, archive=default_archive,
+                 heartbeat_s=15.0):
+        super().__init__(address, StatusHandler)
+        self.store = store
+        self.archive = archive
+        self.heartbeat_s = heartbeat_s
+        self.cache = ResponseCache(store)
+        self.broadcaster = EventBroadcaster(store)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.broadcaster.start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self.broadcaster.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local JSON/SSE status API for bins")
+    parser.add_argument('--host', default=STATUS_HOST,
+                        help="Address to bind (default: SDM_STATUS_HOST or 127.0.0.1); "
+                             "other hosts can only reach the API if this is not loopback")
+    parser.add_argument('--port', type=int, default=STATUS_PORT)
+    parser.add_argument('--db', help="Event store database")
+    args = parser.parse_args()
+
+    store = EventStore(args.db) if args.db else default_store
+    archive = CaptureArchive(db_path=args.db) if args.db else default_archive
+    server = StatusServer((args.host, args.port), store, archive)
+    print(f"Status API on http://{args.host}:{args.port}/bins")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStatus API stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import http.client
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from capture_archive import CaptureArchive
+from event_store import EventStore, make_event
+from status_api import MAX_HISTORY, StatusServer
+
+
+class EventStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        db_path = os.path.join(self.workdir, 'events.db')
+        self.store = EventStore(db_path, flush_interval=0.05)
+        self.store.last_id()  # Create the schema before the server reads it
+        archive = CaptureArchive(os.path.join(self.workdir, 'archive'), db_path)
+        self.server = StatusServer(('127.0.0.1', 0), self.store, archive, heartbeat_s=0.2)
+        self.server.broadcaster.poll_interval = 0.02
+        self.server.broadcaster.backlog = 16
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.store.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def record(self, count):
+        for i in range(count):
+            self.store.record(make_event('BIN001', 'Test site', [i % 100] * 4,
+                                         {'Category': 'Bio Degradable and Recyclable',
+                                          'Item': f"item {i}"}))
+        self.store.flush()
+
+    def open_stream(self, last_event_id=None):
+        conn = http.client.HTTPConnection(*self.server.server_address[:2], timeout=10)
+        headers = {'Last-Event-ID': str(last_event_id)} if last_event_id is not None else {}
+        conn.request('GET', '/events', headers=headers)
+        response = conn.getresponse()
+        self.addCleanup(conn.close)
+        return response
+
+    def read_ids(self, response, count):
+        """Event ids from the stream until count arrived, for at most 10 s"""
+        ids = []
+        deadline = time.monotonic() + 10
+        while len(ids) < count and time.monotonic() < deadline:
+            line = response.fp.readline().decode().strip()
+            if line.startswith('id: '):
+                ids.append(int(line[4:]))
+        return ids
+
+    def test_burst_larger_than_backlog(self):
+        response = self.open_stream()
+        response.fp.readline()  # First keep-alive: the stream is live
+        self.record(600)
+        ids = self.read_ids(response, 600)
+        self.assertEqual(ids, list(range(1, 601)))
+
+    def test_reconnect_catches_up_past_one_page(self):
+        count = MAX_HISTORY + 200
+        self.record(count)
+        ids = self.read_ids(self.open_stream(last_event_id=0), count)
+        self.assertEqual(ids, list(range(1, count + 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
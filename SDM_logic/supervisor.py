@@ -0,0 +1,241 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from component_supervisor import Backoff
+from live_channel import LiveChannel, channel_name
+from status_api import STATUS_PORT
+from unit_registry import DEFAULT_BIN_CODE, load_units
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD_PORT = int(os.environ.get('SDM_DASHBOARD_PORT', '8501'))
+
+# A ready worker that has not published its status for this long is hung
+WORKER_LIVENESS_S = 60.0
+
+
+def http_ok(url, timeout=2.0):
+    """True if url answers 200"""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+class Service:
+    """
+    One supervised process.
+
+    ready(service): True once the process is up and serving; startup of
+                    the next service waits for it (up to ready_timeout).
+    alive(service): liveness of a ready process; max_missed failed checks
+                    in a row restart it. None: running is enough.
+    """
+
+    def __init__(self, name, command, ready=None, alive=None, ready_timeout=60.0,
+                 stop_timeout=15.0, max_missed=3):
+        self.name = name
+        self.command = command
+        self.ready = ready
+        self.alive = alive
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.max_missed = max_missed
+        self.process = None
+        self.started_at = None       # time.time(), comparable with heartbeats
+        self.is_ready = False
+        self.missed = 0
+        self.backoff = Backoff(1.0, 60.0)
+        self.restart_at = None       # Monotonic time of a scheduled restart
+        self.restarts = 0
+
+    def start(self):
+        # Own session: Ctrl+C reaches only the supervisor, which stops
+        # the services in order
+        self.process = subprocess.Popen(self.command, cwd=HERE, start_new_session=True)
+        self.started_at = time.time()
+        self.is_ready = False
+        self.missed = 0
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def uptime(self):
+        return time.time() - self.started_at if self.running() else 0.0
+
+    def check_ready(self):
+        if not self.is_ready and self.running() and (self.ready is None or self.ready(self)):
+            self.is_ready = True
+        return self.is_ready
+
+    def check_alive(self):
+        """False once a ready process has missed max_missed liveness checks"""
+        if not self.is_ready or self.alive is None:
+            return True
+        self.missed = 0 if self.alive(self) else self.missed + 1
+        return self.missed < self.max_missed
+
+    def stop(self):
+        if not self.running():
+            return
+        # All services shut down cleanly on KeyboardInterrupt
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            print(f"[supervisor] {self.name} did not stop in {self.stop_timeout:.0f} s, killing it")
+            self.process.kill()
+            self.process.wait()
+
+
+class ProcessSupervisor:
+    """
+    Starts services in order, each once the one before it is ready,
+    restarts any that exit or stop responding (with exponential backoff,
+    reset after stable_s of running), and stops them in reverse order.
+    """
+
+    def __init__(self, services, check_interval=2.0, stable_s=60.0):
+        self.services = list(services)
+        self.check_interval = check_interval
+        self.stable_s = stable_s
+        self.stop_event = threading.Event()
+
+    def start(self):
+        for service in self.services:
+            if self.stop_event.is_set():
+                return
+            print(f"[supervisor] Starting {service.name}")
+            service.start()
+            deadline = time.monotonic() + service.ready_timeout
+            while not service.check_ready():
+                if not service.running():
+                    print(f"[supervisor] {service.name} exited during startup")
+                    break  # Restarted by the checks in run()
+                if time.monotonic() > deadline:
+                    print(f"[supervisor] {service.name} not ready after "
+                          f"{service.ready_timeout:.0f} s, starting the rest anyway")
+                    break
+                if self.stop_event.wait(0.2):
+                    return
+            else:
+                print(f"[supervisor] {service.name} ready in {service.uptime():.1f} s")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        """Start the services and keep them running until stop()"""
+        try:
+            self.start()
+            while not self.stop_event.wait(self.check_interval):
+                for service in self.services:
+                    self.check(service)
+        finally:
+            for service in reversed(self.services):
+                print(f"[supervisor] Stopping {service.name}")
+                try:
+                    service.stop()
+                except Exception as e:
+                    print(f"[supervisor] Error stopping {service.name}: {e}")
+
+    def check(self, service):
+        now = time.monotonic()
+        if service.restart_at is None:
+            if service.running():
+                was_ready = service.is_ready
+                if service.check_ready() and not was_ready:
+                    print(f"[supervisor] {service.name} ready")
+                if service.check_alive():
+                    if service.uptime() > self.stable_s:
+                        service.backoff.reset()
+                    return
+                print(f"[supervisor] {service.name} is not responding, stopping it")
+                service.stop()
+            else:
+                print(f"[supervisor] {service.name} exited with code "
+                      f"{service.process.returncode}")
+            delay = service.backoff.next_delay()
+            service.restart_at = now + delay
+            print(f"[supervisor] Restarting {service.name} in {delay:.1f} s")
+        if now >= service.restart_at:
+            service.restart_at = None
+            service.restarts += 1
+            service.start()
+
+    def status(self):
+        return {
+            s.name: {'running': s.running(), 'ready': s.is_ready, 'restarts': s.restarts}
+            for s in self.services
+        }
+
+
+def build_services(worker_command, channels, dashboard=True):
+    """Worker first (it owns the serial links and cameras), then the status API and dashboard"""
+
+    def worker_ready(service):
+        return any(c.updated_at() >= service.started_at for c in channels)
+
+    def worker_alive(service):
+        # Units share one event loop: any heartbeat means it is not hung
+        return any(time.time() - c.updated_at() < WORKER_LIVENESS_S for c in channels)
+
+    status_url = f"http://127.0.0.1:{STATUS_PORT}/health"
+    dashboard_url = f"http://127.0.0.1:{DASHBOARD_PORT}/_stcore/health"
+    services = [
+        # Liveness comes from the heartbeat itself, so one miss is enough
+        Service("worker", worker_command, worker_ready, worker_alive, max_missed=1),
+        Service("status-api", [sys.executable, 'status_api.py'],
+                lambda s: http_ok(status_url), lambda s: http_ok(status_url),
+                ready_timeout=20.0),
+    ]
+    if dashboard:
+        services.append(Service(
+            "dashboard",
+            [sys.executable, '-m', 'streamlit', 'run', 'dashboard.py',
+             '--server.headless', 'true', '--server.port', str(DASHBOARD_PORT)],
+            lambda s: http_ok(dashboard_url), lambda s: http_ok(dashboard_url),
+            ready_timeout=60.0))
+    return services
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run and supervise the sorting worker, status API and dashboard")
+    parser.add_argument('--units', help="Unit registry (JSON): run multi_unit.py "
+                                        "for several bins instead of app.py")
+    parser.add_argument('--no-dashboard', action='store_true',
+                        help="Do not start the Streamlit dashboard")
+    args = parser.parse_args()
+
+    if args.units:
+        units_file = os.path.abspath(args.units)
+        units, _ = load_units(units_file)
+        codes = [unit['code'] for unit in units]
+        worker_command = [sys.executable, 'multi_unit.py', '--units', units_file]
+    else:
+        codes = [DEFAULT_BIN_CODE]
+        worker_command = [sys.executable, 'app.py']
+
+    # Live frame and status per bin, handed from the worker to the dashboard
+    channels = [LiveChannel.create(channel_name(code)) for code in codes]
+    supervisor = ProcessSupervisor(build_services(worker_command, channels,
+                                                  dashboard=not args.no_dashboard))
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: supervisor.stop())
+    try:
+        supervisor.run()
+    finally:
+        for channel in channels:
+            channel.close()
+        print("[supervisor] All services stopped")
+
+
+if __name__ == "__main__":
+    main()
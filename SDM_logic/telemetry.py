@@ -0,0 +1,58 @@
+import threading
+import time
+
+# Prefix of the bin level messages pushed by arduino2 in telemetry mode
+LEVELS_PREFIX = "LEVELS "
+
+
+def parse_levels(text):
+    """Parse 'a,b,c,d' (optionally prefixed with LEVELS) into four ints"""
+    if text.startswith(LEVELS_PREFIX):
+        text = text[len(LEVELS_PREFIX):]
+    try:
+        values = [int(x) for x in text.split(',')]
+    except ValueError:
+        return None
+    return values if len(values) == 4 else None
+
+
+class TelemetryCache:
+    """Latest bin levels pushed by the mechanism Arduino, with a timestamp"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = None
+        self.updated_at = None
+        self.updates = 0
+
+    def update(self, values, timestamp=None):
+        """Store a new reading"""
+        with self.lock:
+            self.values = list(values)
+            self.updated_at = timestamp if timestamp is not None else time.time()
+            self.updates += 1
+
+    def handle_message(self, message):
+        """Channel event callback; returns True if the message was telemetry"""
+        if not message.startswith(LEVELS_PREFIX):
+            return False
+        values = parse_levels(message)
+        if values is not None:
+            self.update(values)
+        return True
+
+    def age(self):
+        """Seconds since the last reading, or None if nothing was received"""
+        with self.lock:
+            if self.updated_at is None:
+                return None
+            return time.time() - self.updated_at
+
+    def get(self, max_age=None):
+        """Return the latest reading, or None if missing or older than max_age"""
+        with self.lock:
+            if self.values is None:
+                return None
+            if max_age is not None and time.time() - self.updated_at > max_age:
+                return None
+            return list(self.values)
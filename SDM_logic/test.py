@@ -14,7 +14,7 @@ def send_command(command):
         response = ser.readline().decode('utf-8').strip()  # Read Arduino response
         if response:
             print("Arduino:", response)
-        if "completed" in response or "opened" in response or "updated" in response or "emptied" in response:  # Exit on expected response
+        if "completed" in response or "opened" in response or "updated" in response or "emptied" in response or response.startswith("DONE"):  # Exit on expected response
             break
 
 
@@ -0,0 +1,59 @@
+import json
+import os
+
+from paths import data_path
+
+# Per-unit tuning profiles written by calibrate.py, one JSON file per bin code
+TUNING_DIR = os.environ.get('SDM_TUNING_DIR', data_path('tuning'))
+
+
+def profile_path(bin_code):
+    return os.path.join(TUNING_DIR, f"{bin_code}.json")
+
+
+def load_profile(bin_code):
+    """
+    Tuning profile of a unit, or {} if it was never calibrated:
+    {
+        "detection": {"pixel_threshold": 25, "min_area": 500,
+                      "change_threshold": 0.01, ...},
+        "completion_timeouts": {"COMPRESS": 17.4, "BR": 12.1, ...},
+        ...
+    }
+    """
+    path = profile_path(bin_code)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring tuning profile {path}: {e}")
+        return {}
+
+
+def save_profile(bin_code, profile):
+    """Write a unit's profile (atomically, a half-written file is never loaded)"""
+    path = profile_path(bin_code)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=4)
+    os.replace(tmp_path, path)
+    return path
+
+
+def apply_detection(detector, profile, change_threshold=0.01):
+    """
+    Use a profile's calibrated thresholds on a ChangeDetector. Returns the
+    change threshold to detect with: the calibrated one, else change_threshold.
+    """
+    detection = profile.get('detection', {})
+    detector.pixel_threshold = detection.get('pixel_threshold', detector.pixel_threshold)
+    detector.min_area = detection.get('min_area', detector.min_area)
+    return detection.get('change_threshold', change_threshold)
+
+
+def apply_mechanism(cmd, profile):
+    """Use a profile's measured completion timeouts on a CommandManager"""
+    cmd.completion_timeouts.update(profile.get('completion_timeouts', {}))
@@ -0,0 +1,102 @@
+import json
+import os
+
+# Identity of the bin when the host drives a single unit
+DEFAULT_BIN_CODE = "BIN001"
+DEFAULT_LOCATION = "New Student Activity Center (New SAC)"
+
+UNITS_FILE = os.environ.get('SDM_UNITS_FILE', 'units.json')
+
+# Shared classifier settings used when units.json does not override them
+DEFAULT_CLASSIFIER = {
+    'workers': 2,            # Classification calls running at the same time
+    'rate_per_minute': 30,   # API quota shared by all units
+}
+
+
+def load_units(path=UNITS_FILE):
+    """
+    Load the unit registry.
+
+    units.json looks like:
+    {
+        "classifier": {"workers": 2, "rate_per_minute": 30},
+        "units": [
+            {"code": "BIN001", "location": "...", "camera": 0,
+             "ports": {"stepper_port": "/dev/ttyACM0", "mechanism_port": "/dev/ttyACM1"},
+             "coordinates": [26.1878, 91.6916]},
+            ...
+        ]
+    }
+
+    coordinates ([latitude, longitude]) are optional and place the unit
+    on the fleet map.
+
+    Without a units.json the host runs a single unit the way app.py does:
+    default bin code, first working camera and the port finder.
+
+    Returns (units, classifier_settings).
+    """
+    if not os.path.exists(path):
+        return [{
+            'code': DEFAULT_BIN_CODE,
+            'location': DEFAULT_LOCATION,
+            'camera': None,
+            'ports': None,
+            'change_threshold': 0.01,
+            'coordinates': None,
+        }], dict(DEFAULT_CLASSIFIER)
+
+    with open(path, 'r') as f:
+        config = json.load(f)
+
+    units = [normalize_unit(unit) for unit in config.get('units', [])]
+    validate_units(units)
+    classifier = dict(DEFAULT_CLASSIFIER, **config.get('classifier', {}))
+    return units, classifier
+
+
+def normalize_unit(unit):
+    """Fill in optional fields of one registry entry"""
+    if 'code' not in unit:
+        raise ValueError(f"Unit without a code in registry: {unit}")
+    coordinates = unit.get('coordinates')
+    if coordinates is not None:
+        if len(coordinates) != 2 or not (-90 <= coordinates[0] <= 90) \
+                or not (-180 <= coordinates[1] <= 180):
+            raise ValueError(f"{unit['code']}: coordinates must be [latitude, longitude]")
+        coordinates = [float(c) for c in coordinates]
+    return {
+        'code': unit['code'],
+        'location': unit.get('location', 'Unknown'),
+        'camera': unit.get('camera'),
+        'ports': unit.get('ports'),
+        'change_threshold': unit.get('change_threshold', 0.01),
+        'coordinates': coordinates,
+    }
+
+
+def validate_units(units):
+    """Reject registries where two units would fight over the same hardware"""
+    if not units:
+        raise ValueError("Unit registry is empty")
+
+    seen = {}
+    for unit in units:
+        keys = [('code', unit['code'])]
+        if len(units) > 1:
+            if unit['camera'] is None:
+                raise ValueError(f"{unit['code']}: camera must be set when running several units")
+            if not unit['ports']:
+                raise ValueError(f"{unit['code']}: ports must be set when running several units")
+        if unit['camera'] is not None:
+            keys.append(('camera', unit['camera']))
+        if unit['ports']:
+            keys.append(('port', unit['ports']['stepper_port']))
+            keys.append(('port', unit['ports']['mechanism_port']))
+
+        for key in keys:
+            if key in seen:
+                raise ValueError(
+                    f"{unit['code']} and {seen[key]} share {key[0]} {key[1]}")
+            seen[key] = unit['code']
@@ -1,14 +1,67 @@
 import time
 from datetime import datetime
 import cv2
-import google.generativeai as genai
 import os
+import queue
+import threading
+
+from metrics import classifier_request
 
 # Replace with your key
 os.environ['GOOGLE_API_KEY'] = 'Your API key here'
 
-# Configure Google API
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+# google.generativeai takes seconds to import on a Pi, so it is imported
+# and configured on first use (or by warm_up() while the bin starts)
+genai = None
+
+# Gemini model, created on first use and dropped by reset_client()
+gemini_model = None
+
+# Uploaded captures waiting to be deleted from Gemini's file storage
+uploads_to_delete = queue.Queue(maxsize=64)
+upload_cleaner = None
+upload_cleaner_lock = threading.Lock()
+
+# Prompt for waste classification with strict JSON format
+CLASSIFY_PROMPT = """Analyze the image and return ONLY a JSON response in the following format:
+        {
+            "Category": "one of: ['Bio Degradable and Recyclable', 'Bio Degradable and Non Recyclable', 'Non Bio Degradable and Recyclable', 'Non Bio Degradable and Non Recyclable']",
+            "Item": "name of the object",
+            "Recyclable tips": "how it can be recycled (if recyclable, else null)",
+            "Bio degradable facts": "how it is biodegradable (if biodegradable, else explain how harmful it is for environment)"
+        }
+        
+        Do not include any other text, only the JSON object."""
+
+
+def get_genai():
+    """The configured google.generativeai module"""
+    global genai
+    if genai is None:
+        import google.generativeai
+        google.generativeai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+        genai = google.generativeai
+    return genai
+
+
+def get_model():
+    """Return the shared Gemini model client"""
+    global gemini_model
+    if gemini_model is None:
+        gemini_model = get_genai().GenerativeModel(model_name="gemini-1.5-pro-latest")
+    return gemini_model
+
+
+def warm_up():
+    """Import and configure the client ahead of the first item"""
+    get_model()
+
+
+def reset_client():
+    """Configure the Gemini client again, e.g. after repeated API errors"""
+    global gemini_model
+    get_genai().configure(api_key=os.getenv('GOOGLE_API_KEY'))
+    gemini_model = None
 
 
 def find_camera():
@@ -34,25 +87,43 @@ def find_camera():
     raise RuntimeError("No working camera found!")
 
 
-def capture_image():
-    """Capture image from USB camera and downscale to 720p"""
+def capture_image(camera_port=None, detector=None):
+    """
+    Capture image from USB camera and downscale to 720p.
+    With a detector (change_detection.ChangeDetector) the frame comes from
+    its already open camera as soon as the picture has settled; otherwise
+    the camera is opened for this one capture.
+    The image is written to images/ for analysis; the pipeline's record
+    stage moves the captures it keeps into the capture archive.
+    """
+    if detector is not None:
+        camera_port = detector.camera_port
+    # Several units may capture within the same second
+    suffix = f"_cam{camera_port}" if camera_port is not None else ""
+
     try:
-        # Find camera port
-        camera_port = find_camera()
+        if detector is not None:
+            frame = detector.capture_still()
+            if frame is None:
+                raise RuntimeError("Could not capture frame")
+        else:
+            # Find camera port unless the caller knows which camera to use
+            if camera_port is None:
+                camera_port = find_camera()
 
-        # Initialize camera with found port
-        cap = cv2.VideoCapture(camera_port)
+            # Initialize camera with found port
+            cap = cv2.VideoCapture(camera_port)
 
-        if not cap.isOpened():
-            raise RuntimeError("Could not open camera")
+            if not cap.isOpened():
+                raise RuntimeError("Could not open camera")
 
-        # Wait for camera to initialize
-        time.sleep(2)
+            # Wait for camera to initialize
+            time.sleep(2)
 
-        # Capture frame
-        ret, frame = cap.read()
-        if not ret:
-            raise RuntimeError("Could not capture frame")
+            # Capture frame
+            ret, frame = cap.read()
+            if not ret:
+                raise RuntimeError("Could not capture frame")
 
         # Downscale image to 1280x720 (720p)
         frame_resized = cv2.resize(frame, (640, 360))
@@ -61,16 +132,11 @@ def capture_image():
         if not os.path.exists('images'):
             os.makedirs('images')
 
-        # Save two copies of the image
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         analysis_filename = os.path.join(
-            "images", f"capture_{timestamp}.jpg")  # For analysis
+            "images", f"capture_{timestamp}{suffix}.jpg")  # For analysis
         cv2.imwrite(analysis_filename, frame_resized)
 
-        base_folder_file = os.path.join(
-            os.getcwd(), 'last_item.png')  # Saves in the base folder
-        cv2.imwrite(base_folder_file, frame_resized)
-
         return analysis_filename
 
     except Exception as e:
@@ -83,46 +149,65 @@ def capture_image():
             cap.release()
 
 
-def analyze_waste(image_path):
+def analyze_waste(image_path, remove_image=True):
     """Analyze waste image using Gemini Vision API"""
     try:
-        # Upload image to Gemini
-        image_file = genai.upload_file(path=image_path)
-
-        # Initialize Gemini model
-        model = genai.GenerativeModel(model_name="gemini-1.5-pro-latest")
-
-        # Prepare prompt for waste classification with strict JSON format
-        prompt = """Analyze the image and return ONLY a JSON response in the following format:
-        {
-            "Category": "one of: ['Bio Degradable and Recyclable', 'Bio Degradable and Non Recyclable', 'Non Bio Degradable and Recyclable', 'Non Bio Degradable and Non Recyclable']",
-            "Item": "name of the object",
-            "Recyclable tips": "how it can be recycled (if recyclable, else null)",
-            "Bio degradable facts": "how it is biodegradable (if biodegradable, else explain how harmful it is for environment)"
-        }
-        
-        Do not include any other text, only the JSON object."""
-
-        # Generate response
-        response = model.generate_content([image_file, prompt])
+        with classifier_request('gemini'):
+            # Upload image to Gemini
+            image_file = get_genai().upload_file(path=image_path)
+            try:
+                # Shared Gemini model
+                model = get_model()
+
+                # Generate response
+                response = model.generate_content([image_file, CLASSIFY_PROMPT])
+            finally:
+                delete_upload(image_file)
 
         # Clean up captured image
-        os.remove(image_path)
+        if remove_image:
+            os.remove(image_path)
 
         return response.text
 
     except Exception as e:
         print(f"Error analyzing image: {e}")
-        if os.path.exists(image_path):
+        if remove_image and os.path.exists(image_path):
             os.remove(image_path)
         return None
 
 
-def get_trash_classification():
+def delete_uploads():
+    while True:
+        name = uploads_to_delete.get()
+        try:
+            get_genai().delete_file(name)
+        except Exception as e:
+            print(f"Could not delete uploaded image {name}: {e}")
+
+
+def delete_upload(image_file):
+    """
+    Delete an uploaded capture from Gemini's file storage in the
+    background; otherwise every item leaves one there until it expires.
+    """
+    global upload_cleaner
+    with upload_cleaner_lock:
+        if upload_cleaner is None:
+            upload_cleaner = threading.Thread(
+                target=delete_uploads, name="gemini-cleanup", daemon=True)
+            upload_cleaner.start()
+    try:
+        uploads_to_delete.put_nowait(image_file.name)
+    except queue.Full:
+        pass  # Expires on its own after 48 hours
+
+
+def get_trash_classification(camera_port=None):
     """Main function to capture and analyze waste"""
     try:
         # Capture image from camera
-        image_path = capture_image()
+        image_path = capture_image(camera_port)
 
         # Analyze the captured image
         result = analyze_waste(image_path)
@@ -136,6 +221,23 @@ def get_trash_classification():
         return f"Error: {str(e)}"
 
 
+def capture_and_classify(camera_port=None, detector=None):
+    """
+    Capture (see capture_image) and analyze waste, keeping the captured image.
+    Returns (result, image_path); image_path is None if the capture failed.
+    """
+    try:
+        image_path = capture_image(camera_port, detector)
+        if image_path is None:
+            return "Error: Could not capture image", None
+
+        result = analyze_waste(image_path, remove_image=False)
+        return result or "Error: Could not analyze waste", image_path
+
+    except Exception as e:
+        return f"Error: {str(e)}", None
+
+
 if __name__ == "__main__":
     # Test the system
     result = get_trash_classification()
@@ -2,14 +2,24 @@ import time
 from datetime import datetime
 import cv2
 import os
-from openai import OpenAI
 import base64
 
+from metrics import classifier_request
+
 # Replace with your OpenAI API key
 os.environ['OPENAI_API_KEY'] = 'your-openai-api-key'
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# OpenAI client, imported and created on first use (the SDK is slow to import)
+client = None
+
+
+def get_client():
+    """Return the shared OpenAI client"""
+    global client
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return client
 
 
 def encode_image_to_base64(image_path):
@@ -120,11 +130,12 @@ def analyze_waste(image_path):
         ]
 
         # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4-vision-preview",
-            messages=messages,
-            max_tokens=1000
-        )
+        with classifier_request('openai'):
+            response = get_client().chat.completions.create(
+                model="gpt-4-vision-preview",
+                messages=messages,
+                max_tokens=1000
+            )
 
         # Clean up captured image
         os.remove(image_path)